@@ -5,7 +5,8 @@ load_dotenv()
 
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, flash, session, send_from_directory, jsonify
+    url_for, flash, session, send_from_directory, send_file, jsonify,
+    Response, stream_with_context, abort
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -14,10 +15,11 @@ from flask_login import (
     login_required, UserMixin, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
-from PIL import Image, ImageEnhance
-import random, zipfile, shutil, datetime, ffmpeg
+import random, shutil, datetime
+import queue, tempfile, threading, json, time, glob
+import click
+from urllib.parse import quote
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 # Import billing blueprints
 from billing import subscription_bp, referral_bp
@@ -25,19 +27,49 @@ from billing import subscription_bp, referral_bp
 from google_drive import start_auth, handle_callback
 
 # Import token.py
-from tokens import deduct_tokens, reset_user_tokens, get_plan_tokens
+from tokens import (
+    deduct_tokens, reset_user_tokens, get_plan_tokens, TOKEN_COSTS,
+    reserve_tokens, commit_reservation, refund_reservation
+)
+from plan_settings import image_settings, video_settings
 
 # ---- Import your image and video processing logic ----
 from image_videoprocessing import process_images_logic, process_videos_logic
+import jobs
+import backups
+import retention
+import cache
+import thumbs
+import dbconfig
+import metrics
+import uploads
+import sampler
+import preview
+import phash
+from probe import check_video
+from zipstream import stream_zip
 
 # -------------------- App & DB Setup --------------------
 app = Flask(__name__)
+# Uploads are written to disk while the body is parsed (see uploads.py)
+app.request_class = uploads.DiskRequest
+app.config['MAX_CONTENT_LENGTH'] = uploads.MAX_UPLOAD_BYTES
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'please_change_me')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = dbconfig.DATABASE_URL
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbconfig.engine_options()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Processing runs on the worker pool (worker.py); set ASYNC_JOBS=0 to run it
+# inside the request instead, e.g. for local development without a worker.
+ASYNC_JOBS = os.getenv('ASYNC_JOBS', '1') == '1'
+
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+dbconfig.init_engine(app, db)
+
+if not ASYNC_JOBS:
+    # No worker.py to run the backup uploader either
+    backups.start_uploader_thread()
 
 # -------------------- Login Manager --------------------
 login_manager = LoginManager()
@@ -56,16 +88,38 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(150), default='New User')
     backup_enabled = db.Column(db.Boolean, default=False)
     dark_mode_enabled = db.Column(db.Boolean, default=False)
-    stripe_customer_id     = db.Column(db.String(100), nullable=True)
-    stripe_subscription_id = db.Column(db.String(100), nullable=True)
+    stripe_customer_id     = db.Column(db.String(100), nullable=True, index=True)
+    stripe_subscription_id = db.Column(db.String(100), nullable=True, index=True)
     plan                   = db.Column(db.String(50), default='free')
     tokens                 = db.Column(db.Integer, default=0)
     referral_code   = db.Column(db.String(20), unique=True, nullable=True)
-    referred_by_id  = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    referred_by_id  = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     referrals       = db.relationship(
         'User', backref=db.backref('referrer', remote_side=[id]), lazy='dynamic'
     )
 
+class HistoryItem(db.Model):
+    # One row per rendered variant in static/history, so the history page is
+    # an indexed range scan instead of a listdir + stat of the whole folder.
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    filename   = db.Column(db.String(255), nullable=False, index=True)
+    kind       = db.Column(db.String(10), nullable=False)
+    size       = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    job_id     = db.Column(db.String(32), nullable=True)
+    __table_args__ = (db.Index('ix_history_item_user_id_id', 'user_id', 'id'),)
+
+class TokenReservation(db.Model):
+    # Tokens held for one batch from the moment it is accepted (tokens.py)
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount     = db.Column(db.Integer, nullable=False)
+    status     = db.Column(db.String(10), nullable=False, default='reserved')
+    job_id     = db.Column(db.String(32), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    settled_at = db.Column(db.DateTime, nullable=True)
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -173,19 +227,114 @@ def image_processor(): return render_template('image_processor.html')
 def video_processor(): return render_template('video_processor.html')
 
 # -------------------- History & Downloads --------------
+HISTORY_PER_PAGE = 25
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+
+def history_kind(filename):
+    return 'video' if filename.lower().endswith(VIDEO_EXTENSIONS) else 'image'
+
+def history_name(job_id, fn):
+    # static/history is shared by every user and batch: stored names carry
+    # the job, so two uploads of the same filename never overwrite each other
+    return f"{job_id[:8]}_{fn}"
+
+def archive_name(path):
+    # A variant's name inside the zip, without its job tag
+    return os.path.basename(path).split('_', 1)[-1]
+
+def record_history(user_id, paths, job_id=None):
+    # Index freshly written variants. A variant that reuses one of this
+    # user's filenames has replaced that file on disk, so older rows for it go.
+    names = [os.path.basename(p) for p in paths]
+    if not names:
+        return
+    HistoryItem.query.filter(
+        HistoryItem.user_id == user_id, HistoryItem.filename.in_(names)
+    ).delete(synchronize_session=False)
+    for path, fn in zip(paths, names):
+        db.session.add(HistoryItem(
+            user_id=user_id, filename=fn, kind=history_kind(fn),
+            size=os.path.getsize(path), job_id=job_id
+        ))
+    db.session.commit()
+
+def history_page(user_id, before=None, after=None, per_page=HISTORY_PER_PAGE):
+    # Keyset pagination over (user_id, id): newest first, one extra row
+    # tells us whether there is another page. Cost doesn't depend on how
+    # much history exists or which page is shown.
+    q = HistoryItem.query.filter(HistoryItem.user_id == user_id)
+    if after is not None:
+        rows = q.filter(HistoryItem.id > after).order_by(HistoryItem.id.asc()).limit(per_page + 1).all()
+        has_newer = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_older = bool(items) and q.filter(HistoryItem.id < items[-1].id).first() is not None
+    else:
+        if before is not None:
+            q = q.filter(HistoryItem.id < before)
+        rows = q.order_by(HistoryItem.id.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_older = len(rows) > per_page
+        has_newer = before is not None
+    return {
+        'items': items,
+        'newer': items[0].id if items and has_newer else None,
+        'older': items[-1].id if items and has_older else None,
+    }
+
 @app.route('/history')
 @login_required
 def history():
-    page = int(request.args.get('page',1))
-    per_page=25
-    hist_folder='static/history'
-    files=sorted(
-        os.listdir(hist_folder),
-        key=lambda x: os.path.getmtime(os.path.join(hist_folder,x)),
-        reverse=True
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    page = history_page(current_user.id, before=before, after=after)
+    return render_template(
+        'history.html',
+        items=page['items'],
+        newer=page['newer'], older=page['older']
     )
-    total=(len(files)+per_page-1)//per_page
-    return render_template('history.html', files=files[(page-1)*per_page:page*per_page], page=page, total_pages=total)
+
+@app.route('/thumb/<filename>')
+@login_required
+def thumbnail(filename):
+    # Gallery previews. The page links them with ?v=<history id>, so the
+    # browser may keep them for good; the ETag covers reloads and re-renders.
+    src = os.path.join('static/history', os.path.basename(filename))
+    if not os.path.isfile(src):
+        abort(404)
+    try:
+        path = thumbs.make_thumbnail(src)
+    except Exception as e:
+        print(f"Thumbnail for {src} failed: {e}")
+        abort(404)
+    resp = send_file(
+        path, mimetype=thumbs.thumb_mimetype(),
+        conditional=True, etag=True, max_age=thumbs.THUMB_MAX_AGE
+    )
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.cache_control.immutable = True
+    return resp
+
+@app.cli.command('backfill-history')
+@click.option('--user-id', type=int, default=None,
+              help='Owner for the backfilled files; without it they are indexed but not shown to anyone.')
+def backfill_history(user_id):
+    # One-time import of files written to static/history before the index
+    # existed, oldest first so ids keep following creation order.
+    hist_folder = 'static/history'
+    known = {fn for (fn,) in db.session.query(HistoryItem.filename)}
+    entries = sorted(
+        (e for e in os.scandir(hist_folder) if e.is_file() and e.name not in known),
+        key=lambda e: e.stat().st_mtime
+    )
+    for e in entries:
+        st = e.stat()
+        db.session.add(HistoryItem(
+            user_id=user_id, filename=e.name, kind=history_kind(e.name), size=st.st_size,
+            created_at=datetime.datetime.utcfromtimestamp(st.st_mtime)
+        ))
+    db.session.commit()
+    click.echo(f"Indexed {len(entries)} file(s) from {hist_folder}")
 
 @app.route('/download/<filename>')
 @login_required
@@ -196,38 +345,11 @@ def download_file(filename):
 def download_zip(filename):
     return send_from_directory('static/processed_zips', filename, as_attachment=True)
 
-# -------------------- Google Drive Backup -------------
-def upload_to_google_drive(file_path, filename):
-    gauth = GoogleAuth()
-    gauth.LoadCredentialsFile("credentials.json")
-    if gauth.credentials is None:
-        gauth.LocalWebserverAuth()
-    elif gauth.access_token_expired:
-        gauth.Refresh()
-    else:
-        gauth.Authorize()
-    gauth.SaveCredentialsFile("credentials.json")
-
-    drive=GoogleDrive(gauth)
-    folder_list=drive.ListFile({'q': "title='MetadataChangerBackup' and mimeType='application/vnd.google-apps.folder' and trashed=false"}).GetList()
-    if folder_list:
-        folder_id=folder_list[0]['id']
-    else:
-        folder=drive.CreateFile({'title':'MetadataChangerBackup', 'mimeType':'application/vnd.google-apps.folder'})
-        folder.Upload()
-        folder_id=folder['id']
-    f=drive.CreateFile({'title':filename,'parents':[{'id':folder_id}]})
-    f.SetContentFile(file_path)
-    f.Upload()
-
 # -------------------- Image/Video Processing ----------
 def scale_range(min_val,max_val,intensity): 
     return random.uniform(min_val*(intensity/100), max_val*(intensity/100))
 
-@app.route('/process-images', methods=['POST'])
-@login_required
-def process_images():
-    images = request.files.getlist('images')
+def processing_form():
     batch = int(request.form.get('batch_size', 5))
     intensity = int(request.form.get('intensity', 30))
     opts = {
@@ -237,76 +359,530 @@ def process_images():
         'crop': 'crop' in request.form,
         'flip': 'flip_horizontal' in request.form
     }
+    return batch, intensity, opts
+
+def save_uploads(files, folder):
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for f in files:
+        fn = os.path.basename(f.filename)
+        uploads.save_upload(f, os.path.join(folder, fn))
+        names.append(fn)
+    return names
+
+def receive_uploads(files, kind):
+    # Save the uploads where the worker can reach them, under a new job id
+    job_id = jobs.new_job_id()
+    folder = jobs.job_upload_dir(job_id)
+    with metrics.timer('receive', kind=kind, plan=current_user.plan):
+        names = save_uploads(files, folder)
+    return job_id, folder, names
+
+def preflight_videos(folder, names):
+    # Turn away anything we can't render before tokens are even looked at
+    for fn in names:
+        with metrics.timer('probe', kind='video', plan=current_user.plan):
+            error = check_video(os.path.join(folder, fn))
+        if error:
+            return f"{fn}: {error}"
+    return None
+
+def enqueue_batch(kind, job_id, names, batch, intensity, opts, tokens_needed, reservation_id, variants=None):
+    payload = {
+        'files': names, 'batch': batch, 'intensity': intensity,
+        'opts': opts, 'tokens_needed': tokens_needed, 'reservation_id': reservation_id
+    }
+    if variants:
+        payload['variants'] = variants
+    try:
+        jobs.enqueue(kind, payload, user_id=current_user.id, total=len(names) * batch, job_id=job_id)
+    except Exception:
+        refund_reservation(reservation_id, db, User, TokenReservation)
+        raise
+
+    if not ASYNC_JOBS:
+        # No worker pool (e.g. `python app.py`): run it inside this request.
+        job = jobs.claim(job_id=job_id)
+        result = jobs.run_job(job)
+        if result is None:
+            return jsonify({'error': jobs.get_job(job_id)['error'], 'job_id': job_id}), 500
+        return jsonify({'job_id': job_id, **result})
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'tokens_left': current_user.tokens
+    }), 202
+
+def discard_batch(user_id, job_id, paths):
+    # Undo a failed batch: its files, thumbnails, history rows and hashes.
+    # Also whatever the render wrote but never reported before it failed:
+    # stored names carry the job (history_name).
+    paths = sorted(set(paths) | set(glob.glob(os.path.join('static/history', history_name(job_id, '*')))))
+    HistoryItem.query.filter_by(user_id=user_id, job_id=job_id).delete(synchronize_session=False)
+    db.session.commit()
+    names = [os.path.basename(path) for path in paths]
+    phash.forget(user_id, names)
+    for path in paths:
+        for doomed in (path, thumbs.thumb_path(os.path.basename(path))):
+            if os.path.exists(doomed):
+                os.remove(doomed)
+
+def run_batch(job, progress, logic, prefix, settings_for=None):
+    p = job['payload']
+    kind = prefix.rstrip('s')
+    user = db.session.get(User, job['user_id'])
+    plan, backup_enabled = user.plan, user.backup_enabled
+    # Tokens were reserved when the job was accepted; hold no transaction
+    # open while rendering.
+    db.session.commit()
+    folder = jobs.job_upload_dir(job['id'])
+    files = [jobs.StoredUpload(os.path.join(folder, fn), history_name(job['id'], fn)) for fn in p['files']]
     ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    out = os.path.join('processed', ts)
-    os.makedirs(out, exist_ok=True)
+    produced = []
+    hashes = []
 
-    # --- TOKEN CHECK ---
-    tokens_needed = len(images) * batch * 1  # 1 token per image variant
-    if current_user.tokens < tokens_needed:
-        return jsonify({'error': "Not enough tokens", 'tokens_left': current_user.tokens}), 402
+    def on_variant(path):
+        # Per-variant progress for /jobs/<id> and its event stream
+        produced.append(path)
+        progress(done=len(produced), current=os.path.basename(path))
+
+    def on_hash(path, h):
+        hashes.append((os.path.basename(path), h))
+
+    zip_fn = f"{prefix}_{ts}_{job['id'][:8]}.zip"
+    zp = os.path.join('static/processed_zips', zip_fn)
+    try:
+        # --- MAIN PROCESSING ---
+        # Variants are written once, to history; the zip is built from there.
+        progress(stage='processing')
+        logic(
+            files, p['batch'], p['intensity'], p['opts'],
+            out=None,
+            hist_folder='static/history',
+            on_variant=on_variant,
+            on_hash=on_hash,
+            plan=plan,
+            variants=p.get('variants'),
+            **({'settings': settings_for(plan)} if settings_for else {})
+        )
+        with metrics.timer('history_index', kind=kind, plan=plan):
+            record_history(job['user_id'], sorted(produced), job_id=job['id'])
+        # Variants that look alike, within the batch or against earlier ones
+        with metrics.timer('phash_index', kind=kind, plan=plan):
+            near_duplicates = phash.check_and_record(job['user_id'], kind, hashes, job_id=job['id'])
+        progress(stage='thumbnails')
+        with metrics.timer('thumbnails', kind=kind, plan=plan):
+            thumbs.make_thumbnails(produced)
+
+        progress(stage='zipping')
+        with metrics.timer('zip', kind=kind, plan=plan), open(zp, 'wb') as fh:
+            for chunk in stream_zip(sorted(produced), arcname=archive_name):
+                fh.write(chunk)
+    except Exception:
+        # --- REFUND TOKENS --- (the user gets nothing, so nothing stays)
+        db.session.rollback()
+        if 'reservation_id' in p:
+            refund_reservation(p['reservation_id'], db, User, TokenReservation)
+        discard_batch(job['user_id'], job['id'], produced + [zp])
+        raise
+    finally:
+        for f in files:
+            f.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # --- COMMIT TOKENS --- (only once the zip is there to download)
+    if 'reservation_id' in p:
+        commit_reservation(p['reservation_id'], db, User, TokenReservation)
+    else:
+        # Queued before reservations existed: charge the old way
+        deduct_tokens(db.session.get(User, job['user_id']), p['tokens_needed'], db)
+    if backup_enabled:
+        # Uploaded by the backup worker (backups.py); the zip stays for download
+        backups.enqueue_backup(zp, zip_fn, user_id=job['user_id'])
+    return {
+        'zip_filename': zip_fn,
+        'tokens_left': db.session.get(User, job['user_id']).tokens,
+        'near_duplicates': near_duplicates
+    }
+
+class StreamCancelled(Exception):
+    # Raised into the processing logic once a streamed response is abandoned
+    pass
+
+def stream_batch(prefix, job_id, folder, names, batch, intensity, opts, reservation_id, logic, settings_for=None, variants=None):
+    # Render in a background thread and add each variant to the response as
+    # soon as it lands in history: no processed/ dir, no zip left on disk.
+    # The view's DB session is torn down before the body is sent; keep plain
+    # values. The reservation is committed once every variant is rendered
+    # and refunded if the stream ends early; the render then stops at the
+    # next variant. A stopped or failed render leaves nothing behind: what it
+    # wrote goes the way of a failed job (discard_batch).
+    user_id, backup_enabled, plan = current_user.id, current_user.backup_enabled, current_user.plan
+    kind = prefix.rstrip('s')
+    extra = {'settings': settings_for(plan)} if settings_for else {}
+    produced = queue.Queue()
+    hashes = []
+    finished = object()
+    cancel = threading.Event()
+    ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    zip_fn = f"{prefix}_{ts}.zip"
+    # Uploads are already saved: the request's file streams are gone once
+    # the response starts
+    paths = [os.path.join(folder, fn) for fn in names]
+
+    def work():
+        stored = [jobs.StoredUpload(p, history_name(job_id, os.path.basename(p))) for p in paths]
+        made = []
+
+        def on_variant(path):
+            made.append(path)
+            if cancel.is_set():
+                raise StreamCancelled()
+            produced.put(path)
+
+        def discard():
+            # The logic has returned: pool renders still running were waited for
+            with app.app_context():
+                discard_batch(user_id, job_id, made)
 
-    # --- MAIN PROCESSING ---
-    process_images_logic(
-        images, batch, intensity, opts,
-        out=out,
-        hist_folder='static/history'
+        try:
+            logic(
+                stored, batch, intensity, opts,
+                out=None,
+                hist_folder='static/history',
+                on_variant=on_variant,
+                on_hash=lambda path, h: hashes.append((os.path.basename(path), h)),
+                plan=plan,
+                variants=variants,
+                **extra
+            )
+            produced.put(finished)
+        except StreamCancelled:
+            discard()
+        except Exception as e:
+            discard()
+            produced.put(e)
+        finally:
+            for f in stored:
+                f.close()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def rendered():
+        threading.Thread(target=work, daemon=True).start()
+        written = []
+        while True:
+            item = produced.get()
+            if item is finished:
+                # --- COMMIT TOKENS ---
+                commit_reservation(reservation_id, db, User, TokenReservation)
+                with metrics.timer('history_index', kind=kind, plan=plan):
+                    record_history(user_id, sorted(written), job_id=job_id)
+                # Indexed for later batches; the zip is already on its way
+                with metrics.timer('phash_index', kind=kind, plan=plan):
+                    phash.check_and_record(user_id, kind, hashes, job_id=job_id)
+                return
+            if isinstance(item, Exception):
+                raise item
+            written.append(item)
+            yield item
+
+    def generate():
+        # Backups need the archive as a file; tee the stream into one
+        # (kept in the backup spool, where the uploader picks it up later)
+        backup = None
+        if backup_enabled:
+            os.makedirs(backups.BACKUP_SPOOL_FOLDER, exist_ok=True)
+            backup = tempfile.NamedTemporaryFile(suffix='.zip', dir=backups.BACKUP_SPOOL_FOLDER, delete=False)
+        complete = False
+        try:
+            yield from stream_zip(rendered(), tee=backup, arcname=archive_name)
+            complete = True
+        finally:
+            if not complete:
+                # Client gone (or a render failed): stop rendering
+                cancel.set()
+                # --- REFUND TOKENS --- (no-op once the batch was committed)
+                refund_reservation(reservation_id, db, User, TokenReservation)
+            if backup:
+                backup.close()
+                if complete:
+                    backups.enqueue_backup(backup.name, zip_fn, user_id=user_id, remove=True)
+                else:
+                    os.remove(backup.name)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{zip_fn}"'}
     )
 
-    # --- DEDUCT TOKENS ---
-    deduct_tokens(current_user, tokens_needed, db)
+@jobs.on_abandon('images')
+@jobs.on_abandon('videos')
+def abandon_batch(job):
+    # Its worker died on every attempt (jobs.recover): the tokens go back and
+    # whatever the render wrote goes, as for a batch that failed
+    p = job['payload']
+    if 'reservation_id' in p:
+        refund_reservation(p['reservation_id'], db, User, TokenReservation)
+    discard_batch(job['user_id'], job['id'], [])
+    shutil.rmtree(jobs.job_upload_dir(job['id']), ignore_errors=True)
+
+@jobs.handler('images')
+def run_images_job(job, progress):
+    return run_batch(job, progress, process_images_logic, 'images', image_settings)
+
+@jobs.handler('videos')
+def run_videos_job(job, progress):
+    return run_batch(job, progress, process_videos_logic, 'videos', video_settings)
 
-    zip_fn = f"images_{ts}.zip"
-    zp = os.path.join('static/processed_zips', zip_fn)
-    with zipfile.ZipFile(zp, 'w') as zf:
-        for f in os.listdir(out):
-            zf.write(os.path.join(out, f), arcname=f)
-    shutil.rmtree(out)
-    if current_user.backup_enabled:
-        upload_to_google_drive(zp, zip_fn)
-    return jsonify({'zip_filename': zip_fn, 'tokens_left': current_user.tokens})
+@app.route('/process-images', methods=['POST'])
+@login_required
+def process_images():
+    images = request.files.getlist('images')
+    batch, intensity, opts = processing_form()
+    try:
+        variants = previewed_variants('images', batch, intensity, opts)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job_id, folder, names = receive_uploads(images, 'image')
+
+    # --- RESERVE TOKENS ---
+    tokens_needed = len(images) * batch * TOKEN_COSTS['image']
+    reservation_id = reserve_tokens(current_user.id, tokens_needed, db, User, TokenReservation, job_id)
+    if reservation_id is None:
+        shutil.rmtree(folder, ignore_errors=True)
+        return jsonify({'error': "Not enough tokens", 'tokens_left': current_user.tokens}), 402
+
+    if 'stream' in request.form:
+        return stream_batch('images', job_id, folder, names, batch, intensity, opts, reservation_id, process_images_logic, image_settings, variants)
+    return enqueue_batch('images', job_id, names, batch, intensity, opts, tokens_needed, reservation_id, variants)
 
 @app.route('/process-videos',methods=['POST'])
 @login_required
 def process_videos():
     vids = request.files.getlist('videos')
-    batch = int(request.form.get('batch_size', 5))
-    intensity = int(request.form.get('intensity', 30))
-    opts = {
-        'contrast':'adjust_contrast' in request.form,
-        'brightness':'adjust_brightness' in request.form,
-        'rotate':'rotate' in request.form,
-        'crop':'crop' in request.form,
-        'flip':'flip_horizontal' in request.form
-    }
-    ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    out = os.path.join('processed', ts)
-    os.makedirs(out, exist_ok=True)
-
-    # --- TOKEN CHECK ---
-    tokens_needed = len(vids) * batch * 2  # 2 tokens per video variant
-    if current_user.tokens < tokens_needed:
+    batch, intensity, opts = processing_form()
+    try:
+        variants = previewed_variants('videos', batch, intensity, opts)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # --- PRE-FLIGHT ---
+    # Saving is a hardlink of the parser's temp file; probing reads headers
+    job_id, folder, names = receive_uploads(vids, 'video')
+    error = preflight_videos(folder, names)
+    if error:
+        shutil.rmtree(folder, ignore_errors=True)
+        return jsonify({'error': error}), 415
+
+    # --- RESERVE TOKENS ---
+    tokens_needed = len(vids) * batch * TOKEN_COSTS['video']
+    reservation_id = reserve_tokens(current_user.id, tokens_needed, db, User, TokenReservation, job_id)
+    if reservation_id is None:
+        shutil.rmtree(folder, ignore_errors=True)
         return jsonify({'error': "Not enough tokens", 'tokens_left': current_user.tokens}), 402
 
-    # --- MAIN PROCESSING ---
-    process_videos_logic(
-        vids, batch, intensity, opts,
-        out=out,
-        hist_folder='static/history'
+    if 'stream' in request.form:
+        return stream_batch('videos', job_id, folder, names, batch, intensity, opts, reservation_id, process_videos_logic, video_settings, variants)
+    return enqueue_batch('videos', job_id, names, batch, intensity, opts, tokens_needed, reservation_id, variants)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': e.description or "Upload too large"}), 413
+
+# -------------------- Previews --------------------
+# Free, low-resolution renders of a batch's sampled variants (preview.py).
+# The response carries the variants and a signed preview_token; posting the
+# token with the processing form renders exactly those variants.
+preview_tokens = URLSafeTimedSerializer(app.secret_key, salt='preview')
+PREVIEW_WAIT_POLL = 0.05
+
+def previewed_variants(kind, batch, intensity, opts):
+    # The variants of the preview this form commits, or None to sample anew
+    token = request.form.get('preview_token')
+    if not token:
+        return None
+    try:
+        chosen = preview_tokens.loads(token, max_age=preview.PREVIEW_TTL)
+    except BadSignature:
+        raise ValueError("Preview expired, preview again or process without it")
+    if chosen['user_id'] != current_user.id or chosen['kind'] != kind:
+        raise ValueError("Invalid preview")
+    if (chosen['batch'], chosen['intensity'], chosen['opts']) != (batch, intensity, opts):
+        raise ValueError("Settings changed since the preview, preview again")
+    return chosen['variants']
+
+def wait_for_job(job_id, timeout):
+    deadline = time.monotonic() + timeout
+    job = jobs.get_job(job_id)
+    while job['status'] not in (jobs.DONE, jobs.FAILED) and time.monotonic() < deadline:
+        time.sleep(PREVIEW_WAIT_POLL)
+        job = jobs.get_job(job_id)
+    return job
+
+def run_preview(kind, files):
+    batch, intensity, opts = processing_form()
+    job_id, folder, names = receive_uploads(files, kind.rstrip('s'))
+    if kind == 'videos':
+        error = preflight_videos(folder, names)
+        if error:
+            shutil.rmtree(folder, ignore_errors=True)
+            return jsonify({'error': error}), 415
+
+    # Sampled here, once for every file, so the token can carry them
+    space = sampler.IMAGE_SPACE if kind == 'images' else sampler.VIDEO_SPACE
+    with metrics.timer('sample', kind=kind.rstrip('s'), plan=current_user.plan):
+        variants = sampler.sample_variants(batch, opts, intensity, space, sampler.make_rng())
+    token = preview_tokens.dumps({
+        'user_id': current_user.id, 'kind': kind, 'batch': batch,
+        'intensity': intensity, 'opts': opts, 'variants': variants
+    })
+    payload = {'kind': kind, 'files': names, 'variants': variants, 'opts': opts}
+    jobs.enqueue('preview', payload, user_id=current_user.id, total=len(names) * batch,
+                 queue=preview.PREVIEW_QUEUE, job_id=job_id)
+    if not ASYNC_JOBS:
+        jobs.run_job(jobs.claim(job_id=job_id))
+
+    # Previews take well under a second: answer with them rather than a job id
+    job = wait_for_job(job_id, preview.PREVIEW_TIMEOUT)
+    body = {'job_id': job_id, 'variants': variants, 'preview_token': token, 'tokens_left': current_user.tokens}
+    if job['status'] == jobs.FAILED:
+        return jsonify({**body, 'error': job['error']}), 500
+    if job['status'] != jobs.DONE:
+        return jsonify({**body, 'status_url': url_for('job_status', job_id=job_id)}), 202
+    return jsonify({**body, **job['result']})
+
+@jobs.handler('preview')
+def run_preview_job(job, progress):
+    p = job['payload']
+    folder = jobs.job_upload_dir(job['id'])
+    out = os.path.join(preview.PREVIEW_FOLDER, job['id'])
+    plan = db.session.get(User, job['user_id']).plan
+    db.session.commit()
+    try:
+        with metrics.timer('preview', kind=p['kind'].rstrip('s'), plan=plan):
+            rendered = preview.render_previews(
+                p['kind'], [os.path.join(folder, fn) for fn in p['files']], p['variants'], p['opts'], out
+            )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    # {filename: [[still URL, ...] per variant]}
+    return {'previews': {
+        fn: [['/' + quote(path.replace(os.sep, '/')) for path in stills] for stills in per_variant]
+        for fn, per_variant in rendered.items()
+    }}
+
+@app.route('/preview-images', methods=['POST'])
+@login_required
+def preview_images():
+    return run_preview('images', request.files.getlist('images'))
+
+@app.route('/preview-videos', methods=['POST'])
+@login_required
+def preview_videos():
+    return run_preview('videos', request.files.getlist('videos'))
+
+# -------------------- Jobs --------------------
+def get_own_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job['user_id'] != current_user.id:
+        return None
+    return job
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.public_view(job))
+
+JOB_EVENTS_POLL = float(os.getenv('JOB_EVENTS_POLL', 0.5))
+JOB_EVENTS_KEEPALIVE = float(os.getenv('JOB_EVENTS_KEEPALIVE', 15))
+# One stream never outlives this (under gunicorn's worker timeout); the
+# browser's EventSource reconnects and picks up where it left off.
+JOB_EVENTS_MAX_SECONDS = float(os.getenv('JOB_EVENTS_MAX_SECONDS', 60))
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    # Server-Sent Events: a 'progress' event whenever the job moves (variants
+    # done / total, current file, ETA, tokens left), then one 'done' or
+    # 'failed' event and the stream ends. Comment lines keep idle proxies
+    # from cutting the connection; EventSource reconnects if one does anyway.
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    tokens_left = current_user.tokens
+
+    def generate():
+        yield "retry: 2000\n\n"
+        last = None
+        last_sent = started = time.monotonic()
+        while time.monotonic() - started < JOB_EVENTS_MAX_SECONDS:
+            job = jobs.get_job(job_id)
+            view = {**jobs.public_view(job), 'tokens_left': tokens_left}
+            if job['status'] in (jobs.DONE, jobs.FAILED):
+                if job['result'] and 'tokens_left' in job['result']:
+                    view['tokens_left'] = job['result']['tokens_left']
+                yield sse('done' if job['status'] == jobs.DONE else 'failed', view)
+                return
+            state = (job['status'], job['stage'], job['done'], job['total'])
+            if state != last:
+                yield sse('progress', view)
+                last, last_sent = state, time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(JOB_EVENTS_POLL)
+
+    return Response(
+        generate(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
-    # --- DEDUCT TOKENS ---
-    deduct_tokens(current_user, tokens_needed, db)
+@app.route('/jobs/<job_id>/result')
+@login_required
+def job_result(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == jobs.FAILED:
+        return jsonify({'error': job['error'], 'status': job['status']}), 500
+    if job['status'] != jobs.DONE:
+        return jsonify({'status': job['status'], 'done': job['done'], 'total': job['total']}), 409
+    return send_from_directory('static/processed_zips', job['result']['zip_filename'], as_attachment=True)
+
+@app.route('/cache-stats')
+@login_required
+def cache_stats():
+    return jsonify(cache.stats())
 
-    zip_fn = f"videos_{ts}.zip"
-    zp = os.path.join('static/processed_zips', zip_fn)
-    with zipfile.ZipFile(zp, 'w') as zf:
-        for f in os.listdir(out):
-            zf.write(os.path.join(out, f), arcname=f)
-    shutil.rmtree(out)
-    if current_user.backup_enabled:
-        upload_to_google_drive(zp, zip_fn)
-    return jsonify({'zip_filename': zip_fn, 'tokens_left': current_user.tokens})
+@app.route('/retention-stats')
+@login_required
+def retention_stats():
+    return jsonify(retention.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target; METRICS_TOKEN, when set, is required as a bearer token
+    if metrics.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {metrics.METRICS_TOKEN}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('sweep')
+@click.option('--startup', is_flag=True, help='Walk every folder to the end first, as the worker does on start.')
+def sweep(startup):
+    # One retention pass, e.g. from cron when worker.py isn't running
+    if startup:
+        retention.cleanup_orphans()
+    retention.sweep_once(app, retention.folder_sweepers(), db, User, HistoryItem)
+    click.echo(retention.stats())
 
 # -------------------- OAuth Routes --------------------
 @app.route('/oauth2start')
@@ -0,0 +1,218 @@
+# backups.py
+# Google Drive backups, off the request path. Finished archives are queued
+# as 'backup' jobs (jobs.py, queue 'backup'); one uploader drains them,
+# keeping the authorized Drive client and the backup folder id between
+# uploads, sending files as resumable chunked uploads and retrying with
+# backoff. Small archives waiting at the same time go up as one bundle.
+# Set DRIVE_FAKE_DIR to upload into a local folder instead (fake_drive.py).
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import datetime
+import threading
+import multiprocessing
+import jobs
+import metrics
+
+BACKUP_QUEUE = 'backup'
+BACKUP_FOLDER_NAME = 'MetadataChangerBackup'
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+DRIVE_CREDENTIALS_FILE = os.getenv('DRIVE_CREDENTIALS_FILE', 'credentials.json')
+DRIVE_FAKE_DIR = os.getenv('DRIVE_FAKE_DIR')
+
+# Resumable upload chunk; Drive wants a multiple of 256 KiB
+BACKUP_CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_MB', 8)) * 1024 * 1024
+BACKUP_MAX_RETRIES = int(os.getenv('BACKUP_MAX_RETRIES', 5))
+BACKUP_RETRY_BASE = float(os.getenv('BACKUP_RETRY_BASE', 1.0))
+# Up to BACKUP_BATCH_SIZE queued archives are taken at once; those under
+# BACKUP_SMALL_MB are zipped together into a single upload.
+BACKUP_BATCH_SIZE = int(os.getenv('BACKUP_BATCH_SIZE', 10))
+BACKUP_SMALL_BYTES = int(os.getenv('BACKUP_SMALL_MB', 20)) * 1024 * 1024
+BACKUP_SPOOL_FOLDER = os.path.join('uploads', 'backups')
+
+def enqueue_backup(path, filename, user_id=None, remove=False):
+    # remove: the file is ours to delete once it is safely on Drive
+    return jobs.enqueue(
+        'backup', {'path': path, 'filename': filename, 'remove': remove},
+        user_id=user_id, total=1, queue=BACKUP_QUEUE
+    )
+
+# -------------------- Drive client --------------------
+def load_credentials():
+    # credentials.json as saved by PyDrive (oauth2client) or google-auth
+    from google.oauth2.credentials import Credentials
+    with open(DRIVE_CREDENTIALS_FILE) as f:
+        info = json.load(f)
+    return Credentials(
+        token=info.get('token') or info.get('access_token'),
+        refresh_token=info.get('refresh_token'),
+        token_uri=info.get('token_uri', 'https://oauth2.googleapis.com/token'),
+        client_id=info.get('client_id'),
+        client_secret=info.get('client_secret'),
+        scopes=SCOPES,
+    )
+
+def build_service():
+    if DRIVE_FAKE_DIR:
+        from fake_drive import FakeDriveService
+        return FakeDriveService(DRIVE_FAKE_DIR), None
+    from googleapiclient.discovery import build
+    from google.auth.transport.requests import Request
+    creds = load_credentials()
+    if not creds.valid:
+        creds.refresh(Request())
+    return build('drive', 'v3', credentials=creds, cache_discovery=False), creds
+
+def is_retryable(e):
+    from googleapiclient.errors import HttpError
+    from google.auth.exceptions import TransportError
+    if isinstance(e, HttpError):
+        return e.resp.status in (408, 429, 500, 502, 503, 504)
+    return isinstance(e, (OSError, TimeoutError, TransportError))
+
+def with_retries(fn, *args):
+    # Exponential backoff with jitter: 1s, 2s, 4s, ... (BACKUP_RETRY_BASE)
+    for attempt in range(BACKUP_MAX_RETRIES + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == BACKUP_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = BACKUP_RETRY_BASE * 2 ** attempt * (0.5 + random.random())
+            print(f"Drive call failed ({e}); retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+
+class DriveClient:
+    # One authorized service and folder lookup for many uploads
+    def __init__(self, factory=build_service):
+        self.factory = factory
+        self._service = None
+        self._creds = None
+        self._folder_id = None
+
+    def service(self):
+        if self._service is None or (self._creds is not None and not self._creds.valid):
+            self._service, self._creds = self.factory()
+        return self._service
+
+    def folder_id(self):
+        if self._folder_id is None:
+            self._folder_id = with_retries(self._find_or_create_folder)
+        return self._folder_id
+
+    def _find_or_create_folder(self):
+        files = self.service().files()
+        found = files.list(
+            q=f"name='{BACKUP_FOLDER_NAME}' and mimeType='{FOLDER_MIME}' and trashed=false",
+            fields='files(id)'
+        ).execute().get('files', [])
+        if found:
+            return found[0]['id']
+        return files.create(body={'name': BACKUP_FOLDER_NAME, 'mimeType': FOLDER_MIME}, fields='id').execute()['id']
+
+    def upload(self, path, filename):
+        return with_retries(self._upload, path, filename)
+
+    def _upload(self, path, filename):
+        from googleapiclient.http import MediaFileUpload
+        media = MediaFileUpload(path, mimetype='application/zip', chunksize=BACKUP_CHUNK_SIZE, resumable=True)
+        request = self.service().files().create(
+            body={'name': filename, 'parents': [self.folder_id()]},
+            media_body=media, fields='id'
+        )
+        response = None
+        while response is None:
+            # Each chunk is retried on its own; the upload resumes, not restarts
+            _, response = request.next_chunk(num_retries=BACKUP_MAX_RETRIES)
+        return response['id']
+
+    def reset(self):
+        # After a failure the cached service/folder may be what's broken
+        self._service = self._creds = self._folder_id = None
+
+# -------------------- Uploader --------------------
+def bundle(batch, dest):
+    # The archives are already compressed, so they are stored as-is
+    with zipfile.ZipFile(dest, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for job in batch:
+            zf.write(job['payload']['path'], job['payload']['filename'])
+    return dest
+
+def settle(job, file_id=None, error=None):
+    p = job['payload']
+    if error is not None:
+        jobs.fail(job['id'], error)
+        return
+    jobs.finish(job['id'], {'file_id': file_id})
+    if p.get('remove') and os.path.exists(p['path']):
+        os.remove(p['path'])
+
+def upload_group(client, group):
+    if len(group) == 1:
+        p = group[0]['payload']
+        return client.upload(p['path'], p['filename'])
+    os.makedirs(BACKUP_SPOOL_FOLDER, exist_ok=True)
+    ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    name = f"backup_bundle_{ts}_{len(group)}.zip"
+    path = bundle(group, os.path.join(BACKUP_SPOOL_FOLDER, f"{group[0]['id']}.zip"))
+    try:
+        return client.upload(path, name)
+    finally:
+        os.remove(path)
+
+def upload_batch(client, batch):
+    missing = [j for j in batch if not os.path.exists(j['payload']['path'])]
+    for job in missing:
+        settle(job, error='Archive no longer on disk')
+    batch = [j for j in batch if j not in missing]
+    small = [j for j in batch if os.path.getsize(j['payload']['path']) < BACKUP_SMALL_BYTES]
+    singles = [j for j in batch if j not in small] if len(small) > 1 else batch
+    groups = [[j] for j in singles]
+    if len(small) > 1:
+        groups.append(small)
+    for group in groups:
+        try:
+            # kind is left empty: it is the media kind everywhere else
+            with metrics.timer('drive_upload' if len(group) == 1 else 'drive_upload_bundle'):
+                file_id = upload_group(client, group)
+        except Exception as e:
+            print(f"Backup upload failed: {e}", file=sys.stderr)
+            client.reset()
+            for job in group:
+                settle(job, error=str(e) or e.__class__.__name__)
+            continue
+        for job in group:
+            settle(job, file_id=file_id)
+
+def run_uploader(client=None, once=False):
+    client = client or DriveClient()
+    while True:
+        batch = []
+        while len(batch) < max(1, BACKUP_BATCH_SIZE):
+            job = jobs.claim(BACKUP_QUEUE)
+            if job is None:
+                break
+            batch.append(job)
+        if batch:
+            upload_batch(client, batch)
+            metrics.flush()
+        elif once:
+            return
+        else:
+            time.sleep(jobs.JOB_POLL_INTERVAL)
+
+def start_uploader():
+    # Its own process next to the job workers (worker.py)
+    p = multiprocessing.Process(target=run_uploader, daemon=True)
+    p.start()
+    return p
+
+def start_uploader_thread():
+    # Without worker.py (ASYNC_JOBS=0) the web process uploads in the background
+    t = threading.Thread(target=run_uploader, daemon=True)
+    t.start()
+    return t
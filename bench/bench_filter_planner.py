@@ -0,0 +1,140 @@
+# bench/bench_filter_planner.py
+# Checks the filter planner (filter_plan.py) against the naive operation
+# order and reports what it saves.
+#   python bench/bench_filter_planner.py --variants 20 --min-psnr 40
+# Images: image_engine.render as planned vs tone-mapping the whole source
+# first; the outputs must match exactly. Video: the naive eq -> rotate ->
+# crop -> scale -> hflip chain vs the planned chain on a synthetic clip, in
+# one ffmpeg run per variant that splits the input and compares both
+# branches with the psnr filter (must stay above --min-psnr), plus the
+# time of each chain alone and the pixel operations of each. Exits
+# non-zero when a comparison falls outside its tolerance.
+import os
+import re
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PROCESSING_VERBOSE', '0')
+import numpy as np
+import ffmpeg
+import sampler
+import image_engine
+import filter_plan
+from synthetic import OPTS, make_image, make_video
+
+OPTION_SETS = {
+    'all': OPTS,
+    'tone+crop': {**OPTS, 'rotate': False},
+    'rotate+crop': {**OPTS, 'contrast': False, 'brightness': False},
+}
+
+def sample(n, seed, space):
+    return sampler.sample_variants(n, OPTS, 100, space, sampler.make_rng(seed))
+
+def check_images(size, mode, variants):
+    source = image_engine.Source(make_image(size, mode))
+    rows = []
+    for name, opts in OPTION_SETS.items():
+        worst = 0
+        planned_s = naive_s = 0.0
+        src_px = out_px = 0
+        for v in variants:
+            t0 = time.perf_counter()
+            planned = image_engine.render(source, v, opts)
+            planned_s += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            toned = image_engine.apply_lut(source.arr, image_engine.tone_lut(source, v[0], v[1], opts))
+            naive = image_engine.render(source, v, opts, arr=toned)
+            naive_s += time.perf_counter() - t0
+            worst = max(worst, int(np.abs(planned.astype(int) - naive.astype(int)).max()))
+            src_px += source.width * source.height
+            out_px += planned.shape[0] * planned.shape[1]
+        rows.append({'kind': 'image', 'mode': mode, 'size': f"{size[0]}x{size[1]}", 'opts': name,
+                     'max_abs_diff': worst, 'naive_ms': 1000 * naive_s / len(variants),
+                     'planned_ms': 1000 * planned_s / len(variants),
+                     'tone_pixels_saved': 1 - out_px / src_px})
+    return rows
+
+def chain(st, steps):
+    for name, args, kwargs in steps:
+        st = st.filter(name, *args, **kwargs)
+    return st
+
+def psnr(src, naive, planned):
+    branches = ffmpeg.input(src).video.filter_multi_output('split', 2)
+    cmp = ffmpeg.filter([chain(branches[0], naive), chain(branches[1], planned)], 'psnr')
+    err = ffmpeg.output(cmp, '-', f='null').run(capture_stderr=True)[1].decode()
+    m = re.search(r'average:(\S+)', err)
+    return float('inf') if m.group(1) == 'inf' else float(m.group(1))
+
+def time_chain(src, steps):
+    t0 = time.perf_counter()
+    ffmpeg.output(chain(ffmpeg.input(src).video, steps), '-', f='null').run(quiet=True)
+    return time.perf_counter() - t0
+
+def check_video(src, w, h, variants):
+    rows = []
+    for name, opts in OPTION_SETS.items():
+        for v in variants:
+            naive = filter_plan.naive_video(v, opts, w, h)
+            planned = filter_plan.plan_video(v, opts, w, h)
+            no_upscale = filter_plan.plan_video(v, opts, w, h, upscale=False)
+            naive_ops = filter_plan.pixel_ops(naive, w, h)
+            rows.append({
+                'kind': 'video', 'size': f"{w}x{h}", 'opts': name, 'variant': [round(x, 4) for x in v[:4]] + [v[4]],
+                'psnr_db': psnr(src, naive, planned),
+                'naive_s': time_chain(src, naive), 'planned_s': time_chain(src, planned),
+                'pixel_ops_saved': 1 - filter_plan.pixel_ops(planned, w, h) / naive_ops,
+                'pixel_ops_saved_no_upscale': 1 - filter_plan.pixel_ops(no_upscale, w, h) / naive_ops,
+            })
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--image-size', default='2000x1500')
+    ap.add_argument('--modes', default='RGB,RGBA')
+    ap.add_argument('--video-size', default='1280x720')
+    ap.add_argument('--seconds', type=float, default=3)
+    ap.add_argument('--variants', type=int, default=10)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--min-psnr', type=float, default=40.0)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    failed = False
+    size = tuple(int(x) for x in args.image_size.split('x'))
+    image_variants = sample(args.variants, args.seed, sampler.IMAGE_SPACE)
+    results = []
+    for mode in args.modes.split(','):
+        for r in check_images(size, mode, image_variants):
+            results.append(r)
+            failed |= r['max_abs_diff'] != 0
+            print(f"image {mode:5s} {r['opts']:12s} diff={r['max_abs_diff']:3d}  "
+                  f"{r['naive_ms']:7.1f} -> {r['planned_ms']:7.1f} ms/variant  "
+                  f"LUT pixels -{100 * r['tone_pixels_saved']:.0f}%", flush=True)
+
+    w, h = (int(x) for x in args.video_size.split('x'))
+    video_variants = sample(args.variants, args.seed, sampler.VIDEO_SPACE)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'clip.mp4')
+        make_video(src, args.video_size, args.seconds, audio=False)
+        for r in check_video(src, w, h, video_variants):
+            results.append(r)
+            failed |= r['psnr_db'] < args.min_psnr
+            print(f"video {r['opts']:12s} psnr={r['psnr_db']:6.1f}dB  {r['naive_s']:6.2f} -> {r['planned_s']:6.2f} s  "
+                  f"pixel ops -{100 * r['pixel_ops_saved']:.0f}% "
+                  f"(-{100 * r['pixel_ops_saved_no_upscale']:.0f}% without upscale)", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        print("Planned output differs from the naive order beyond tolerance", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
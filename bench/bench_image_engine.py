@@ -0,0 +1,78 @@
+# bench/bench_image_engine.py
+# PIL enhance chain vs the NumPy engine (per variant and batched).
+#   python bench/bench_image_engine.py --size 4000x3000 --variants 5
+# Each engine runs in a fresh process so peak RSS is comparable. Render
+# time excludes decode and encode. Also reports the pixel difference
+# against the PIL output.
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import OPTS, make_image, variants_for
+
+def run_engine(engine, size, mode, n, queue):
+    import numpy as np
+    import image_engine
+    from image_videoprocessing import pil_variant
+    img = make_image(size, mode)
+    img.load()
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    variants = variants_for(n)
+    t0 = time.perf_counter()
+    if engine == 'pil':
+        outs = []
+        for v in variants:
+            outs.append(np.asarray(pil_variant(img, v, OPTS)))
+    else:
+        source = image_engine.Source(img)
+        if engine == 'numpy-batched':
+            outs = image_engine.render_batch(source, variants, OPTS)
+        else:
+            outs = [image_engine.render(source, v, OPTS) for v in variants]
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    diff = None
+    if engine != 'pil':
+        ref = [np.asarray(pil_variant(img, v, OPTS).convert(source.mode)) for v in variants]
+        d = [np.abs(a.astype(int) - b.astype(int)) for a, b in zip(ref, outs) if a.shape == b.shape]
+        diff = {'mean': float(np.mean([x.mean() for x in d])), 'max': int(max(x.max() for x in d)),
+                'shape_mismatches': len(outs) - len(d)}
+    queue.put({'engine': engine, 'mode': mode, 'size': f"{size[0]}x{size[1]}", 'variants': n,
+               'per_variant_ms': 1000 * elapsed / n, 'peak_rss_mb': peak / 1024,
+               'render_rss_mb': (peak - base_rss) / 1024, 'diff_vs_pil': diff})
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='4000x3000')
+    ap.add_argument('--variants', type=int, default=5)
+    ap.add_argument('--modes', default='RGB,RGBA')
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    size = tuple(int(x) for x in args.size.split('x'))
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for mode in args.modes.split(','):
+        for engine in ('pil', 'numpy', 'numpy-batched'):
+            q = ctx.Queue()
+            p = ctx.Process(target=run_engine, args=(engine, size, mode, args.variants, q))
+            p.start()
+            r = q.get()
+            p.join()
+            results.append(r)
+            diff = r['diff_vs_pil']
+            print(f"{mode:5s} {engine:14s} {r['per_variant_ms']:8.1f} ms/variant  "
+                  f"render RSS +{r['render_rss_mb']:7.1f} MB"
+                  + (f"  diff mean={diff['mean']:.3f} max={diff['max']}" if diff else ''), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# bench/bench_phash.py
+# Perceptual-hash index (phash.py) at history scale.
+#   python bench/bench_phash.py --items 100000 --max-lookup-ms 10
+# Fills a scratch index with --items random hashes for one user, then times:
+#   load       first lookup in a fresh process (whole user read from SQLite)
+#   lookup     a --batch of variants against the batch and the history,
+#              once the user's hashes are in memory (median / p99)
+#   record     check_and_record, lookup plus insert, with refresh
+#   hash       hash_image on a rendered variant, and hash_thumbnails per
+#              thumbnail on a stack of them
+# Planted near-duplicates (a few bits flipped from history entries) must
+# all be found. Exits non-zero when one is missed or the median lookup is
+# slower than --max-lookup-ms.
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+
+USER = 1
+
+def fill(phash, n, seed):
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(64) for _ in range(n)]
+    conn = phash._connect()
+    try:
+        conn.execute('BEGIN')
+        conn.executemany(
+            "INSERT INTO variant_hashes (user_id, kind, filename, hash, job_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(USER, 'image', f"history_{i}.jpg", phash.to_signed(h), None, time.time()) for i, h in enumerate(hashes)]
+        )
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return hashes
+
+def near(h, bits, rng):
+    for b in rng.sample(range(64), bits):
+        h ^= 1 << b
+    return h
+
+def time_ms(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return 1000 * (time.perf_counter() - t0), result
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--items', type=int, default=100000)
+    ap.add_argument('--batch', type=int, default=10)
+    ap.add_argument('--repeat', type=int, default=50)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--max-lookup-ms', type=float, default=10.0)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['PHASH_DB'] = os.path.join(tmp, 'phash.db')
+        import phash
+        rng = random.Random(args.seed + 1)
+        t0 = time.perf_counter()
+        history = fill(phash, args.items, args.seed)
+        fill_s = time.perf_counter() - t0
+
+        conn = phash._connect()
+        try:
+            load_ms, index = time_ms(lambda: phash.user_index(conn, USER, 'image'))
+            lookups, planted_found = [], 0
+            for r in range(args.repeat):
+                items = [(f"new_{r}_{i}.jpg", rng.getrandbits(64)) for i in range(args.batch)]
+                # One planted near-duplicate of a history item per batch
+                target = rng.randrange(args.items)
+                items[0] = (items[0][0], near(history[target], phash.PHASH_THRESHOLD // 2, rng))
+                ms, found = time_ms(lambda: phash.batch_matches(items) + phash.history_matches(
+                    conn, phash.user_index(conn, USER, 'image'), items))
+                lookups.append(ms)
+                planted_found += any(f['file'] == items[0][0] and f['match'] == f"history_{target}.jpg" for f in found)
+        finally:
+            conn.close()
+
+        records = []
+        for r in range(min(args.repeat, 20)):
+            items = [(f"rec_{r}_{i}.jpg", rng.getrandbits(64)) for i in range(args.batch)]
+            records.append(time_ms(lambda: phash.check_and_record(USER, 'image', items))[0])
+
+        from synthetic import make_image
+        img = make_image((1920, 1080), 'RGB')
+        hash_ms = statistics.median(time_ms(lambda: phash.hash_image(img))[0] for _ in range(20))
+        thumbs = np.random.default_rng(0).random((1000, phash.THUMB, phash.THUMB)).astype(np.float32) * 255
+        stack_ms = time_ms(lambda: phash.hash_thumbnails(thumbs))[0] / len(thumbs)
+
+    lookups.sort()
+    result = {
+        'items': args.items, 'batch': args.batch, 'algo': phash.PHASH_ALGO, 'threshold': phash.PHASH_THRESHOLD,
+        'fill_s': fill_s, 'load_ms': load_ms,
+        'lookup_ms_p50': statistics.median(lookups), 'lookup_ms_p99': lookups[int(0.99 * (len(lookups) - 1))],
+        'record_ms_p50': statistics.median(records),
+        'hash_image_1080p_ms': hash_ms, 'hash_per_thumbnail_ms': stack_ms,
+        'planted_found': planted_found, 'planted': args.repeat,
+    }
+    print(f"{args.items} hashes ({phash.PHASH_ALGO}, threshold {phash.PHASH_THRESHOLD} bits), batch of {args.batch}")
+    print(f"  load      {load_ms:8.1f} ms (first lookup in a process)")
+    print(f"  lookup    {result['lookup_ms_p50']:8.2f} ms p50  {result['lookup_ms_p99']:8.2f} ms p99")
+    print(f"  record    {result['record_ms_p50']:8.2f} ms p50 (lookup + insert)")
+    print(f"  hash      {hash_ms:8.2f} ms per 1080p variant, {stack_ms:.4f} ms per thumbnail in a stack")
+    print(f"  planted near-duplicates found: {planted_found}/{args.repeat}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    failed = False
+    if planted_found != args.repeat:
+        print("Missed planted near-duplicates", file=sys.stderr)
+        failed = True
+    if result['lookup_ms_p50'] > args.max_lookup_ms:
+        print(f"Median lookup slower than {args.max_lookup_ms:g} ms", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
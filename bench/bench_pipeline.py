@@ -0,0 +1,240 @@
+# bench/bench_pipeline.py
+# End-to-end benchmark of variant generation: process_images_logic,
+# process_videos_logic and the zip step, over synthetic fixtures, batch sizes
+# and intensity/option profiles.
+#   python bench/bench_pipeline.py --json bench-results.json
+#   python bench/bench_pipeline.py --quick --compare bench-results.json
+# Fixtures are generated locally and deterministically by synthetic.py:
+# JPEGs, RGBA and palette PNGs at several sizes, and short lavfi test videos
+# (testsrc2 + sine) via ffmpeg. Each case runs in a fresh process, working in a scratch
+# directory with the variant cache off and SAMPLER_SEED fixed. Reported per
+# case:
+#   variants_per_s      throughput over all repeats
+#   wall_s              median wall time of one run
+#   latency_p50/p90/max seconds from start until each variant was in history
+#   peak_rss_mb         this process; peak_child_rss_mb the largest pool
+#                       worker or ffmpeg run
+#   zip_mb_per_s        stream_zip over the run's outputs
+# --json writes these with the git revision and knobs; --compare prints the
+# change against an earlier --json file, so regressions show up in review.
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+
+from synthetic import save_image, make_video
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED = '1234'
+
+PROFILES = {
+    'all': {'contrast': True, 'brightness': True, 'rotate': True, 'crop': True, 'flip': True},
+    'tone': {'contrast': True, 'brightness': True, 'rotate': False, 'crop': False, 'flip': False},
+    'geometry': {'contrast': False, 'brightness': False, 'rotate': True, 'crop': True, 'flip': True},
+}
+
+# name -> (kind, size, mode or seconds)
+FIXTURES = {
+    'jpeg_640x480': ('image', (640, 480), 'RGB'),
+    'jpeg_1920x1080': ('image', (1920, 1080), 'RGB'),
+    'jpeg_4000x3000': ('image', (4000, 3000), 'RGB'),
+    'rgba_1920x1080': ('image', (1920, 1080), 'RGBA'),
+    'palette_1024x768': ('image', (1024, 768), 'P'),
+    'video_854x480_3s': ('video', (854, 480), 3),
+    'video_1280x720_3s': ('video', (1280, 720), 3),
+}
+QUICK_FIXTURES = ('jpeg_640x480', 'rgba_1920x1080', 'palette_1024x768', 'video_854x480_3s')
+
+# -------------------- Fixtures --------------------
+def fixture_path(fixture_dir, name):
+    kind = FIXTURES[name][0]
+    ext = {'image': '.jpg' if FIXTURES[name][2] == 'RGB' else '.png', 'video': '.mp4'}[kind]
+    return os.path.join(fixture_dir, name + ext)
+
+def ensure_fixtures(fixture_dir, names):
+    # Generated once and reused: same bytes on every run of this revision
+    os.makedirs(fixture_dir, exist_ok=True)
+    for name in names:
+        path = fixture_path(fixture_dir, name)
+        if os.path.exists(path):
+            continue
+        kind, size, arg = FIXTURES[name]
+        print(f"Generating {path}", flush=True)
+        if kind == 'image':
+            save_image(path, size, arg)
+        else:
+            make_video(path, f"{size[0]}x{size[1]}", arg)
+
+# -------------------- One case --------------------
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def run_case(case, fixture, workdir, repeat, queue):
+    # Runs in a fresh process: environment first, then the app modules
+    os.environ.update({'CACHE_ENABLED': '0', 'SAMPLER_SEED': SEED, 'PROCESSING_VERBOSE': '0'})
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import storage
+    import executor
+    from jobs import StoredUpload
+    from zipstream import stream_zip
+    from image_videoprocessing import process_images_logic, process_videos_logic
+    logic = process_images_logic if case['kind'] == 'image' else process_videos_logic
+    hist = os.path.join(workdir, 'history')
+
+    walls, latencies, zips = [], [], []
+    produced = 0
+    for r in range(repeat):
+        shutil.rmtree(hist, ignore_errors=True)
+        os.makedirs(hist)
+        # process_videos_logic removes its uploads: hand it a link each run
+        upload_dir = os.path.join(workdir, 'uploads', str(r))
+        os.makedirs(upload_dir, exist_ok=True)
+        upload = os.path.join(upload_dir, os.path.basename(fixture))
+        storage.link(fixture, upload)
+        f = StoredUpload(upload)
+        paths = []
+        t0 = time.perf_counter()
+
+        def on_variant(path):
+            latencies.append(time.perf_counter() - t0)
+            paths.append(path)
+        try:
+            logic([f], case['batch'], case['intensity'], dict(PROFILES[case['profile']]),
+                  out=None, hist_folder=hist, on_variant=on_variant)
+        finally:
+            f.close()
+        walls.append(time.perf_counter() - t0)
+        produced += len(paths)
+
+        t1 = time.perf_counter()
+        size = 0
+        for chunk in stream_zip(sorted(paths)):
+            size += len(chunk)
+        zips.append((time.perf_counter() - t1, size))
+
+    # Reap the render pool so its workers count towards RUSAGE_CHILDREN
+    if executor._process_pool is not None:
+        executor._process_pool.shutdown(wait=True)
+    zip_s = sum(t for t, _ in zips)
+    queue.put({
+        **case,
+        'repeat': repeat,
+        'variants': produced,
+        'variants_per_s': produced / sum(walls),
+        'wall_s': statistics.median(walls),
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p90': percentile(latencies, 0.9),
+        'latency_max': max(latencies) if latencies else 0.0,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'zip_mb_per_s': sum(s for _, s in zips) / 1e6 / zip_s if zip_s else 0.0,
+    })
+
+def run_isolated(case, fixture, repeat):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as workdir:
+        q = ctx.Queue()
+        p = ctx.Process(target=run_case, args=(case, fixture, workdir, repeat, q))
+        p.start()
+        p.join()
+        if p.exitcode != 0:
+            return {**case, 'error': f'exit code {p.exitcode}'}
+        return q.get()
+
+# -------------------- Reporting --------------------
+def case_id(r):
+    return f"{r['fixture']}/b{r['batch']}/i{r['intensity']}/{r['profile']}"
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    keys = ('RENDER_WORKERS', 'RENDER_SLOTS', 'IMAGE_ENGINE', 'IMAGE_ENGINE_BATCHED', 'VIDEO_SINGLE_PASS')
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': SEED,
+        'env': {k: os.environ[k] for k in keys if k in os.environ},
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def print_row(r, baseline=None):
+    if 'error' in r:
+        print(f"{case_id(r):44s} FAILED ({r['error']})", flush=True)
+        return
+    line = (f"{case_id(r):44s} {r['variants_per_s']:8.2f} {r['wall_s']:8.3f} {r['latency_p50']:8.3f} "
+            f"{r['latency_p90']:8.3f} {r['peak_rss_mb']:8.1f} {r['peak_child_rss_mb']:8.1f} {r['zip_mb_per_s']:8.1f}")
+    old = (baseline or {}).get(case_id(r))
+    if old and 'error' not in old and old['variants_per_s']:
+        line += f"  {100 * (r['variants_per_s'] / old['variants_per_s'] - 1):+6.1f}% var/s"
+    print(line, flush=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--fixtures', help='comma-separated fixture names (default: all)')
+    ap.add_argument('--batches', default='1,5,10')
+    ap.add_argument('--intensities', default='30,100')
+    ap.add_argument('--profiles', default='all,tone,geometry')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--quick', action='store_true', help='small matrix for a fast check')
+    ap.add_argument('--fixture-dir', default=os.path.join(ROOT, 'bench', 'fixtures'))
+    ap.add_argument('--json', help='write results to this file')
+    ap.add_argument('--compare', help='earlier --json output to compare throughput against')
+    args = ap.parse_args()
+
+    if args.quick:
+        names = list(QUICK_FIXTURES)
+        batches, intensities, profiles, repeat = [5], [30], ['all'], 1
+    else:
+        names = args.fixtures.split(',') if args.fixtures else list(FIXTURES)
+        batches = [int(b) for b in args.batches.split(',')]
+        intensities = [int(i) for i in args.intensities.split(',')]
+        profiles = args.profiles.split(',')
+        repeat = args.repeat
+    ensure_fixtures(args.fixture_dir, names)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {case_id(r): r for r in json.load(f)['results']}
+
+    results = []
+    print(f"{'case':44s} {'var/s':>8s} {'wall_s':>8s} {'p50_s':>8s} {'p90_s':>8s} "
+          f"{'rss_mb':>8s} {'child_mb':>8s} {'zip_MB/s':>8s}")
+    for name in names:
+        for batch in batches:
+            for intensity in intensities:
+                for profile in profiles:
+                    case = {'fixture': name, 'kind': FIXTURES[name][0], 'batch': batch,
+                            'intensity': intensity, 'profile': profile}
+                    r = run_isolated(case, fixture_path(args.fixture_dir, name), repeat)
+                    results.append(r)
+                    print_row(r, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
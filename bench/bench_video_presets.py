@@ -0,0 +1,66 @@
+# bench/bench_video_presets.py
+# x264 preset x source resolution matrix for the video variant encoder, to
+# pick PLAN_VIDEO_SETTINGS defaults by throughput vs output size.
+#   python bench/bench_video_presets.py --sizes 1280x720,1920x1080 --presets veryfast,fast,medium
+# Each cell renders the same variants in single-pass mode and reports wall
+# time, ffmpeg CPU time, encoded frames per second and total output bytes.
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_videoprocessing import render_video_variants_single_pass
+from synthetic import OPTS, FPS, make_video, variants_for
+
+def measure(src, variants, out_dir, w, h, info, settings):
+    outps = [os.path.join(out_dir, f"variant_{i+1}.mp4") for i in range(len(variants))]
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    render_video_variants_single_pass(src, variants, outps, OPTS, w, h, info, settings)
+    wall = time.perf_counter() - t0
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    size = sum(os.path.getsize(p) for p in outps)
+    for p in outps:
+        os.remove(p)
+    return wall, cpu, size
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='854x480,1280x720,1920x1080')
+    ap.add_argument('--presets', default='ultrafast,veryfast,fast,medium')
+    ap.add_argument('--crf', type=int, default=23)
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--variants', type=int, default=3)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    variants = variants_for(args.variants)
+    results = []
+    print(f"{'size':>10s} {'preset':>10s} {'wall_s':>8s} {'cpu_s':>8s} {'fps':>8s} {'MB':>8s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes.split(','):
+            w, h = (int(x) for x in size.split('x'))
+            src = os.path.join(tmp, f'source_{size}.mp4')
+            make_video(src, size, args.seconds)
+            info = {'width': w, 'height': h, 'fps': FPS, 'duration': args.seconds, 'codec': 'h264', 'audio': 'aac'}
+            frames = int(args.seconds * FPS) * args.variants
+            for preset in args.presets.split(','):
+                settings = {'preset': preset, 'crf': args.crf, 'max_dimension': 0, 'max_fps': 0}
+                wall, cpu, out_bytes = measure(src, variants, tmp, w, h, info, settings)
+                results.append({'size': size, 'preset': preset, 'crf': args.crf, 'seconds': args.seconds,
+                                'variants': args.variants, 'wall_s': wall, 'cpu_s': cpu,
+                                'fps': frames / wall, 'bytes': out_bytes})
+                print(f"{size:>10s} {preset:>10s} {wall:8.2f} {cpu:8.2f} {frames / wall:8.1f} "
+                      f"{out_bytes / 1e6:8.2f}", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
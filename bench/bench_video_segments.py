@@ -0,0 +1,96 @@
+# bench/bench_video_segments.py
+# Whole-file single-pass rendering vs segment-parallel rendering
+# (VIDEO_SEGMENT_SECONDS) of one long source, against the number of cores.
+#   python bench/bench_video_segments.py --seconds 600 --cores 1,2,4,8
+# The source is a synthetic testsrc2 + sine clip with a keyframe every
+# --gop seconds. Each run is a fresh process pinned to the first N cores
+# (sched_setaffinity) with RENDER_WORKERS = RENDER_SLOTS = N. Speedup is
+# against the whole-file run on one core and on the same cores.
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+from synthetic import OPTS, make_video, variants_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(mode, cores, src, info, n_variants, segment_seconds, queue):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cores])
+    os.environ.update({
+        'RENDER_WORKERS': str(cores), 'RENDER_SLOTS': str(cores), 'PROCESSING_VERBOSE': '0',
+        'VIDEO_SEGMENT_SECONDS': str(segment_seconds), 'VIDEO_SEGMENT_MIN_DURATION': '0',
+    })
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    # Imported only now: the render knobs are read at import time
+    sys.path.insert(0, ROOT)
+    import image_videoprocessing as P
+    variants = variants_for(n_variants)
+    outps = [os.path.join(workdir, f"variant_{i+1}.mp4") for i in range(n_variants)]
+    render = P.render_video_variants_segmented if mode == 'segments' else P.render_video_variants_single_pass
+    t0 = time.perf_counter()
+    render(src, variants, outps, OPTS, info['width'], info['height'], info, {'preset': 'veryfast', 'crf': 23})
+    wall = time.perf_counter() - t0
+    queue.put({'mode': mode, 'cores': cores, 'wall_s': wall, 'bytes': sum(os.path.getsize(p) for p in outps)})
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def measure(mode, cores, src, info, n_variants, segment_seconds):
+    ctx = multiprocessing.get_context('spawn')
+    q = ctx.Queue()
+    p = ctx.Process(target=run, args=(mode, cores, src, info, n_variants, segment_seconds, q))
+    p.start()
+    r = q.get()
+    p.join()
+    return r
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='1280x720')
+    ap.add_argument('--seconds', type=float, default=600)
+    ap.add_argument('--gop', type=float, default=2, help='seconds between source keyframes')
+    ap.add_argument('--segment-seconds', type=float, default=30)
+    ap.add_argument('--variants', type=int, default=3)
+    ap.add_argument('--cores', default=None, help='comma-separated core counts (default: 1,2,4,... up to all)')
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    if args.cores:
+        cores = [int(c) for c in args.cores.split(',')]
+    else:
+        cores = sorted({min(2 ** k, available) for k in range(available.bit_length() + 1)})
+    w, h = (int(x) for x in args.size.split('x'))
+    info = {'width': w, 'height': h, 'fps': FPS, 'duration': args.seconds, 'codec': 'h264', 'audio': 'aac'}
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        print(f"Generating {args.seconds:g}s {args.size} source", flush=True)
+        make_video(src, args.size, args.seconds, gop=args.gop, preset='veryfast')
+        baseline = None
+        print(f"{'cores':>5s} {'whole_s':>9s} {'segments_s':>10s} {'vs_same':>8s} {'vs_1core':>8s}")
+        for n in cores:
+            whole = measure('whole', n, src, info, args.variants, args.segment_seconds)
+            seg = measure('segments', n, src, info, args.variants, args.segment_seconds)
+            baseline = baseline or whole['wall_s']
+            row = {'cores': n, 'size': args.size, 'seconds': args.seconds, 'variants': args.variants,
+                   'segment_seconds': args.segment_seconds, 'whole_s': whole['wall_s'],
+                   'segments_s': seg['wall_s'], 'speedup_same_cores': whole['wall_s'] / seg['wall_s'],
+                   'speedup_vs_1core_whole': baseline / seg['wall_s'],
+                   'whole_bytes': whole['bytes'], 'segments_bytes': seg['bytes']}
+            results.append(row)
+            print(f"{n:5d} {whole['wall_s']:9.2f} {seg['wall_s']:10.2f} {row['speedup_same_cores']:7.2f}x "
+                  f"{row['speedup_vs_1core_whole']:7.2f}x", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
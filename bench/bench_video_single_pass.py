@@ -0,0 +1,57 @@
+# bench/bench_video_single_pass.py
+# Per-variant ffmpeg runs vs one split-filter run for the whole batch.
+#   python bench/bench_video_single_pass.py --size 1920x1080 --seconds 10 --variants 5
+# Reports wall time and the CPU time of the ffmpeg child processes.
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_videoprocessing import render_video_variants, render_video_variants_single_pass
+from synthetic import OPTS, make_video, variants_for
+
+def measure(render, src, variants, out_dir, w, h):
+    outps = [os.path.join(out_dir, f"variant_{i+1}.mp4") for i in range(len(variants))]
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    render(src, variants, outps, OPTS, w, h)
+    wall = time.perf_counter() - t0
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    for p in outps:
+        os.remove(p)
+    return wall, cpu
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='1920x1080')
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--variants', type=int, default=5)
+    ap.add_argument('--repeat', type=int, default=1)
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+
+    w, h = (int(x) for x in args.size.split('x'))
+    variants = variants_for(args.variants)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        make_video(src, args.size, args.seconds)
+        for label, render in (('per-variant', render_video_variants),
+                              ('single-pass', render_video_variants_single_pass)):
+            for _ in range(args.repeat):
+                wall, cpu = measure(render, src, variants, tmp, w, h)
+                results.append({'mode': label, 'size': args.size, 'seconds': args.seconds,
+                                'variants': args.variants, 'wall_s': wall, 'cpu_s': cpu})
+                print(f"{label:12s} wall={wall:7.2f}s  cpu={cpu:7.2f}s", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# bench/load_db.py
+# Database load test: several worker processes (like gunicorn workers) hammer
+# login, the token reservation a process request makes, and the Stripe
+# webhook against one SQLite file, and report throughput and errors.
+#   python bench/load_db.py --workers 4 --seconds 10            # current settings
+#   python bench/load_db.py --workers 4 --seconds 10 --before   # old defaults
+# --before runs with SQLite's defaults (rollback journal, synchronous=FULL,
+# 5s lock wait) and without the user lookup indexes.
+import os
+import sys
+import time
+import json
+import hmac
+import random
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPS = ('login', 'process', 'webhook')
+WEBHOOK_SECRET = 'whsec_load_test'
+PASSWORD = 'load-test'
+
+def configure(db_path, before):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['STRIPE_WEBHOOK_SECRET'] = WEBHOOK_SECRET
+    if before:
+        os.environ['DB_JOURNAL_MODE'] = 'delete'
+        os.environ['DB_SYNCHRONOUS'] = 'full'
+        os.environ['DB_BUSY_TIMEOUT_MS'] = '5000'
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+def setup(db_path, users, before):
+    configure(db_path, before)
+    import app as A
+    from werkzeug.security import generate_password_hash
+    pw = generate_password_hash(PASSWORD)
+    with A.app.app_context():
+        A.db.create_all()
+        A.db.session.add_all(
+            A.User(email=f'load{i}@example.com', password=pw, tokens=10 ** 6,
+                   stripe_customer_id=f'cus_{i}', stripe_subscription_id=f'sub_{i}')
+            for i in range(users)
+        )
+        A.db.session.commit()
+        if before:
+            for ix in ('ix_user_stripe_customer_id', 'ix_user_stripe_subscription_id', 'ix_user_referred_by_id'):
+                A.db.session.execute(A.db.text(f'DROP INDEX IF EXISTS {ix}'))
+            A.db.session.commit()
+
+def signed_webhook(sub_id):
+    payload = json.dumps({
+        'id': 'evt_load', 'object': 'event', 'type': 'invoice.payment_succeeded',
+        'data': {'object': {'object': 'invoice', 'subscription': sub_id}}
+    })
+    ts = int(time.time())
+    sig = hmac.new(WEBHOOK_SECRET.encode(), f'{ts}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return payload, {'Stripe-Signature': f't={ts},v1={sig}', 'Content-Type': 'application/json'}
+
+def worker(db_path, users, before, seconds, mix, results):
+    configure(db_path, before)
+    import app as A
+    import tokens
+    rng = random.Random(os.getpid())
+    client = A.app.test_client()
+    counts = {op: 0 for op in OPS}
+    errors = {op: 0 for op in OPS}
+    latency = {op: 0.0 for op in OPS}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        op = rng.choices(OPS, weights=mix)[0]
+        i = rng.randrange(users)
+        t0 = time.perf_counter()
+        try:
+            if op == 'login':
+                ok = client.post('/login', data={'email': f'load{i}@example.com', 'password': PASSWORD}).status_code < 400
+            elif op == 'process':
+                # What a process request does to the DB: reserve, then settle
+                with A.app.app_context():
+                    rid = tokens.reserve_tokens(i + 1, 2, A.db, A.User, A.TokenReservation)
+                    ok = rid is not None and tokens.commit_reservation(rid, A.db, A.User, A.TokenReservation)
+            else:
+                payload, headers = signed_webhook(f'sub_{i}')
+                ok = client.post('/subscription/webhook', data=payload, headers=headers).status_code == 200
+        except Exception:
+            ok = False
+        latency[op] += time.perf_counter() - t0
+        counts[op] += 1
+        errors[op] += not ok
+    results.put((counts, errors, latency))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', type=int, default=4)
+    ap.add_argument('--seconds', type=float, default=10)
+    ap.add_argument('--users', type=int, default=200)
+    ap.add_argument('--mix', default='1,4,2', help='relative weights of login,process,webhook')
+    ap.add_argument('--before', action='store_true', help='old SQLite defaults, no lookup indexes')
+    ap.add_argument('--json', help='write results to this file')
+    args = ap.parse_args()
+    mix = [float(x) for x in args.mix.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'load.db')
+        p = multiprocessing.Process(target=setup, args=(db_path, args.users, args.before))
+        p.start()
+        p.join()
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker, args=(db_path, args.users, args.before, args.seconds, mix, results))
+            for _ in range(args.workers)
+        ]
+        for p in procs:
+            p.start()
+        totals = {op: [0, 0, 0.0] for op in OPS}
+        for _ in procs:
+            counts, errors, latency = results.get()
+            for op in OPS:
+                totals[op][0] += counts[op]
+                totals[op][1] += errors[op]
+                totals[op][2] += latency[op]
+        for p in procs:
+            p.join()
+
+    label = 'before' if args.before else 'after'
+    report = []
+    print(f"{label}: {args.workers} workers, {args.seconds:g}s")
+    print(f"{'op':>8s} {'ops/s':>8s} {'errors':>7s} {'avg_ms':>8s}")
+    for op in OPS:
+        n, err, lat = totals[op]
+        report.append({'mode': label, 'op': op, 'ops_per_s': n / args.seconds, 'errors': err,
+                       'avg_ms': 1000 * lat / n if n else 0})
+        print(f"{op:>8s} {n / args.seconds:8.1f} {err:7d} {1000 * lat / n if n else 0:8.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# bench/synthetic.py
+# Synthetic sources and variant parameters shared by the bench scripts.
+# Everything is deterministic (fixed RNG seed, lavfi test sources), so two
+# runs of the same revision measure the same bytes.
+#   from synthetic import OPTS, FPS, variants_for, make_image, save_image, make_video
+import subprocess
+
+OPTS = {'contrast': True, 'brightness': True, 'rotate': True, 'crop': True, 'flip': True}
+FPS = 30
+
+def variants_for(n):
+    # Fixed, distinct parameters so every mode compared does identical filter work
+    return [(0.1 * (i + 1), 0.02 * (i + 1), -10 + 5 * i, 0.1 + 0.02 * i, i % 2 == 1) for i in range(n)]
+
+def make_image(size, mode='RGB'):
+    import numpy as np
+    import cv2
+    from PIL import Image
+    w, h = size
+    rng = np.random.default_rng(0)
+    # Smooth noise: compresses like a photo, unlike raw noise
+    arr = cv2.resize((rng.random((h // 8, w // 8, 3)) * 255).astype(np.uint8), (w, h))
+    img = Image.fromarray(arr)
+    if mode == 'RGBA':
+        alpha = cv2.resize((rng.random((h // 16, w // 16)) * 255).astype(np.uint8), (w, h))
+        img.putalpha(Image.fromarray(alpha))
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.ADAPTIVE, colors=64)
+        img.info['transparency'] = 0
+    elif mode != 'RGB':
+        img = img.convert(mode)
+    return img
+
+def save_image(path, size, mode='RGB'):
+    # JPEG for RGB, PNG (keeping the transparency) for everything else
+    img = make_image(size, mode)
+    if mode == 'RGB':
+        img.save(path, 'JPEG', quality=90)
+    elif mode == 'P':
+        img.save(path, 'PNG', transparency=0)
+    else:
+        img.save(path, 'PNG')
+
+def make_video(path, size, seconds, audio=True, gop=None, preset=None, metadata=None, stream_metadata=None):
+    # testsrc2 (+ a sine tone) as H.264/AAC. size is 'WxH'; gop in seconds
+    # between keyframes; metadata / stream_metadata are key -> value tags for
+    # the container / the video stream.
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={FPS}']
+    if audio:
+        cmd += ['-f', 'lavfi', '-i', 'sine=frequency=440']
+    cmd += ['-t', str(seconds), '-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+    if preset:
+        cmd += ['-preset', preset]
+    if gop:
+        cmd += ['-g', str(int(gop * FPS))]
+    if audio:
+        cmd += ['-c:a', 'aac', '-shortest']
+    for key, value in (metadata or {}).items():
+        cmd += ['-metadata', f'{key}={value}']
+    for key, value in (stream_metadata or {}).items():
+        cmd += ['-metadata:s:v:0', f'{key}={value}']
+    cmd.append(path)
+    subprocess.run(cmd, check=True)
@@ -0,0 +1,276 @@
+# cache.py
+# Content-addressed store for uploaded video sources and rendered variants.
+# Keys are SHA-256 hashes: of the source bytes for sources, and of the
+# source hash plus every rendering parameter for variant sets. Entries are
+# tracked in a small SQLite index and evicted least-recently-used first once
+# the store grows past CACHE_MAX_BYTES. A job reading a stored source holds
+# a shared flock on it (hold()) and eviction skips entries it cannot lock
+# exclusively, so a source stashed by one job is never removed under it by
+# another job's store; the lock goes away with the process.
+import os
+import json
+import time
+import glob
+import fcntl
+import shutil
+import sqlite3
+import storage
+import hashlib
+
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') == '1'
+CACHE_FOLDER = os.getenv('CACHE_FOLDER', 'cache')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 5 * 1024 ** 3))
+CHUNK_SIZE = 1024 * 1024
+# Perceptual hashes (phash.py) of a variant set, next to its files
+HASHES_FILE = 'hashes.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key         TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def _connect():
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_FOLDER, 'index.db'), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def _count(conn, name):
+    conn.execute(
+        "INSERT INTO counters (name, value) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,)
+    )
+
+# -------------------- Hashing --------------------
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_stream(stream):
+    # Hashes a seekable stream and rewinds it for whoever reads it next
+    h = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+def variants_key(source_hash, kind, **params):
+    blob = json.dumps({'source': source_hash, 'kind': kind, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+# -------------------- Sources --------------------
+def source_path(source_hash, ext):
+    return os.path.join(CACHE_FOLDER, 'sources', source_hash + ext.lower())
+
+def lookup_source(source_hash, ext, held=None):
+    # Path of an already stored source, or None. With held (an ExitStack)
+    # the source is held until that closes; one evicted meanwhile is a miss.
+    path = source_path(source_hash, ext)
+    conn = _connect()
+    try:
+        if os.path.exists(path) and (held is None or hold(path, held)):
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), 'source:' + source_hash))
+            _count(conn, 'source_hits')
+            return path
+        _count(conn, 'source_misses')
+        return None
+    finally:
+        conn.close()
+
+def store_source(source_hash, ext, from_path=None, stream=None, held=None):
+    # Move a saved upload (from_path) or write an upload stream into the store.
+    # With held, it is held (see lookup_source) before eviction can see it.
+    path = source_path(source_hash, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if from_path:
+        shutil.move(from_path, tmp)
+    else:
+        with open(tmp, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+    if held is not None:
+        # The lock is on the file, so it carries over the rename
+        hold(tmp, held)
+    os.replace(tmp, path)
+    _record('source:' + source_hash, 'source', path, os.path.getsize(path))
+    return path
+
+# -------------------- Variant sets --------------------
+def lookup_variants(key):
+    # Cached variant files for key, ordered by variant number, or None
+    folder = os.path.join(CACHE_FOLDER, 'variants', key)
+    conn = _connect()
+    try:
+        if os.path.isdir(folder):
+            files = sorted(
+                (f for f in os.listdir(folder) if f != HASHES_FILE),
+                key=lambda f: int(os.path.splitext(f)[0])
+            )
+            if files:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), 'variants:' + key))
+                _count(conn, 'variant_hits')
+                return [os.path.join(folder, f) for f in files]
+        _count(conn, 'variant_misses')
+        return None
+    finally:
+        conn.close()
+
+def cached_hashes(cached):
+    # Perceptual hashes stored with a variant set, in variant order (None
+    # where there are none)
+    try:
+        with open(os.path.join(os.path.dirname(cached[0]), HASHES_FILE)) as f:
+            hashes = json.load(f)
+    except (IndexError, OSError, ValueError):
+        hashes = []
+    return [hashes[i] if i < len(hashes) else None for i in range(len(cached))]
+
+def store_variants(key, paths, hashes=None):
+    # paths are in variant order; stored as 1.jpg, 2.jpg, ... under the key,
+    # with their perceptual hashes (if given) for cache hits to report
+    folder = os.path.join(CACHE_FOLDER, 'variants', key)
+    if os.path.isdir(folder):
+        return
+    tmp = f"{folder}.{os.getpid()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    size = 0
+    for i, p in enumerate(paths):
+        dst = os.path.join(tmp, f"{i+1}{os.path.splitext(p)[1]}")
+        storage.link(p, dst)
+        size += os.path.getsize(dst)
+    if hashes:
+        with open(os.path.join(tmp, HASHES_FILE), 'w') as f:
+            json.dump(list(hashes), f)
+    try:
+        os.rename(tmp, folder)
+    except OSError:
+        # Another worker stored the same set first
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    _record('variants:' + key, 'variants', folder, size)
+
+def materialize(cached, name, dest_folders):
+    # Link cached variants into place under this upload's name; returns the
+    # paths created in the last destination folder (history).
+    created = []
+    for i, p in enumerate(cached):
+        fn = f"{name}_variant_{i+1}{os.path.splitext(p)[1]}"
+        for folder in dest_folders:
+            storage.link(p, os.path.join(folder, fn))
+        created.append(os.path.join(dest_folders[-1], fn))
+    return created
+
+# -------------------- Locks --------------------
+def hold(path, held):
+    # Shared lock on a stored entry until the ExitStack held closes. False if
+    # the entry was evicted before the lock was taken.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        same = os.stat(path).st_ino == os.fstat(fd).st_ino
+    except FileNotFoundError:
+        same = False
+    if not same:
+        os.close(fd)
+        return False
+    held.callback(os.close, fd)
+    return True
+
+def _lock_for_eviction(path):
+    # Exclusive lock on an entry nobody holds (an fd to close once it is
+    # removed); None if someone does. Entries that are already gone need none.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return -1
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+# -------------------- Bookkeeping --------------------
+def _record(key, kind, path, size):
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, kind, path, size, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, path, size, time.time())
+        )
+        evict(conn)
+    finally:
+        conn.close()
+
+def evict(conn=None, max_bytes=None):
+    # Drop least-recently-used entries until the store fits in max_bytes,
+    # passing over the ones a job holds
+    own = conn is None
+    conn = conn or _connect()
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    freed = 0
+    try:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        for key, path, size in conn.execute(
+            "SELECT key, path, size FROM entries ORDER BY last_access"
+        ).fetchall():
+            if total - freed <= max_bytes:
+                break
+            lock = _lock_for_eviction(path)
+            if lock is None:
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                    # Sidecars (probe results) live and die with their source
+                    for sidecar in glob.glob(glob.escape(path) + '.*.json'):
+                        os.remove(sidecar)
+            finally:
+                if lock >= 0:
+                    os.close(lock)
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            freed += size
+        return freed
+    finally:
+        if own:
+            conn.close()
+
+def stats():
+    conn = _connect()
+    try:
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    finally:
+        conn.close()
+    return {
+        'variant_hits': counters.get('variant_hits', 0),
+        'variant_misses': counters.get('variant_misses', 0),
+        'source_hits': counters.get('source_hits', 0),
+        'source_misses': counters.get('source_misses', 0),
+        'entries': entries,
+        'bytes': size,
+        'max_bytes': CACHE_MAX_BYTES,
+    }
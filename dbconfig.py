@@ -0,0 +1,50 @@
+# dbconfig.py
+# Database URL and engine options, all overridable from the environment.
+# SQLite stays the default; WAL lets readers carry on while one writer
+# commits, and busy_timeout makes a writer wait for the lock instead of
+# failing with "database is locked" when several gunicorn workers and job
+# workers write at once. Point DATABASE_URL at Postgres/MySQL to go further.
+import os
+from sqlalchemy import event
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///users.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# SQLite only
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'wal')
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 15000))
+# NORMAL is safe with WAL (a power cut can lose the last commits, never
+# corrupt the file) and skips an fsync per commit
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'normal')
+
+def is_sqlite(url):
+    return url.startswith('sqlite')
+
+def engine_options(url=DATABASE_URL):
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_pre_ping': True,
+    }
+    if is_sqlite(url):
+        # sqlite3's own lock wait, in seconds; connections may be handed to
+        # another thread by the pool
+        options['connect_args'] = {'timeout': DB_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False}
+    else:
+        options['pool_recycle'] = DB_POOL_RECYCLE
+    return options
+
+def set_sqlite_pragmas(dbapi_conn, connection_record):
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cur.close()
+
+def init_engine(app, db):
+    # Call once the app is configured; applies the pragmas to every new
+    # SQLite connection
+    with app.app_context():
+        if is_sqlite(str(db.engine.url)):
+            event.listen(db.engine, 'connect', set_sqlite_pragmas)
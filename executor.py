@@ -0,0 +1,114 @@
+# executor.py
+# Bounded parallel rendering shared by the image and video paths.
+# Pillow work goes to a process pool; ffmpeg runs are launched from threads.
+# Either way every render holds a "render slot" first. Slots are lock files
+# under instance/render_slots, so the limit is host-wide: it holds across
+# gunicorn workers, job workers and concurrent requests alike.
+import os
+import time
+import fcntl
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Cores this process may run on (a cpuset or affinity mask can be smaller
+# than the machine)
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+# Parallel renders a single batch may submit at once
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', CPU_COUNT))
+# Renders allowed to run at the same time on this host, across all requests
+RENDER_SLOTS = max(1, int(os.getenv('RENDER_SLOTS', CPU_COUNT)))
+RENDER_SLOT_DIR = os.getenv('RENDER_SLOT_DIR', os.path.join('instance', 'render_slots'))
+
+_process_pool = None
+
+def _try_lock(i):
+    fd = os.open(os.path.join(RENDER_SLOT_DIR, f'slot_{i}.lock'), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+@contextlib.contextmanager
+def render_slots(n=1):
+    # All-or-nothing: grab n free slots or release what we got and retry, so
+    # two callers never sit on half of what they need.
+    n = max(1, min(n, RENDER_SLOTS))
+    os.makedirs(RENDER_SLOT_DIR, exist_ok=True)
+    while True:
+        held = []
+        for i in range(RENDER_SLOTS):
+            fd = _try_lock(i)
+            if fd is not None:
+                held.append(fd)
+                if len(held) == n:
+                    break
+        if len(held) == n:
+            break
+        for fd in held:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        time.sleep(0.05)
+    try:
+        yield n
+    finally:
+        for fd in held:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+def ffmpeg_threads(slots=1, outputs=1):
+    # Each slot is worth CPU_COUNT / RENDER_SLOTS cores; split them between
+    # the encoders of one ffmpeg process so the host is never oversubscribed.
+    return max(1, (CPU_COUNT * slots) // RENDER_SLOTS // max(1, outputs))
+
+def process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=max(1, RENDER_WORKERS))
+    return _process_pool
+
+def run_all(executor, fn, calls, on_result=None):
+    # Submit every call, stop at the first failure and re-raise it. on_result
+    # sees each result as soon as it is ready; the return value is in
+    # submission order, so output naming stays deterministic. On failure the
+    # calls already running are waited for, so nothing is still writing
+    # files once the caller cleans up.
+    futures = [executor.submit(fn, *args) for args in calls]
+    try:
+        for f in as_completed(futures):
+            result = f.result()
+            if on_result:
+                on_result(result)
+    except BaseException:
+        for other in futures:
+            other.cancel()
+        wait(futures)
+        raise
+    return [f.result() for f in futures]
+
+def run_inline(fn, calls, on_result=None):
+    results = []
+    for args in calls:
+        results.append(fn(*args))
+        if on_result:
+            on_result(results[-1])
+    return results
+
+def run_processes(fn, calls, on_result=None):
+    global _process_pool
+    if RENDER_WORKERS <= 1 or len(calls) <= 1:
+        return run_inline(fn, calls, on_result)
+    try:
+        return run_all(process_pool(), fn, calls, on_result)
+    except BrokenProcessPool:
+        # A pool worker died (OOM kill...); start fresh next time
+        _process_pool = None
+        raise
+
+def run_threads(fn, calls, on_result=None):
+    if RENDER_WORKERS <= 1 or len(calls) <= 1:
+        return run_inline(fn, calls, on_result)
+    with ThreadPoolExecutor(max_workers=min(RENDER_WORKERS, len(calls))) as pool:
+        return run_all(pool, fn, calls, on_result)
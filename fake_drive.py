@@ -0,0 +1,118 @@
+# fake_drive.py
+# Stand-in for the Drive v3 service object, backed by a local folder, for
+# exercising backups.py without Google credentials: DRIVE_FAKE_DIR=/tmp/drive.
+# Implements the calls the uploader makes (files().list / create, resumable
+# next_chunk); DRIVE_FAKE_FAIL_RATE makes that share of calls fail with a
+# 503 so the retry path gets exercised too.
+import os
+import json
+import uuid
+import random
+import httplib2
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+class FakeDriveService:
+    def __init__(self, root, fail_rate=None):
+        self.root = root
+        self.fail_rate = float(os.getenv('DRIVE_FAKE_FAIL_RATE', 0) if fail_rate is None else fail_rate)
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, 'index.json')
+
+    def _index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save(self, index):
+        with open(self.index_path, 'w') as f:
+            json.dump(index, f, indent=2)
+
+    def _maybe_fail(self):
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise HttpError(httplib2.Response({'status': 503}), b'{"error": "backendError"}')
+
+    def files(self):
+        return FakeFiles(self)
+
+class FakeRequest:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self, num_retries=0):
+        return self.fn()
+
+class FakeUpload:
+    # Mirrors HttpRequest.next_chunk() for a resumable MediaFileUpload
+    def __init__(self, service, body, media):
+        self.service = service
+        self.body = body
+        self.media = media
+        self.file_id = uuid.uuid4().hex
+        self.offset = 0
+        self.path = os.path.join(service.root, self.file_id)
+
+    def next_chunk(self, num_retries=0):
+        for attempt in range(num_retries + 1):
+            try:
+                self.service._maybe_fail()
+                break
+            except HttpError:
+                if attempt == num_retries:
+                    raise
+        size = self.media.size()
+        chunk = self.media.getbytes(self.offset, min(self.media.chunksize(), size - self.offset))
+        with open(self.path, 'ab') as f:
+            f.write(chunk)
+        self.offset += len(chunk)
+        if self.offset < size:
+            return FakeProgress(self.offset, size), None
+        index = self.service._index()
+        index[self.file_id] = {'name': self.body['name'], 'parents': self.body.get('parents', []), 'size': size}
+        self.service._save(index)
+        return None, {'id': self.file_id}
+
+    def execute(self, num_retries=0):
+        response = None
+        while response is None:
+            _, response = self.next_chunk(num_retries)
+        return response
+
+class FakeProgress:
+    def __init__(self, done, total):
+        self.resumable_progress = done
+        self.total_size = total
+
+    def progress(self):
+        return self.resumable_progress / self.total_size
+
+class FakeFiles:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q='', fields=None, **kwargs):
+        def run():
+            self.service._maybe_fail()
+            # Only the "name = '...' and mimeType = folder" form is understood
+            files = [
+                {'id': fid, 'name': meta['name']}
+                for fid, meta in self.service._index().items()
+                if meta.get('mimeType') == FOLDER_MIME and f"name='{meta['name']}'" in q.replace(' = ', '=')
+            ]
+            return {'files': files}
+        return FakeRequest(run)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        if media_body is not None:
+            return FakeUpload(self.service, body, media_body)
+
+        def run():
+            self.service._maybe_fail()
+            index = self.service._index()
+            file_id = uuid.uuid4().hex
+            index[file_id] = dict(body)
+            self.service._save(index)
+            return {'id': file_id}
+        return FakeRequest(run)
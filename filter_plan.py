@@ -0,0 +1,115 @@
+# filter_plan.py
+# Picks a cheaper, equivalent order for a variant's operations.
+# Video: the naive chain is eq -> rotate -> crop -> scale(w, h) -> hflip, so
+# eq and rotate run over the full frame that crop then throws away. The plan
+# maps the crop window back through the rotation, pre-crops the source to
+# that window's bounding box (plus a margin for the rotate filter's
+# interpolation) and runs rotate on that; eq moves after the final crop
+# when no rotate fill can reach the output (otherwise it stays before
+# rotate, so the fill stays black); hflip runs before the upscale.
+# Images (image_engine.py): the tone LUT runs on the warped/cropped output
+# rather than the whole source when that is smaller and exact.
+# pixel_ops() is the cost model: pixels each filter reads or writes.
+import math
+
+# Extra source pixels kept around the mapped crop window
+MARGIN = 2
+# apply_video_filters has always converted degrees with this value
+PI = 3.1415926
+
+def rotated_half_extent(w, h, angle):
+    # Half width/height of the bounding box of a w x h rectangle rotated by
+    # angle (radians) about its centre
+    c, s = abs(math.cos(angle)), abs(math.sin(angle))
+    return (w * c + h * s) / 2, (w * s + h * c) / 2
+
+def crop_size(w, h, crop_factor, opts, even=False):
+    dx = dy = 0
+    if opts.get('crop'):
+        dx, dy = int(w * crop_factor), int(h * crop_factor)
+    cw, ch = w - 2 * dx, h - 2 * dy
+    if even:
+        # The crop becomes the output size: libx264 needs it even for 4:2:0
+        cw, ch = cw - cw % 2, ch - ch % 2
+    return dx, dy, cw, ch
+
+def eq_step(variant, opts):
+    contrast, brightness = variant[0], variant[1]
+    c = 1 + contrast if opts.get('contrast') else 1
+    b = brightness if opts.get('brightness') else 0
+    return ('eq', (), {'contrast': c, 'brightness': b})
+
+def naive_video(variant, opts, w, h):
+    # The original order, kept as the reference for bench/bench_filter_planner.py
+    _, _, rotation, crop_factor, flip = variant
+    steps = []
+    if opts.get('contrast') or opts.get('brightness'):
+        steps.append(eq_step(variant, opts))
+    if opts.get('rotate'):
+        steps.append(('rotate', (), {'angle': rotation * PI / 180, 'fillcolor': 'black'}))
+    if opts.get('crop'):
+        dx, dy, cw, ch = crop_size(w, h, crop_factor, opts)
+        steps.append(('crop', (cw, ch, dx, dy), {}))
+        steps.append(('scale', (w, h), {}))
+    if flip:
+        steps.append(('hflip', (), {}))
+    return steps
+
+def plan_video(variant, opts, w, h, upscale=True):
+    # Filter steps, as (name, args, kwargs), for a w x h input. With
+    # upscale=False the cropped frame is the output (no scale back to w x h).
+    _, _, rotation, crop_factor, flip = variant
+    tone = eq_step(variant, opts) if opts.get('contrast') or opts.get('brightness') else None
+    dx, dy, cw, ch = crop_size(w, h, crop_factor, opts, even=not upscale)
+    cropped = (cw, ch) != (w, h)
+    steps = []
+    if opts.get('rotate'):
+        angle = rotation * PI / 180
+        hx, hy = rotated_half_extent(cw, ch, angle)
+        # Source pixels that can reach the output: the mapped window's box.
+        # Symmetric about the centre, so rotating the pre-cropped frame
+        # about its own centre samples exactly the same source positions.
+        # Even offsets: crop rounds x/y down to the chroma grid on 4:2:0, and
+        # the centre must not move by that rounding
+        px = max(0, math.floor(w / 2 - hx) - MARGIN) // 2 * 2
+        py = max(0, math.floor(h / 2 - hy) - MARGIN) // 2 * 2
+        fill_reaches_output = hx > w / 2 - MARGIN or hy > h / 2 - MARGIN
+        if px or py:
+            steps.append(('crop', (w - 2 * px, h - 2 * py, px, py), {}))
+        if tone and fill_reaches_output:
+            steps.append(tone)
+        steps.append(('rotate', (), {'angle': angle, 'fillcolor': 'black'}))
+        if cropped:
+            steps.append(('crop', (cw, ch, dx - px, dy - py), {}))
+        if tone and not fill_reaches_output:
+            steps.append(tone)
+    else:
+        if cropped:
+            steps.append(('crop', (cw, ch, dx, dy), {}))
+        if tone:
+            steps.append(tone)
+    if flip:
+        steps.append(('hflip', (), {}))
+    if cropped and upscale:
+        steps.append(('scale', (w, h), {}))
+    return steps
+
+def pixel_ops(steps, w, h):
+    # Pixels processed by the chain; crop only moves a pointer
+    total = 0
+    for name, args, _ in steps:
+        if name == 'crop':
+            w, h = args[0], args[1]
+            continue
+        if name == 'scale':
+            w, h = args
+        total += w * h
+    return total
+
+def image_tone_last(lut, src_pixels, out_pixels, warped):
+    # Tone-map the output instead of the source: exact because the LUT is
+    # per pixel and the warp samples nearest-neighbour, provided the warp's
+    # black fill stays black (LUT[0] == 0); worth it when the output is smaller
+    if lut is None or out_pixels >= src_pixels:
+        return False
+    return not warped or int(lut[0]) == 0
@@ -0,0 +1,147 @@
+# image_engine.py
+# NumPy/OpenCV variant renderer. The source is decoded once into an array;
+# per variant, contrast+brightness become one 256-entry LUT pass and
+# rotate(expand)+crop+flip become one inverse affine warp, so no full-size
+# intermediate images are allocated. The LUT runs on whichever of source and
+# output is smaller when that is exact (filter_plan.image_tone_last). Matches the PIL chain in
+# image_videoprocessing.pil_variant to within rounding at rotation edges.
+import math
+import numpy as np
+import cv2
+from PIL import Image
+import filter_plan
+import metrics
+
+LEVELS = np.arange(256, dtype=np.float32)
+IDENTITY = np.arange(256, dtype=np.uint8)
+
+# PIL's rotate() uses nearest-neighbour by default; keep the same look
+WARP_INTERPOLATION = cv2.INTER_NEAREST
+
+class Source:
+    # A decoded upload, ready to render many variants from
+    def __init__(self, img):
+        if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        self.mode = img.mode
+        self.arr = np.asarray(img)
+        # ImageEnhance.Contrast pivots around the mean grey level of the source
+        grey = img if img.mode == "L" else img.convert("L")
+        self.mean = int(float(np.asarray(grey, dtype=np.float64).mean()) + 0.5)
+        self.height, self.width = self.arr.shape[:2]
+
+def tone_lut(source, contrast, brightness, opts):
+    # Contrast (blend with the mean grey) then brightness (blend with black),
+    # clipped and truncated per stage like PIL, fused into one uint8 table.
+    lut = LEVELS
+    if opts.get('contrast'):
+        lut = np.trunc(np.clip(source.mean + (1 + contrast) * (lut - source.mean), 0, 255))
+    if opts.get('brightness'):
+        lut = np.trunc(np.clip(lut * (1 + brightness), 0, 255))
+    if lut is LEVELS:
+        return None
+    return lut.astype(np.uint8)
+
+def apply_lut(arr, lut):
+    if lut is None:
+        return arr
+    if arr.ndim == 2 or arr.shape[2] == 3:
+        return cv2.LUT(arr, lut)
+    # Per-channel table that leaves alpha alone, as ImageEnhance does
+    return cv2.LUT(arr, np.stack([lut, lut, lut, IDENTITY], axis=-1).reshape(1, 256, 4))
+
+def rotate_matrix(w, h, rotation):
+    # The inverse affine matrix and canvas size Image.rotate(expand=True)
+    # uses, computed the same way so sizes match to the pixel.
+    a = -math.radians(rotation)
+    m = [round(math.cos(a), 15), round(math.sin(a), 15), 0.0,
+         round(-math.sin(a), 15), round(math.cos(a), 15), 0.0]
+
+    def transform(x, y):
+        return m[0] * x + m[1] * y + m[2], m[3] * x + m[4] * y + m[5]
+
+    m[2], m[5] = transform(-w / 2, -h / 2)
+    m[2] += w / 2
+    m[5] += h / 2
+    corners = [transform(x, y) for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    nw = math.ceil(max(x for x, _ in corners)) - math.floor(min(x for x, _ in corners))
+    nh = math.ceil(max(y for _, y in corners)) - math.floor(min(y for _, y in corners))
+    m[2], m[5] = transform(-(nw - w) / 2, -(nh - h) / 2)
+    return np.array([m[0:3], m[3:6], [0, 0, 1]], dtype=np.float64), (nw, nh)
+
+def geometry(source, rotation, crop_factor, flip, opts):
+    # Returns (matrix, (out_w, out_h)): matrix maps output pixel -> source
+    # pixel for the whole rotate -> crop -> flip chain, or None when no
+    # rotation is involved and plain slicing will do.
+    w, h = source.width, source.height
+    rotate = opts.get('rotate') and rotation % 360 != 0
+    if rotate:
+        rot_m, (rw, rh) = rotate_matrix(w, h, rotation)
+    else:
+        rw, rh = w, h
+    dx = dy = 0
+    if opts.get('crop'):
+        dx, dy = int(rw * crop_factor), int(rh * crop_factor)
+    out_w, out_h = rw - 2 * dx, rh - 2 * dy
+    if not rotate:
+        return None, (out_w, out_h)
+
+    # Output (x, y) -> cropped canvas -> rotated canvas -> source. PIL samples
+    # at pixel centres (+0.5) while OpenCV's centres are integers.
+    flip_m = np.array([[-1, 0, out_w - 1], [0, 1, 0], [0, 0, 1]], dtype=np.float64) if flip else np.eye(3)
+    crop_m = np.array([[1, 0, dx + 0.5], [0, 1, dy + 0.5], [0, 0, 1]], dtype=np.float64)
+    to_cv = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]], dtype=np.float64)
+    m = to_cv @ rot_m @ crop_m @ flip_m
+    return m[:2], (out_w, out_h)
+
+def render(source, variant, opts, arr=None, labels=None):
+    # arr lets render_batch pass in an already tone-mapped copy of the source;
+    # labels (kind/plan) time the tone and warp passes (metrics.py)
+    timed = metrics.stage_timer(labels)
+    contrast, brightness, rotation, crop_factor, flip = variant
+    matrix, (out_w, out_h) = geometry(source, rotation, crop_factor, flip, opts)
+    lut = None
+    if arr is None:
+        lut = tone_lut(source, contrast, brightness, opts)
+        if lut is not None and not filter_plan.image_tone_last(lut, source.width * source.height, out_w * out_h, matrix is not None):
+            with timed('filter_tone'):
+                arr = apply_lut(source.arr, lut)
+            lut = None
+        else:
+            arr = source.arr
+    with timed('filter_warp'):
+        if matrix is None:
+            dx, dy = (source.width - out_w) // 2, (source.height - out_h) // 2
+            view = arr[dy:dy + out_h, dx:dx + out_w]
+            out = np.ascontiguousarray(view[:, ::-1] if flip else view)
+        else:
+            out = cv2.warpAffine(
+                arr, matrix, (out_w, out_h),
+                flags=WARP_INTERPOLATION | cv2.WARP_INVERSE_MAP,
+                borderMode=cv2.BORDER_CONSTANT, borderValue=0
+            )
+    if lut is None:
+        return out
+    with timed('filter_tone'):
+        return apply_lut(out, lut)
+
+def render_batch(source, variants, opts, labels=None):
+    # Tone-map all N variants in one vectorised gather over a stacked
+    # (N, 256) LUT, then warp each. Trades N source-sized buffers for fewer,
+    # larger NumPy calls; worth it for many variants of smallish images.
+    luts = [tone_lut(source, v[0], v[1], opts) for v in variants]
+    if any(lut is None for lut in luts):
+        return [render(source, v, opts, labels=labels) for v in variants]
+    with metrics.stage_timer(labels)('filter_tone'):
+        stacked = np.stack(luts)
+        colour = source.arr if source.arr.ndim == 2 else source.arr[..., :3]
+        toned = stacked[np.arange(len(variants)).reshape((-1,) + (1,) * colour.ndim), colour[None]]
+        if source.arr.ndim == 3 and source.arr.shape[2] == 4:
+            alpha = np.broadcast_to(source.arr[None, ..., 3:], toned.shape[:3] + (1,))
+            toned = np.concatenate([toned, alpha], axis=-1)
+    return [render(source, v, opts, arr=toned[k], labels=labels) for k, v in enumerate(variants)]
+
+def to_image(source, arr):
+    return Image.fromarray(arr, source.mode)
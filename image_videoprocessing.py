@@ -1,176 +1,600 @@
+import io
 import os
-import random
 import shutil
+import tempfile
+import contextlib
 from PIL import Image, ImageEnhance
 import ffmpeg
 import sys
 import traceback
-import math
+import image_engine
+import sampler
+import cache
+import storage
+import metrics
+import filter_plan
+import metadata_words
+import phash
+from cache import CACHE_ENABLED
+from storage import unlink_existing, write_new
+from probe import PROBE_SUFFIX, probe_video, move_probe
+from executor import RENDER_WORKERS, render_slots, ffmpeg_threads, run_processes, run_threads
 
 OUTPUT_FOLDER = "output"
 HISTORY_FOLDER = "history"
 
+# Render all variants of a video from a single decode (split filter) instead
+# of one ffmpeg run per variant.
+VIDEO_SINGLE_PASS = os.getenv('VIDEO_SINGLE_PASS', '1') == '1'
+
+# Segment-parallel mode for long sources (opt-in): cut the source at
+# keyframes into ~VIDEO_SEGMENT_SECONDS pieces, render every piece (all
+# variants, one split-filter run each) in parallel, then join each variant's
+# pieces losslessly with the concat demuxer. Only sources of at least
+# VIDEO_SEGMENT_MIN_DURATION seconds are split; 0 turns the mode off.
+VIDEO_SEGMENT_SECONDS = float(os.getenv('VIDEO_SEGMENT_SECONDS', 0))
+VIDEO_SEGMENT_MIN_DURATION = float(os.getenv('VIDEO_SEGMENT_MIN_DURATION', 120))
+SEGMENT_FOLDER = os.path.join('uploads', 'segments')
+
+# Scale cropped video variants back up to the source size. Off, the crop is
+# the output size: smaller files and no upscale pass.
+VIDEO_UPSCALE_CROP = os.getenv('VIDEO_UPSCALE_CROP', '1') == '1'
+
+# Image variant engine: 'numpy' (LUT + single affine warp, see image_engine.py)
+# or 'pil' (ImageEnhance/rotate/crop/transpose chain). IMAGE_ENGINE_BATCHED
+# tone-maps all variants of an image in one array operation.
+IMAGE_ENGINE = os.getenv('IMAGE_ENGINE', 'numpy')
+IMAGE_ENGINE_BATCHED = os.getenv('IMAGE_ENGINE_BATCHED', '0') == '1'
+
+# PROCESSING_VERBOSE=0 silences the progress prints (and ffmpeg's own
+# console output) on the hot path; failures are always printed.
+VERBOSE = os.getenv('PROCESSING_VERBOSE', '1') == '1'
+
+# Random tags (metadata_words.py) on every variant, written by the encode
+# that produces it: EXIF in the image save, -metadata on the ffmpeg output.
+# The source's own metadata is dropped in the same step.
+VARIANT_METADATA = os.getenv('VARIANT_METADATA', '1') == '1'
+
+
+# Audio codecs an .mp4 can carry as-is; anything else is re-encoded to AAC.
+# No filter touches audio, so copying it is lossless and nearly free.
+MP4_AUDIO_CODECS = {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus'}
+
 # Ensure output/history folders exist
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 os.makedirs(HISTORY_FOLDER, exist_ok=True)
 
-def scale_range(min_val, max_val, intensity):
-    # At intensity=100, uses the full range; at lower, scales down.
-    factor = intensity / 100
-    return random.uniform(min_val * factor, max_val * factor)
+def log(*args):
+    if VERBOSE:
+        print(*args, file=sys.stderr)
+
+def pil_variant(img, variant, opts, labels=None):
+    # labels (kind/plan) time each filter (metrics.py)
+    timed = metrics.stage_timer(labels)
+    contrast, brightness, rotation, crop_factor, flip = variant
+    var = img.copy()
+    if opts.get('contrast'):
+        with timed('filter_contrast'):
+            var = ImageEnhance.Contrast(var).enhance(1 + contrast)
+    if opts.get('brightness'):
+        with timed('filter_brightness'):
+            var = ImageEnhance.Brightness(var).enhance(1 + brightness)
+    if opts.get('rotate'):
+        with timed('filter_rotate'):
+            var = var.rotate(rotation, expand=True)
+    if opts.get('crop'):
+        with timed('filter_crop'):
+            w, h = var.size
+            dx, dy = int(w * crop_factor), int(h * crop_factor)
+            var = var.crop((dx, dy, w - dx, h - dy))
+    if flip:
+        with timed('filter_flip'):
+            var = var.transpose(Image.FLIP_LEFT_RIGHT)
+    return var
+
+def iter_image_variants(img, variants, opts, labels=None):
+    # Yields one PIL image per variant, from whichever engine is configured;
+    # labels, when given, time the filters as stages (metrics.py)
+    if IMAGE_ENGINE == 'numpy':
+        source = image_engine.Source(img)
+        if IMAGE_ENGINE_BATCHED:
+            for arr in image_engine.render_batch(source, variants, opts, labels):
+                yield image_engine.to_image(source, arr)
+        else:
+            for variant in variants:
+                yield image_engine.to_image(source, image_engine.render(source, variant, opts, labels=labels))
+    else:
+        for variant in variants:
+            yield pil_variant(img, variant, opts, labels)
+
+def open_source(data, max_dimension=0):
+    # Decode an upload, no larger than max_dimension on its longest side.
+    # JPEGs are decoded in draft mode (DCT scaling), so a 24MP photo never
+    # exists at full size in memory when we only need web-size output.
+    img = Image.open(io.BytesIO(data))
+    if max_dimension and max(img.size) > max_dimension:
+        if img.format == 'JPEG':
+            img.draft(img.mode, (max_dimension, max_dimension))
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return img
 
-def param_distance(a, b):
-    # Simple Euclidean distance; tune with weights if desired
-    return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+def variant_cache():
+    # A cache hit replays the stored files byte for byte, tags included, so
+    # rendered variant sets are only cached while VARIANT_METADATA is off
+    # (video sources are deduplicated either way)
+    return CACHE_ENABLED and not VARIANT_METADATA
 
-def is_unique(params, used_params, min_dist=0.07):
-    for up in used_params:
-        if param_distance(params, up) < min_dist:
-            return False
-    return True
+def variant_exif():
+    # A fresh EXIF block for one image variant, or None to write no tags
+    return metadata_words.exif_bytes(metadata_words.random_exif_fields()) if VARIANT_METADATA else None
 
-def process_images_logic(images, batch, intensity, opts, out=OUTPUT_FOLDER, hist_folder=HISTORY_FOLDER):
-    # Adjust these values as needed for your use case/platform
-    contrast_min, contrast_max = -4.0, 4.0
-    brightness_min, brightness_max = -2, 2
-    rotation_min, rotation_max = -25, 25
-    crop_min, crop_max = 0.15, 0.35  # 5%–15% crop
+def variant_metadata():
+    # Fresh tags for one video output, or None to leave ffmpeg's defaults
+    return metadata_words.random_metadata_fields() if VARIANT_METADATA else None
 
+def encode_variant(var, settings, exif=None):
+    # Convert and encode once; the bytes go to every destination. PIL only
+    # writes the EXIF it is given, so the source's never carries over.
+    buf = io.BytesIO()
+    tags = {'exif': exif} if exif else {}
+    if var.mode in ("RGBA", "LA") or (var.mode == "P" and "transparency" in var.info):
+        var.save(buf, format="PNG", compress_level=settings.get('png_compress_level', 6), **tags)
+        return "png", buf.getvalue()
+    if var.mode != "RGB":
+        var = var.convert("RGB")
+    var.save(
+        buf, format="JPEG",
+        quality=settings.get('quality', 75),
+        optimize=settings.get('optimize', False),
+        progressive=settings.get('progressive', False),
+        subsampling=settings.get('subsampling', '4:2:0'),
+        **tags
+    )
+    return "jpg", buf.getvalue()
+
+def distinct_variant(img, var, i, name, opts, intensity, seen, labels):
+    # Perceptual hash of a rendered variant (phash.py). One that comes out
+    # within PHASH_THRESHOLD bits of a variant rendered before it (seen) is
+    # drawn again, up to PHASH_RESAMPLE times; intensity None (variants
+    # chosen by the user) only hashes. Returns the variant and its hash.
+    with metrics.timer('phash', **labels):
+        h = phash.hash_image(var)
+    for attempt in range(phash.PHASH_RESAMPLE if intensity is not None else 0):
+        if not seen or phash.distances([h], seen).min() > phash.PHASH_THRESHOLD:
+            break
+        seed = f"{sampler.SAMPLER_SEED}:{name}:{i}:{attempt}" if sampler.SAMPLER_SEED else None
+        variant = sampler.sample_variants(1, opts, intensity, sampler.IMAGE_SPACE, sampler.make_rng(seed))[0]
+        log(f"Variant {i+1} of {name} is a near-duplicate; re-sampled as {variant}")
+        with metrics.timer('render', **labels):
+            var = next(iter_image_variants(img, [variant], opts, labels))
+        with metrics.timer('phash', **labels):
+            h = phash.hash_image(var)
+    return var, h
+
+def render_image_variants(data, name, items, opts, out, hist_folder, settings=None, plan=None, intensity=None):
+    # Runs in a pool process: decode the source once, render this chunk of
+    # variants. items is a list of (index, (contrast, brightness, rotation, crop, flip)).
+    # Returns (history path, perceptual hash) per variant. Each variant is
+    # encoded and written once, to history; out (if set) gets a link to that
+    # file. With intensity given, near-duplicates within the chunk are
+    # re-sampled (distinct_variant).
+    settings = settings or {}
+    labels = {'kind': 'image', 'plan': plan}
+    written = []
+    seen = []
+    with render_slots():
+        with metrics.timer('decode', **labels):
+            img = open_source(data, settings.get('max_dimension', 0))
+            img.load()
+        rendered = iter_image_variants(img, [variant for _, variant in items], opts, labels)
+        for i, _ in items:
+            with metrics.timer('render', **labels):
+                var = next(rendered)
+            h = None
+            if phash.PHASH_ENABLED:
+                var, h = distinct_variant(img, var, i, name, opts, intensity, seen, labels)
+                seen.append(h)
+            # File extension and format follow the image mode
+            with metrics.timer('encode', **labels):
+                ext, encoded = encode_variant(var, settings, variant_exif())
+            fn = f"{name}_variant_{i+1}.{ext}"
+            hist_path = os.path.join(hist_folder, fn)
+            with metrics.timer('history_write', **labels):
+                write_new(hist_path, encoded)
+                if out:
+                    storage.link(hist_path, os.path.join(out, fn))
+            written.append((hist_path, h))
+    # The pool process may sit idle for a while; don't hold these back
+    metrics.flush()
+    return written
+
+def chosen_key(variants):
+    # Sampled batches share a cache entry; chosen variants are part of the key
+    return {'variants': [list(v) for v in variants]} if variants else {}
+
+def chunked(items, n):
+    # Split items into at most n contiguous, roughly equal chunks
+    n = max(1, min(n, len(items)))
+    size = -(-len(items) // n)
+    return [items[k:k + size] for k in range(0, len(items), size)]
+
+def process_images_logic(images, batch, intensity, opts, out=OUTPUT_FOLDER, hist_folder=HISTORY_FOLDER, on_variant=None, settings=None, plan=None, variants=None, on_hash=None):
+    # on_variant(path) is called with each history path as soon as it exists,
+    # on_hash(path, hash) with its perceptual hash (phash.py) for rendered ones;
+    # settings are the plan's decode/encode options (plan_settings.py), plan
+    # only labels the stage timings (metrics.py). variants, when given (from a
+    # preview, see preview.py), are rendered instead of sampling new ones.
+    # Parameter ranges live in sampler.IMAGE_SPACE
+    rng = sampler.make_rng()
+
+    # Spread each image's variants over the pool; with a single worker every
+    # image stays one chunk and is decoded only once.
+    chunks_per_image = max(1, RENDER_WORKERS // max(1, len(images)))
+    calls = []
+    to_cache = []
     for img_file in images:
-        try:
-            print(f"Opening image file: {img_file.filename}", file=sys.stderr)
-            img = Image.open(img_file)
-            name = os.path.splitext(img_file.filename)[0]
-            used_params = []
-            for i in range(batch):
-                tries = 0
-                while True:
-                    contrast = scale_range(contrast_min, contrast_max, intensity) if opts.get('contrast') else 0
-                    brightness = scale_range(brightness_min, brightness_max, intensity) if opts.get('brightness') else 0
-                    rotation = scale_range(rotation_min, rotation_max, intensity) if opts.get('rotate') else 0
-                    crop_factor = scale_range(crop_min, crop_max, intensity) if opts.get('crop') else 0
-                    params = (round(contrast, 3), round(brightness, 3), round(rotation, 2), round(crop_factor, 3))
-                    if is_unique(params, used_params):
-                        used_params.append(params)
-                        break
-                    tries += 1
-                    if tries > 50:
-                        print("Warning: couldn't find unique params after 50 tries!")
-                        break
-                var = img.copy()
-                if opts.get('contrast'):
-                    var = ImageEnhance.Contrast(var).enhance(1 + contrast)
-                if opts.get('brightness'):
-                    var = ImageEnhance.Brightness(var).enhance(1 + brightness)
-                if opts.get('rotate'):
-                    var = var.rotate(rotation, expand=True)
-                if opts.get('crop'):
-                    w, h = var.size
-                    dx, dy = int(w * crop_factor), int(h * crop_factor)
-                    var = var.crop((dx, dy, w - dx, h - dy))
-                if opts.get('flip') and random.random() > 0.5:
-                    var = var.transpose(Image.FLIP_LEFT_RIGHT)
-
-                # Decide on file extension and format based on image mode
-                if var.mode in ("RGBA", "LA") or (var.mode == "P" and "transparency" in var.info):
-                    fn = f"{name}_variant_{i+1}.png"
-                    out_path = os.path.join(out, fn)
-                    hist_path = os.path.join(hist_folder, fn)
-                    var.save(out_path, format="PNG")
-                    var.save(hist_path, format="PNG")
-                else:
-                    fn = f"{name}_variant_{i+1}.jpg"
-                    out_path = os.path.join(out, fn)
-                    hist_path = os.path.join(hist_folder, fn)
-                    var.convert("RGB").save(out_path, format="JPEG")
-                    var.convert("RGB").save(hist_path, format="JPEG")
-        except Exception as e:
-            print(f"Exception processing image {img_file.filename}: {e}", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
-            raise
+        log(f"Opening image file: {img_file.filename}")
+        data = img_file.read()
+        name = os.path.splitext(img_file.filename)[0]
+
+        # Same bytes + same settings as an earlier batch: reuse its variants
+        key = None
+        if variant_cache():
+            key = cache.variants_key(
+                cache.hash_bytes(data), 'image', batch=batch, intensity=intensity,
+                opts=opts, settings=settings, engine=IMAGE_ENGINE, **chosen_key(variants)
+            )
+            cached = cache.lookup_variants(key)
+            if cached and len(cached) == batch:
+                log(f"Cache hit for {img_file.filename}")
+                paths = cache.materialize(cached, name, ([out] if out else []) + [hist_folder])
+                for path, h in zip(paths, cache.cached_hashes(cached)):
+                    if on_variant:
+                        on_variant(path)
+                    if on_hash:
+                        on_hash(path, h)
+                continue
 
-def process_videos_logic(vids, batch, intensity, opts, out=OUTPUT_FOLDER, hist_folder=HISTORY_FOLDER):
-    # Adjust these values as needed for your use case/platform
-    contrast_min, contrast_max = -4.0, 4.0
-    brightness_min, brightness_max = -2, 2
-    rotation_min, rotation_max = -25, 25
-    crop_min, crop_max = 0.10, 0.35  # 5%–15% crop
+        with metrics.timer('sample', kind='image', plan=plan):
+            indexed = list(enumerate(variants or sampler.sample_variants(batch, opts, intensity, sampler.IMAGE_SPACE, rng)))
+        first = len(calls)
+        for items in chunked(indexed, chunks_per_image):
+            calls.append((data, name, items, opts, out, hist_folder, settings, plan, None if variants else intensity))
+        if key:
+            to_cache.append((key, first, len(calls)))
 
+    try:
+        def chunk_done(done):
+            for path, h in done:
+                if on_variant:
+                    on_variant(path)
+                if on_hash:
+                    on_hash(path, h)
+        results = run_processes(render_image_variants, calls, on_result=chunk_done)
+        # Chunks are contiguous and results come back in call order
+        for key, first, last in to_cache:
+            done = [pair for chunk in results[first:last] for pair in chunk]
+            cache.store_variants(key, [path for path, _ in done], [h for _, h in done])
+    except Exception as e:
+        print(f"Exception processing images: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise
+
+def apply_video_filters(st, variant, opts, w, h, upscale=None):
+    # eq / rotate / crop (+ scale back to w x h) / hflip, in the cheapest
+    # equivalent order (filter_plan.py)
+    if upscale is None:
+        upscale = VIDEO_UPSCALE_CROP
+    for name, args, kwargs in filter_plan.plan_video(variant, opts, w, h, upscale):
+        log(f"Applying {name} filter: {args or ''}{kwargs or ''}")
+        st = st.filter(name, *args, **kwargs)
+    return st
+
+def cap_source(st, w, h, info, settings):
+    # Scale/frame-rate caps go before the per-variant filters, so every
+    # branch (and the split in single-pass mode) works on the smaller frames.
+    # Returns the stream and the size the filters should assume.
+    max_dim = settings.get('max_dimension', 0)
+    if max_dim and max(w, h) > max_dim:
+        factor = max_dim / max(w, h)
+        # libx264 needs even dimensions for 4:2:0
+        w, h = max(2, int(w * factor) // 2 * 2), max(2, int(h * factor) // 2 * 2)
+        st = st.filter('scale', w, h)
+    fps = capped_fps(info, settings)
+    if info and fps != info.get('fps', 0):
+        st = st.filter('fps', fps=fps)
+    return st, w, h
+
+def capped_fps(info, settings):
+    # The frame rate the filters see once cap_source has applied max_fps
+    fps, max_fps = (info or {}).get('fps', 0), settings.get('max_fps', 0)
+    return max_fps if max_fps and fps > max_fps else fps
+
+def output_frames(info, settings):
+    # Frames per variant after the caps (what phash.video_tap picks from)
+    return int(capped_fps(info, settings or {}) * (info or {}).get('duration', 0))
+
+def video_output(st, outp, threads=0, audio=None, audio_codec=None, settings=None, metadata=None):
+    # audio is the source's audio stream (None drops audio); it is copied
+    # when the container allows it. Defaults are x264's own (medium, CRF 23).
+    # metadata replaces the source's tags (variant_metadata()).
+    settings = settings or {}
+    kwargs = {
+        'vcodec': 'libx264',
+        'preset': settings.get('preset', 'medium'),
+        'crf': settings.get('crf', 23),
+        'movflags': '+faststart',
+    }
+    if settings.get('tune'):
+        kwargs['tune'] = settings['tune']
+    if threads:
+        kwargs['threads'] = threads
+    if metadata:
+        kwargs.update(metadata_words.ffmpeg_metadata_args(metadata))
+    streams = [st]
+    if audio is not None:
+        streams.append(audio)
+        kwargs['acodec'] = 'copy' if audio_codec in MP4_AUDIO_CODECS else 'aac'
+    return ffmpeg.output(*streams, outp, **kwargs)
+
+def run_ffmpeg(cmd):
+    try:
+        # quiet captures ffmpeg's output; it is printed below if the run fails
+        ffmpeg.run(cmd, overwrite_output=True, quiet=not VERBOSE)
+        log("ffmpeg ran successfully.")
+    except ffmpeg.Error as e:
+        print("ffmpeg exception:", e, file=sys.stderr)
+        print("ffmpeg stdout:\n", e.stdout.decode() if e.stdout else repr(e.stdout), file=sys.stderr)
+        print("ffmpeg stderr:\n", e.stderr.decode() if e.stderr else repr(e.stderr), file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise
+    except Exception as e:
+        print("General exception in ffmpeg logic:", e, file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise
+
+def render_video_variants(src, variants, outps, opts, w, h, info=None, settings=None):
+    # One ffmpeg run per variant: the source is decoded once for every output.
+    # info is the source's probe (probe.probe_video), settings the plan's
+    # encoder options (plan_settings.PLAN_VIDEO_SETTINGS).
+    settings = settings or {}
+    audio_codec = info.get('audio') if info else None
+    for variant, outp in zip(variants, outps):
+        with render_slots() as slots:
+            inp = ffmpeg.input(src)
+            st, vw, vh = cap_source(inp.video, w, h, info, settings)
+            st = apply_video_filters(st, variant, opts, vw, vh)
+            audio = inp.audio if audio_codec else None
+            run_ffmpeg(final_outputs(st, outp, ffmpeg_threads(slots), audio, audio_codec, settings, info))
+
+def render_video_variants_single_pass(src, variants, outps, opts, w, h, info=None, settings=None):
+    # One ffmpeg run for the whole batch: a split filter fans the decoded
+    # frames out to an independently filtered branch (and encoder) per variant.
+    if len(variants) < 2:
+        return render_video_variants(src, variants, outps, opts, w, h, info, settings)
+    settings = settings or {}
+    with render_slots(len(variants)) as slots:
+        threads = ffmpeg_threads(slots, outputs=len(variants))
+        run_ffmpeg(single_pass_cmd(src, variants, outps, opts, w, h, info, settings, threads))
+
+def final_outputs(st, outp, threads, audio, audio_codec, settings, info):
+    # A variant's encode, tagged (variant_metadata), plus the frames its
+    # perceptual hash is taken from (phash.video_tap), split off the same
+    # filtered stream
+    if not phash.PHASH_ENABLED:
+        return video_output(st, outp, threads, audio, audio_codec, settings, variant_metadata())
+    split = st.filter_multi_output('split', 2)
+    return ffmpeg.merge_outputs(
+        video_output(split[0], outp, threads, audio, audio_codec, settings, variant_metadata()),
+        phash.video_tap(split[1], outp, output_frames(info, settings))
+    )
+
+def single_pass_cmd(src, variants, outps, opts, w, h, info, settings, threads, final=True):
+    # final=False: plain encodes, for segment pieces (tagged when joined,
+    # not hashed)
+    audio_codec = info.get('audio') if info else None
+    inp = ffmpeg.input(src)
+    st, vw, vh = cap_source(inp.video, w, h, info, settings)
+    branches = st.filter_multi_output('split', len(variants))
+    # Copied audio needs no split: each output maps the input stream
+    audio = inp.audio if audio_codec else None
+    cmds = []
+    for i, (variant, outp) in enumerate(zip(variants, outps)):
+        st = apply_video_filters(branches[i], variant, opts, vw, vh)
+        if final:
+            cmds.append(final_outputs(st, outp, threads, audio, audio_codec, settings, info))
+        else:
+            cmds.append(video_output(st, outp, threads, audio, audio_codec, settings))
+    return ffmpeg.merge_outputs(*cmds)
+
+def use_segments(info):
+    return bool(VIDEO_SEGMENT_SECONDS) and bool(info) and info.get('duration', 0) >= VIDEO_SEGMENT_MIN_DURATION
+
+def split_segments(src, folder, seconds):
+    # Stream copy can only cut at keyframes, so pieces start on one and
+    # decode on their own; video only, the audio is taken from src at the end
+    pattern = os.path.join(folder, 'source_%05d.mp4')
+    run_ffmpeg(ffmpeg.input(src).video.output(
+        pattern, vcodec='copy', f='segment', segment_time=seconds, reset_timestamps=1
+    ))
+    return sorted(os.path.join(folder, fn) for fn in os.listdir(folder) if fn.startswith('source_'))
+
+def render_segment(seg, variants, outps, opts, w, h, info, settings):
+    # One piece, every variant, one render slot: pieces run side by side.
+    # The variant parameters are the batch's, so the pieces join without seams.
+    with render_slots() as slots:
+        threads = ffmpeg_threads(slots, outputs=len(variants))
+        run_ffmpeg(single_pass_cmd(seg, variants, outps, opts, w, h, info, settings, threads, final=False))
+    return outps
+
+def concat_segments(src, pieces, outp, folder, audio_codec):
+    # Concat demuxer + stream copy: the encoded pieces are joined as-is and
+    # the source's audio is muxed back in whole (no gaps at the joins)
+    listing = os.path.join(folder, os.path.basename(outp) + '.txt')
+    with open(listing, 'w') as f:
+        for piece in pieces:
+            f.write(f"file '{os.path.abspath(piece)}'\n")
+    streams = [ffmpeg.input(listing, f='concat', safe=0).video]
+    kwargs = {'vcodec': 'copy', 'movflags': '+faststart'}
+    metadata = variant_metadata()
+    if metadata:
+        kwargs.update(metadata_words.ffmpeg_metadata_args(metadata))
+    if audio_codec:
+        streams.append(ffmpeg.input(src).audio)
+        kwargs['acodec'] = 'copy' if audio_codec in MP4_AUDIO_CODECS else 'aac'
+    run_ffmpeg(ffmpeg.output(*streams, outp, **kwargs))
+
+def render_video_variants_segmented(src, variants, outps, opts, w, h, info=None, settings=None):
+    # Same contract as render_video_variants_single_pass, for long sources
+    settings = settings or {}
+    os.makedirs(SEGMENT_FOLDER, exist_ok=True)
+    folder = tempfile.mkdtemp(dir=SEGMENT_FOLDER)
+    try:
+        segments = split_segments(src, folder, VIDEO_SEGMENT_SECONDS)
+        if len(segments) < 2:
+            # Too few keyframes to cut at: nothing to gain
+            return render_video_variants_single_pass(src, variants, outps, opts, w, h, info, settings)
+        log(f"Rendering {src} as {len(segments)} segments")
+        seg_info = {**info, 'audio': None}
+        pieces = [[os.path.join(folder, f"variant_{j}_{k:05d}.mp4") for k in range(len(segments))]
+                  for j in range(len(variants))]
+        run_threads(render_segment, [
+            (seg, variants, [pieces[j][k] for j in range(len(variants))], opts, w, h, seg_info, settings)
+            for k, seg in enumerate(segments)
+        ])
+        run_threads(concat_segments, [
+            (src, pieces[j], outp, folder, info.get('audio'))
+            for j, outp in enumerate(outps)
+        ])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def stash_video_source(vf, held):
+    # Put an upload into the content-addressed source store, or find the copy
+    # already there and skip saving it again. Returns (path, source_hash);
+    # the cache owns the path, so callers must not delete it. It is held
+    # (not evicted) until the ExitStack held closes.
+    ext = os.path.splitext(vf.filename)[1]
+    saved = getattr(vf, 'path', None)
+    source_hash = cache.hash_file(saved) if saved else cache.hash_stream(vf.stream)
+    path = cache.lookup_source(source_hash, ext, held)
+    if path:
+        log(f"Source for {vf.filename} already on disk: {path}")
+        if saved:
+            os.remove(saved)
+        return path, source_hash
+    if saved:
+        path = cache.store_source(source_hash, ext, from_path=saved, held=held)
+        move_probe(saved, path)
+        return path, source_hash
+    return cache.store_source(source_hash, ext, stream=vf.stream, held=held), source_hash
+
+def render_video_task(render, src, variants, outps, opts, w, h, info, settings, plan=None):
+    # ffmpeg filters and encodes in one run: 'render' covers both for videos.
+    # Returns (path, perceptual hash) per output; the hash is None where no
+    # frames were tapped (segmented renders, PHASH_ENABLED=0).
+    for outp in outps:
+        unlink_existing(outp)
+    with metrics.timer('render', kind='video', plan=plan):
+        render(src, variants, outps, opts, w, h, info, settings)
+    return [(outp, phash.read_tap(outp)) for outp in outps]
+
+def process_videos_logic(vids, batch, intensity, opts, out=OUTPUT_FOLDER, hist_folder=HISTORY_FOLDER, on_variant=None, settings=None, plan=None, variants=None, on_hash=None):
+    # on_variant(path) is called with each history path as soon as it exists,
+    # on_hash(path, hash) with its perceptual hash (phash.py) for rendered ones;
+    # variants are encoded straight into hist_folder and linked into out (if set).
+    # settings are the plan's encoder options (plan_settings.py), plan only
+    # labels the stage timings (metrics.py). variants, when given (from a
+    # preview), are rendered instead of sampling new ones.
+    # Parameter ranges live in sampler.VIDEO_SPACE
+    rng = sampler.make_rng()
+
+    # Probe and sample every upload first, then render them all in parallel:
+    # one task per upload in single-pass mode, one per variant otherwise.
+    calls = []
+    sources = []
+    to_cache = []
+    # Stored sources in use, held against eviction until the renders are done
+    held = contextlib.ExitStack()
     for vf in vids:
         try:
-            src = os.path.join('uploads', vf.filename)
-            print(f"Saving uploaded video file {vf.filename} to {src}", file=sys.stderr)
-            vf.save(src)
-            print("File saved.", file=sys.stderr)
-            probe = ffmpeg.probe(src)
-            print(f"ffmpeg probe result: {probe}", file=sys.stderr)
-            vs = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-            w, h = int(vs['width']), int(vs['height'])
             name = os.path.splitext(vf.filename)[0]
-            used_params = []
-            for i in range(batch):
-                tries = 0
-                while True:
-                    contrast = scale_range(contrast_min, contrast_max, intensity) if opts.get('contrast') else 0
-                    brightness = scale_range(brightness_min, brightness_max, intensity) if opts.get('brightness') else 0
-                    rotation = scale_range(rotation_min, rotation_max, intensity) if opts.get('rotate') else 0
-                    crop_factor = scale_range(crop_min, crop_max, intensity) if opts.get('crop') else 0
-                    params = (round(contrast, 3), round(brightness, 3), round(rotation, 2), round(crop_factor, 3))
-                    if is_unique(params, used_params):
-                        used_params.append(params)
-                        break
-                    tries += 1
-                    if tries > 50:
-                        print("Warning: couldn't find unique params after 50 tries!")
-                        break
-                outp = os.path.join(out, f"{name}_variant_{i+1}.mp4")
-                hist = os.path.join(hist_folder, f"{name}_variant_{i+1}.mp4")
-                st = ffmpeg.input(src)
-
-                # Contrast & Brightness
-                c = 1 + contrast if opts.get('contrast') else 1
-                b = brightness if opts.get('brightness') else 0
-                if opts.get('contrast') or opts.get('brightness'):
-                    print(f"Applying eq filter with contrast={c}, brightness={b}", file=sys.stderr)
-                    st = st.filter('eq', contrast=c, brightness=b)
-
-                # Rotation
-                if opts.get('rotate'):
-                    angle_rads = rotation * 3.1415926 / 180
-                    print(f"Applying rotate filter with angle (rads): {angle_rads}", file=sys.stderr)
-                    st = st.filter('rotate', angle=angle_rads, fillcolor='black')
-
-                # Crop (then scale back to original size)
-                if opts.get('crop'):
-                    dx = int(w * crop_factor)
-                    dy = int(h * crop_factor)
-                    print(f"Applying crop filter: dx={dx}, dy={dy}", file=sys.stderr)
-                    st = st.filter('crop', w - 2 * dx, h - 2 * dy, dx, dy).filter('scale', w, h)
-
-                # Horizontal flip (randomly, like images)
-                if opts.get('flip') and random.random() > 0.5:
-                    print("Applying hflip filter", file=sys.stderr)
-                    st = st.filter('hflip')
-
-                cmd = ffmpeg.output(st, outp, vcodec='libx264', acodec='aac')
-                try:
-                    ffmpeg.run(cmd, overwrite_output=True)
-                    print("ffmpeg ran successfully.", file=sys.stderr)
-                except ffmpeg.Error as e:
-                    print("ffmpeg exception:", e, file=sys.stderr)
-                    print("ffmpeg stdout:\n", e.stdout.decode() if e.stdout else repr(e.stdout), file=sys.stderr)
-                    print("ffmpeg stderr:\n", e.stderr.decode() if e.stderr else repr(e.stderr), file=sys.stderr)
-                    traceback.print_exc(file=sys.stderr)
-                    raise
-                except Exception as e:
-                    print("General exception in ffmpeg logic:", e, file=sys.stderr)
-                    traceback.print_exc(file=sys.stderr)
-                    raise
-                print(f"Copying output to history: {hist}", file=sys.stderr)
-                shutil.copy(outp, hist)
-            print(f"Removing source file {src}", file=sys.stderr)
-            os.remove(src)
+            if CACHE_ENABLED:
+                src, source_hash = stash_video_source(vf, held)
+            else:
+                # Jobs hand us uploads that are already on disk
+                src = getattr(vf, 'path', None)
+                if src is None:
+                    src = os.path.join('uploads', vf.filename)
+                    log(f"Saving uploaded video file {vf.filename} to {src}")
+                    vf.save(src)
+                    log("File saved.")
+                sources.append(src)
+            if variant_cache():
+                key = cache.variants_key(
+                    source_hash, 'video', batch=batch, intensity=intensity, opts=opts, settings=settings,
+                    upscale=VIDEO_UPSCALE_CROP, **chosen_key(variants)
+                )
+                cached = cache.lookup_variants(key)
+                if cached and len(cached) == batch:
+                    log(f"Cache hit for {vf.filename}")
+                    paths = cache.materialize(cached, name, ([out] if out else []) + [hist_folder])
+                    for path, h in zip(paths, cache.cached_hashes(cached)):
+                        if on_variant:
+                            on_variant(path)
+                        if on_hash:
+                            on_hash(path, h)
+                    continue
+                to_cache.append((key, [os.path.join(hist_folder, f"{name}_variant_{i+1}.mp4") for i in range(batch)]))
+            with metrics.timer('probe', kind='video', plan=plan):
+                info = probe_video(src)
+            if info is None:
+                raise ValueError(f"No video stream in {vf.filename}")
+            w, h = info['width'], info['height']
+            with metrics.timer('sample', kind='video', plan=plan):
+                sampled = variants or sampler.sample_variants(batch, opts, intensity, sampler.VIDEO_SPACE, rng)
+
+            outps = [os.path.join(hist_folder, f"{name}_variant_{i+1}.mp4") for i in range(batch)]
+            if use_segments(info):
+                calls.append((render_video_variants_segmented, src, sampled, outps, opts, w, h, info, settings, plan))
+            elif VIDEO_SINGLE_PASS:
+                calls.append((render_video_variants_single_pass, src, sampled, outps, opts, w, h, info, settings, plan))
+            else:
+                calls.extend(
+                    (render_video_variants, src, [variant], [outp], opts, w, h, info, settings, plan)
+                    for variant, outp in zip(sampled, outps)
+                )
         except Exception as e:
             print(f"Exception in process_videos_logic for video {vf.filename}: {e}", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
+            held.close()
             raise
+
+    try:
+        hashes = {}
+
+        def task_done(done):
+            for hist, h in done:
+                hashes[hist] = h
+                if out:
+                    storage.link(hist, os.path.join(out, os.path.basename(hist)))
+                if on_variant:
+                    on_variant(hist)
+                if on_hash:
+                    on_hash(hist, h)
+        run_threads(render_video_task, calls, on_result=task_done)
+        for key, paths in to_cache:
+            cache.store_variants(key, paths, [hashes.get(p) for p in paths])
+    except Exception as e:
+        print(f"Exception in process_videos_logic: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise
+    finally:
+        held.close()
+        # Only uploads saved outside the cache are ours to remove
+        for src in sources:
+            if os.path.exists(src):
+                log(f"Removing source file {src}")
+                os.remove(src)
+            if os.path.exists(src + PROBE_SUFFIX):
+                os.remove(src + PROBE_SUFFIX)
@@ -0,0 +1,347 @@
+# jobs.py
+# Local job queue for the heavy processing endpoints.
+# Jobs live in a small SQLite database (no external broker); a pool of worker
+# processes started by worker.py claims them one at a time.
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import traceback
+import multiprocessing
+import metrics
+from werkzeug.datastructures import FileStorage
+
+JOBS_DB = os.getenv('JOBS_DB', os.path.join('instance', 'jobs.db'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+# Runs a job gets before a worker dying under it fails it for good (a source
+# that crashes the codec would otherwise take down worker after worker)
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))
+JOB_UPLOAD_FOLDER = os.path.join('uploads', 'jobs')
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    queue       TEXT NOT NULL DEFAULT 'default',
+    kind        TEXT NOT NULL,
+    user_id     INTEGER,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    current     TEXT,
+    done        INTEGER NOT NULL DEFAULT 0,
+    total       INTEGER NOT NULL DEFAULT 0,
+    payload     TEXT,
+    result      TEXT,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    worker_pid  INTEGER,
+    attempts    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (queue, status, created_at);
+"""
+# Columns added after the table first shipped: (name, definition)
+ADDED_COLUMNS = (('current', 'TEXT'), ('worker_pid', 'INTEGER'), ('attempts', 'INTEGER NOT NULL DEFAULT 0'))
+_columns_checked = False
+
+# kind -> callable(job, progress); filled in by @handler in app.py
+HANDLERS = {}
+# kind -> callable(job), run (in an app context) when a job is failed because
+# its worker died; undoes what the handler could not (see abandon)
+ABANDON_HANDLERS = {}
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+def on_abandon(kind):
+    def register(fn):
+        ABANDON_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def _connect():
+    os.makedirs(os.path.dirname(JOBS_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    _add_missing_columns(conn)
+    return conn
+
+def _add_missing_columns(conn):
+    global _columns_checked
+    if _columns_checked:
+        return
+    have = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for name, definition in ADDED_COLUMNS:
+        if name not in have:
+            try:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            except sqlite3.OperationalError:
+                # Another process added it first
+                pass
+    _columns_checked = True
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+class StoredUpload(FileStorage):
+    # An upload saved under uploads/jobs/<id>/ by the web tier, reopened in the
+    # worker so the processing logic sees the same FileStorage interface.
+    # filename (default: the saved name) is what the variants are named after.
+    def __init__(self, path, filename=None):
+        super().__init__(stream=open(path, 'rb'), filename=filename or os.path.basename(path))
+        self.path = path
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+def job_upload_dir(job_id):
+    return os.path.join(JOB_UPLOAD_FOLDER, job_id)
+
+def enqueue(kind, payload, user_id=None, total=0, queue='default', job_id=None):
+    job_id = job_id or new_job_id()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, queue, kind, user_id, status, total, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, queue, kind, user_id, QUEUED, total, json.dumps(payload), time.time())
+        )
+    finally:
+        conn.close()
+    return job_id
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+def claim(queue='default', job_id=None):
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+    # pick the same row. Passing job_id claims that specific job (inline mode).
+    # The claiming process is recorded, so its death can be noticed (abandon).
+    conn = _connect()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if job_id:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE id = ? AND status = ?", (job_id, QUEUED)
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE queue = ? AND status = ? ORDER BY created_at LIMIT 1",
+                (queue, QUEUED)
+            ).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, worker_pid = ?, attempts = attempts + 1 WHERE id = ?",
+            (RUNNING, time.time(), os.getpid(), row['id'])
+        )
+        conn.execute('COMMIT')
+        job = _row_to_job(row)
+        job.update(status=RUNNING, worker_pid=os.getpid(), attempts=job['attempts'] + 1)
+        return job
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def update_progress(job_id, done=None, total=None, stage=None, current=None):
+    sets, args = [], []
+    for col, val in (('done', done), ('total', total), ('stage', stage), ('current', current)):
+        if val is not None:
+            sets.append(f"{col} = ?")
+            args.append(val)
+    if not sets:
+        return
+    conn = _connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id = ?", (*args, job_id))
+    finally:
+        conn.close()
+
+def finish(job_id, result):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = NULL, current = NULL, done = total, result = ?, finished_at = ? "
+            "WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+def fail(job_id, error):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+def requeue_stale():
+    # Jobs left 'running' by a worker that died get picked up again.
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, worker_pid = NULL WHERE status = ?",
+            (QUEUED, RUNNING)
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def abandon(pid):
+    # The worker process pid died mid-job (segfault, OOM kill): its job goes
+    # back to the queue, or fails once it has had JOB_MAX_ATTEMPTS runs.
+    # Returns [(job, requeued)].
+    conn = _connect()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? AND worker_pid = ?", (RUNNING, pid)
+        ).fetchall()
+        out = []
+        for row in rows:
+            if row['attempts'] < JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, stage = NULL, current = NULL, done = 0, started_at = NULL, "
+                    "worker_pid = NULL WHERE id = ?", (QUEUED, row['id'])
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (FAILED, 'The worker running this job stopped unexpectedly', time.time(), row['id'])
+                )
+            out.append((_row_to_job(row), row['attempts'] < JOB_MAX_ATTEMPTS))
+        conn.execute('COMMIT')
+        return out
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def recover(app, pid):
+    # Called by the supervisor for each worker found dead
+    for job, requeued in abandon(pid):
+        if requeued:
+            print(f"Job {job['id']} ({job['kind']}) requeued after its worker died", file=sys.stderr)
+            continue
+        print(f"Job {job['id']} ({job['kind']}) failed: its worker died {job['attempts']} time(s)", file=sys.stderr)
+        fn = ABANDON_HANDLERS.get(job['kind'])
+        if fn is None:
+            continue
+        try:
+            with app.app_context():
+                fn(job)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+
+def eta_seconds(job, now=None):
+    # Straight-line estimate from the variants done so far; None until the
+    # first one lands
+    if job['status'] != RUNNING or not job['started_at'] or not job['done']:
+        return None
+    elapsed = (now or time.time()) - job['started_at']
+    return max(0.0, elapsed / job['done'] * (job['total'] - job['done']))
+
+def public_view(job):
+    # What /jobs/<id> (and its event stream) exposes to the browser.
+    eta = eta_seconds(job)
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'current': job.get('current'),
+        'done': job['done'],
+        'total': job['total'],
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'result': job['result'],
+        'error': job['error'],
+    }
+
+def run_job(job):
+    fn = HANDLERS.get(job['kind'])
+    if fn is None:
+        fail(job['id'], f"No handler for job kind '{job['kind']}'")
+        return None
+
+    def progress(done=None, total=None, stage=None, current=None):
+        update_progress(job['id'], done=done, total=total, stage=stage, current=current)
+
+    try:
+        result = fn(job, progress)
+    except Exception as e:
+        print(f"Job {job['id']} ({job['kind']}) failed: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        fail(job['id'], str(e) or e.__class__.__name__)
+        return None
+    finish(job['id'], result)
+    return result
+
+# -------------------- Worker pool --------------------
+def _worker_loop(app, queue, poll_interval=JOB_POLL_INTERVAL):
+    while True:
+        job = claim(queue)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        with app.app_context():
+            run_job(job)
+        # Stage timings go out between jobs, not only every few seconds
+        metrics.flush()
+
+def _spawn_worker(app, queue, poll_interval=JOB_POLL_INTERVAL):
+    # Not daemonic: workers may start their own subprocesses (ffmpeg, pools).
+    p = multiprocessing.Process(target=_worker_loop, args=(app, queue, poll_interval))
+    p.start()
+    return p
+
+def run_workers(app, concurrency=JOB_WORKERS, queue='default', pools=()):
+    # pools adds (queue, concurrency, poll_interval) pools, supervised
+    # alongside the main one, e.g. the preview queue (preview.py)
+    requeued = requeue_stale()
+    if requeued:
+        print(f"Requeued {requeued} stale job(s)", file=sys.stderr)
+    specs = [(queue, concurrency, JOB_POLL_INTERVAL)] + list(pools)
+    procs = []
+    for q, n, poll_interval in specs:
+        spawn = (q, poll_interval)
+        procs.extend((spawn, _spawn_worker(app, *spawn)) for _ in range(max(1, n)))
+        print(f"Started {max(1, n)} worker(s) on queue '{q}'", file=sys.stderr)
+    try:
+        # Restart any worker that crashes hard (segfault in a codec, OOM kill...)
+        while True:
+            for i, (spawn, p) in enumerate(procs):
+                if not p.is_alive():
+                    print(f"Worker {p.pid} exited ({p.exitcode}); restarting", file=sys.stderr)
+                    # Before spawning: the new worker may be handed the same pid
+                    recover(app, p.pid)
+                    procs[i] = (spawn, _spawn_worker(app, *spawn))
+            time.sleep(1)
+    finally:
+        for _, p in procs:
+            p.terminate()
@@ -1,5 +1,6 @@
 import random
 from datetime import datetime, timedelta
+import piexif
 
 METADATA_WORDS = {
     "title": [
@@ -50,3 +51,45 @@ def random_exif_fields():
         "gps_lat": random.uniform(-90, 90),
         "gps_lon": random.uniform(-180, 180),
     }
+
+# The random fields in the form each encoder takes, so tags are written by
+# the same save/ffmpeg run that produces a variant (image_videoprocessing.py)
+def ffmpeg_metadata_args(fields):
+    # ffmpeg output options: drop everything copied from the source
+    # (global, stream and chapter metadata), then set the new tags.
+    # ffmpeg-python takes options as kwargs, so repeated -metadata options
+    # need distinct keys; ffmpeg ignores what follows the 'g' specifier.
+    args = {'map_metadata': -1, 'map_chapters': -1}
+    for i, (key, value) in enumerate(fields.items()):
+        args[f'metadata:g:{i}'] = f'{key}={value}'
+    return args
+
+def exif_rational(degrees):
+    # Degrees as EXIF degrees/minutes/seconds rationals
+    d = int(degrees)
+    m = int((degrees - d) * 60)
+    s = min(5999, round(((degrees - d) * 60 - m) * 60 * 100))
+    return ((d, 1), (m, 1), (s, 100))
+
+def exif_bytes(fields):
+    # EXIF block for PIL's save(exif=...), from random_exif_fields()
+    stamp = fields["datetime"].replace("-", ":")
+    lat, lon = fields["gps_lat"], fields["gps_lon"]
+    return piexif.dump({
+        "0th": {
+            piexif.ImageIFD.Artist: fields["artist"],
+            piexif.ImageIFD.ImageDescription: fields["description"],
+            piexif.ImageIFD.Copyright: fields["copyright"],
+            piexif.ImageIFD.DateTime: stamp,
+        },
+        "Exif": {
+            piexif.ExifIFD.DateTimeOriginal: stamp,
+            piexif.ExifIFD.DateTimeDigitized: stamp,
+        },
+        "GPS": {
+            piexif.GPSIFD.GPSLatitudeRef: "N" if lat >= 0 else "S",
+            piexif.GPSIFD.GPSLatitude: exif_rational(abs(lat)),
+            piexif.GPSIFD.GPSLongitudeRef: "E" if lon >= 0 else "W",
+            piexif.GPSIFD.GPSLongitude: exif_rational(abs(lon)),
+        },
+    })
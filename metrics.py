@@ -0,0 +1,166 @@
+# metrics.py
+# Per-stage timings for the processing pipeline, as Prometheus histograms
+# (stage_seconds{stage, kind, plan}) served by /metrics. Stages:
+#   receive, probe (videos), decode, sample, render, phash (images), encode,
+#   history_write, history_index, phash_index, thumbnails, zip, drive_upload,
+#   drive_upload_bundle (several small archives as one upload), preview
+# and, inside an image's render, one stage per filter: filter_tone and
+# filter_warp for the NumPy engine (contrast+brightness are one LUT pass,
+# rotate+crop+flip one warp), filter_contrast, filter_brightness,
+# filter_rotate, filter_crop and filter_flip for the PIL chain. A video's
+# filters run in ffmpeg's filter graph alongside the encoder, so videos
+# only have render.
+# Stages run in web processes, job workers and render pool processes alike,
+# so observations are buffered per process and flushed into one SQLite file
+# (every METRICS_FLUSH_INTERVAL seconds, at the end of a render chunk, and
+# at exit); /metrics reads the totals back from there.
+import os
+import time
+import atexit
+import sqlite3
+import threading
+import contextlib
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_DB = os.getenv('METRICS_DB', os.path.join('instance', 'metrics.db'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# Bearer token /metrics asks for; unset leaves the endpoint open to scrapers
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRIC_NAME = 'metadatachanger_stage_seconds'
+
+# Upper bounds (seconds); a stage spans ~1ms (sampling) to minutes (encodes)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_buckets (
+    stage  TEXT NOT NULL,
+    kind   TEXT NOT NULL,
+    plan   TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count  INTEGER NOT NULL,
+    PRIMARY KEY (stage, kind, plan, bucket)
+);
+CREATE TABLE IF NOT EXISTS stage_totals (
+    stage TEXT NOT NULL,
+    kind  TEXT NOT NULL,
+    plan  TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum   REAL NOT NULL,
+    PRIMARY KEY (stage, kind, plan)
+);
+"""
+
+_lock = threading.Lock()
+# (stage, kind, plan) -> [per-bucket counts..., +Inf count, count, sum]
+_pending = {}
+_last_flush = time.monotonic()
+
+def _connect():
+    os.makedirs(os.path.dirname(METRICS_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(METRICS_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def bucket_index(seconds):
+    for i, le in enumerate(BUCKETS):
+        if seconds <= le:
+            return i
+    return len(BUCKETS)
+
+def observe(stage, seconds, kind='', plan=''):
+    if not METRICS_ENABLED:
+        return
+    key = (stage, kind or '', plan or '')
+    with _lock:
+        row = _pending.get(key)
+        if row is None:
+            row = _pending[key] = [0] * (len(BUCKETS) + 1) + [0, 0.0]
+        row[bucket_index(seconds)] += 1
+        row[-2] += 1
+        row[-1] += seconds
+        due = time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL
+    if due:
+        flush()
+
+@contextlib.contextmanager
+def timer(stage, kind='', plan=''):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, kind, plan)
+
+def stage_timer(labels):
+    # timer() with kind/plan bound, for code timing several stages in a row;
+    # labels None times nothing (callers outside a batch, e.g. previews)
+    if labels is None:
+        return lambda stage: contextlib.nullcontext()
+    return lambda stage: timer(stage, **labels)
+
+def flush():
+    global _pending, _last_flush
+    with _lock:
+        pending, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    try:
+        conn = _connect()
+    except sqlite3.Error:
+        return
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for (stage, kind, plan), row in pending.items():
+            conn.executemany(
+                "INSERT INTO stage_buckets (stage, kind, plan, bucket, count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(stage, kind, plan, bucket) DO UPDATE SET count = count + excluded.count",
+                [(stage, kind, plan, i, n) for i, n in enumerate(row[:-2]) if n]
+            )
+            conn.execute(
+                "INSERT INTO stage_totals (stage, kind, plan, count, sum) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(stage, kind, plan) DO UPDATE SET count = count + excluded.count, sum = sum + excluded.sum",
+                (stage, kind, plan, row[-2], row[-1])
+            )
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        # Metrics are best effort: never fail a render over them
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+    finally:
+        conn.close()
+
+atexit.register(flush)
+
+def _labels(stage, kind, plan, le=None):
+    pairs = [('stage', stage), ('kind', kind), ('plan', plan)]
+    if le is not None:
+        pairs.append(('le', le))
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def render():
+    # Prometheus text exposition format (version 0.0.4)
+    flush()
+    conn = _connect()
+    try:
+        buckets = conn.execute("SELECT stage, kind, plan, bucket, count FROM stage_buckets").fetchall()
+        totals = conn.execute("SELECT stage, kind, plan, count, sum FROM stage_totals ORDER BY stage, kind, plan").fetchall()
+    finally:
+        conn.close()
+    counts = {}
+    for stage, kind, plan, bucket, count in buckets:
+        counts.setdefault((stage, kind, plan), {})[bucket] = count
+    lines = [
+        f'# HELP {METRIC_NAME} Time spent in each processing stage.',
+        f'# TYPE {METRIC_NAME} histogram',
+    ]
+    for stage, kind, plan, count, total in totals:
+        per_bucket = counts.get((stage, kind, plan), {})
+        cumulative = 0
+        for i, le in enumerate(BUCKETS):
+            cumulative += per_bucket.get(i, 0)
+            lines.append(f'{METRIC_NAME}_bucket{_labels(stage, kind, plan, f"{le:g}")} {cumulative}')
+        lines.append(f'{METRIC_NAME}_bucket{_labels(stage, kind, plan, "+Inf")} {count}')
+        lines.append(f'{METRIC_NAME}_sum{_labels(stage, kind, plan)} {total:.6f}')
+        lines.append(f'{METRIC_NAME}_count{_labels(stage, kind, plan)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,41 @@
+"""Add history_item index table
+
+Revision ID: 3f1c2a9d7e41
+Revises: b6e960b45c1b
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e41'
+down_revision = 'b6e960b45c1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('history_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('job_id', sa.String(length=32), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('history_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_history_item_filename'), ['filename'], unique=False)
+        batch_op.create_index('ix_history_item_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('history_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_history_item_user_id_id')
+        batch_op.drop_index(batch_op.f('ix_history_item_filename'))
+
+    op.drop_table('history_item')
@@ -0,0 +1,39 @@
+"""Add token_reservation table
+
+Revision ID: 8d2e4b7a1c53
+Revises: 3f1c2a9d7e41
+Create Date: 2026-10-18 10:41:07.552310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b7a1c53'
+down_revision = '3f1c2a9d7e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_reservation',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('job_id', sa.String(length=32), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('settled_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('token_reservation', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_token_reservation_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('token_reservation', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_token_reservation_user_id'))
+
+    op.drop_table('token_reservation')
@@ -0,0 +1,30 @@
+"""Index user Stripe and referral lookup columns
+
+Revision ID: c47a19e0d2b8
+Revises: 8d2e4b7a1c53
+Create Date: 2026-10-18 11:26:53.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a19e0d2b8'
+down_revision = '8d2e4b7a1c53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_stripe_customer_id'), ['stripe_customer_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_stripe_subscription_id'), ['stripe_subscription_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_referred_by_id'), ['referred_by_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_referred_by_id'))
+        batch_op.drop_index(batch_op.f('ix_user_stripe_subscription_id'))
+        batch_op.drop_index(batch_op.f('ix_user_stripe_customer_id'))
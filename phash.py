@@ -0,0 +1,268 @@
+# phash.py
+# Perceptual hashes of the variants we actually output, so "distinct" is
+# measured on pixels rather than on parameter tuples. A hash is 64 bits:
+#   phash: signs of the 8x8 lowest DCT frequencies of a 32x32 grey thumbnail
+#          against their median (robust to re-encoding and small shifts)
+#   dhash: signs of horizontal gradients on a 9x8 grey thumbnail (cheaper)
+# Both work on a stack of thumbnails at once with NumPy. Images are hashed
+# from the rendered variant before it is encoded; videos from a few frames
+# tapped off the filter graph feeding the encoder (video_tap), averaged.
+# Hashes live in a SQLite table; lookups scan a per-process NumPy copy of
+# the user's hashes (XOR + popcount over a uint64 array), refreshed with
+# only the rows added since: a batch of ten against 100k history items
+# takes a few milliseconds (bench/bench_phash.py).
+import os
+import time
+import sqlite3
+import threading
+import collections
+import numpy as np
+import cv2
+
+PHASH_ENABLED = os.getenv('PHASH_ENABLED', '1') == '1'
+PHASH_DB = os.getenv('PHASH_DB', os.path.join('instance', 'phash.db'))
+# 'phash' or 'dhash'
+PHASH_ALGO = os.getenv('PHASH_ALGO', 'phash')
+# Hashes this many bits apart or fewer count as near-duplicates
+PHASH_THRESHOLD = int(os.getenv('PHASH_THRESHOLD', 6))
+# Image variants re-sampled this many times at most when they come out too
+# close to a sibling (image_videoprocessing.render_image_variants)
+PHASH_RESAMPLE = int(os.getenv('PHASH_RESAMPLE', 2))
+# Frames per video variant taken for its hash
+PHASH_VIDEO_FRAMES = int(os.getenv('PHASH_VIDEO_FRAMES', 3))
+# Nearest history matches checked against the table per variant
+MAX_MATCHES = 5
+# Users whose hashes a process keeps in memory (least recently used go)
+CACHED_INDEXES = int(os.getenv('PHASH_CACHED_INDEXES', 64))
+
+THUMB = 32
+TAP_SUFFIX = '.phash.tmp'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS variant_hashes (
+    id         INTEGER PRIMARY KEY,
+    user_id    INTEGER,
+    kind       TEXT NOT NULL,
+    filename   TEXT NOT NULL,
+    hash       INTEGER NOT NULL,
+    job_id     TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_variant_hashes_user ON variant_hashes (user_id, kind, id);
+CREATE INDEX IF NOT EXISTS ix_variant_hashes_filename ON variant_hashes (filename);
+"""
+
+def _connect():
+    os.makedirs(os.path.dirname(PHASH_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(PHASH_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+# -------------------- Hashing --------------------
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    m = np.sqrt(2 / n) * np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m
+
+DCT = _dct_matrix(THUMB)
+
+def grey_thumbnail(arr):
+    # HxW, HxWx3 or HxWx4 uint8 -> 32x32 float32 luma (area average)
+    small = cv2.resize(arr, (THUMB, THUMB), interpolation=cv2.INTER_AREA).astype(np.float32)
+    if small.ndim == 2:
+        return small
+    return small[..., 0] * 0.299 + small[..., 1] * 0.587 + small[..., 2] * 0.114
+
+def image_thumbnail(img):
+    # PIL image (any mode) -> grey thumbnail
+    if img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return grey_thumbnail(np.asarray(img))
+
+def pack(bits):
+    # (N, 64) bools -> N uint64, first bit most significant
+    return np.packbits(bits, axis=1).view('>u8')[:, 0].astype(np.uint64)
+
+def phash_bits(thumbs):
+    coeffs = DCT @ thumbs @ DCT.T
+    low = coeffs[:, :8, :8].reshape(len(thumbs), 64)
+    # The DC term only says how bright the frame is
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return low > median
+
+def dhash_bits(thumbs):
+    small = np.stack([cv2.resize(t, (9, 8), interpolation=cv2.INTER_AREA) for t in thumbs])
+    return (small[:, :, 1:] > small[:, :, :-1]).reshape(len(thumbs), 64)
+
+def hash_thumbnails(thumbs):
+    # Stack of grey thumbnails -> one Python int per thumbnail
+    thumbs = np.asarray(thumbs, dtype=np.float32).reshape(-1, THUMB, THUMB)
+    bits = dhash_bits(thumbs) if PHASH_ALGO == 'dhash' else phash_bits(thumbs)
+    return [int(h) for h in pack(bits)]
+
+def hash_image(img):
+    return hash_thumbnails([image_thumbnail(img)])[0]
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(a):
+        return np.bitwise_count(a)
+else:
+    _POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(a):
+        return _POPCOUNT8[a.view(np.uint8)].reshape(a.shape + (8,)).sum(axis=-1)
+
+def distances(queries, hashes):
+    # Hamming distance of every query to every hash: (len(queries), len(hashes))
+    q = np.asarray(queries, dtype=np.uint64).reshape(-1, 1)
+    return popcount(q ^ np.asarray(hashes, dtype=np.uint64).reshape(1, -1))
+
+def to_signed(h):
+    # SQLite integers are signed 64-bit
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+# -------------------- Video --------------------
+def tap_path(outp):
+    return outp + TAP_SUFFIX
+
+def frame_select(total, n=None):
+    # select filter expression picking n frames spread over a stream of
+    # total frames (0 if unknown: the first frame only)
+    n = n or PHASH_VIDEO_FRAMES
+    if total <= 0:
+        return 'eq(n,0)'
+    return '+'.join(f'eq(n,{int(total * (k + 0.5) / n)})' for k in range(n))
+
+def video_tap(st, outp, total):
+    # Extra output on a variant's filtered stream: a few 32x32 grey frames
+    # as raw bytes next to outp, hashed once the encode is done. total is
+    # the frame count of st, i.e. after any frame-rate cap.
+    st = st.filter('select', frame_select(total)).filter('scale', THUMB, THUMB, flags='area').filter('format', 'gray')
+    return st.output(tap_path(outp), f='rawvideo', fps_mode='passthrough')
+
+def read_tap(outp):
+    # Hash of the frames video_tap wrote for outp (removed afterwards); None
+    # if no frame made it out
+    path = tap_path(outp)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    frames = np.frombuffer(data, dtype=np.uint8)
+    if len(frames) < THUMB * THUMB:
+        return None
+    frames = frames[:len(frames) // (THUMB * THUMB) * THUMB * THUMB].reshape(-1, THUMB, THUMB)
+    return hash_thumbnails([frames.mean(axis=0)])[0]
+
+# -------------------- Index --------------------
+class UserIndex:
+    # One user's hashes of one kind, in arrays; catches up on rows added
+    # since the last lookup. Rows deleted in the meantime may linger here,
+    # so matches are confirmed against the table before they are reported.
+    def __init__(self):
+        self.last_id = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def refresh(self, conn, user_id, kind):
+        rows = conn.execute(
+            "SELECT id, hash FROM variant_hashes WHERE user_id IS ? AND kind = ? AND id > ? ORDER BY id",
+            (user_id, kind, self.last_id)
+        ).fetchall()
+        if rows:
+            new = np.array(rows, dtype=np.int64)
+            self.ids = np.concatenate([self.ids, new[:, 0]])
+            self.hashes = np.concatenate([self.hashes, np.ascontiguousarray(new[:, 1]).view(np.uint64)])
+            self.last_id = int(new[-1, 0])
+
+    def drop(self, dead):
+        keep = ~np.isin(self.ids, list(dead))
+        self.ids, self.hashes = self.ids[keep], self.hashes[keep]
+
+_indexes = collections.OrderedDict()
+_lock = threading.Lock()
+
+def user_index(conn, user_id, kind):
+    with _lock:
+        key = (user_id, kind)
+        index = _indexes.pop(key, None) or UserIndex()
+        _indexes[key] = index
+        while len(_indexes) > CACHED_INDEXES:
+            _indexes.popitem(last=False)
+        index.refresh(conn, user_id, kind)
+        return index
+
+def batch_matches(items):
+    # Each variant against the ones before it in the batch (closest one)
+    if len(items) < 2:
+        return []
+    d = distances([h for _, h in items], [h for _, h in items])
+    found = []
+    for i in range(1, len(items)):
+        j = int(np.argmin(d[i, :i]))
+        if d[i, j] <= PHASH_THRESHOLD:
+            found.append({'file': items[i][0], 'match': items[j][0], 'distance': int(d[i, j]), 'scope': 'batch'})
+    return found
+
+def history_matches(conn, index, items):
+    # Each variant against the user's earlier ones, nearest first. Files the
+    # batch is about to replace (same name) are not earlier variants.
+    if not len(index.ids):
+        return []
+    names = {fn for fn, _ in items}
+    found, dead = [], set()
+    for fn, h in items:
+        row = popcount(index.hashes ^ np.uint64(h))
+        close = np.nonzero(row <= PHASH_THRESHOLD)[0]
+        for k in close[np.argsort(row[close], kind='stable')][:MAX_MATCHES]:
+            hit = conn.execute("SELECT filename FROM variant_hashes WHERE id = ?", (int(index.ids[k]),)).fetchone()
+            if hit is None:
+                dead.add(int(index.ids[k]))
+            elif hit[0] not in names:
+                found.append({'file': fn, 'match': hit[0], 'distance': int(row[k]), 'scope': 'history'})
+                break
+    if dead:
+        with _lock:
+            index.drop(dead)
+    return found
+
+def check_and_record(user_id, kind, items, job_id=None):
+    # items: [(filename, hash)] for one batch. Returns its near-duplicates
+    # (within the batch and against the user's history), then adds the
+    # batch to the index, replacing the user's rows for the same filenames.
+    items = [(fn, h) for fn, h in items if h is not None]
+    if not PHASH_ENABLED or not items:
+        return []
+    conn = _connect()
+    try:
+        found = batch_matches(items) + history_matches(conn, user_index(conn, user_id, kind), items)
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany("DELETE FROM variant_hashes WHERE filename = ? AND user_id IS ?",
+                         [(fn, user_id) for fn, _ in items])
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO variant_hashes (user_id, kind, filename, hash, job_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, kind, fn, to_signed(h), job_id, now) for fn, h in items]
+        )
+        conn.execute('COMMIT')
+        return found
+    finally:
+        conn.close()
+
+def forget(user_id, filenames):
+    # History files removed (retention.py): their hashes go too, for that
+    # user only
+    if not filenames:
+        return
+    conn = _connect()
+    try:
+        conn.executemany("DELETE FROM variant_hashes WHERE filename = ? AND user_id IS ?",
+                         [(fn, user_id) for fn in filenames])
+    finally:
+        conn.close()
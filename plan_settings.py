@@ -0,0 +1,86 @@
+# plan_settings.py
+# Per-plan rendering settings, looked up the same way as tokens.PLAN_TOKEN_AMOUNTS.
+
+# max_dimension: longest side the source is decoded/downscaled to before
+#   rendering (0 = native resolution). JPEGs use draft-mode decoding for it.
+# quality/optimize/progressive/subsampling: Pillow JPEG encoder options.
+# png_compress_level: zlib level for variants that keep transparency.
+PLAN_IMAGE_SETTINGS = {
+    'free': {
+        'max_dimension': 2048,
+        'quality': 80,
+        'optimize': False,
+        'progressive': False,
+        'subsampling': '4:2:0',
+        'png_compress_level': 6,
+    },
+    'pro': {
+        'max_dimension': 4096,
+        'quality': 90,
+        'optimize': True,
+        'progressive': True,
+        'subsampling': '4:2:0',
+        'png_compress_level': 6,
+    },
+    'pro+': {
+        'max_dimension': 0,
+        'quality': 95,
+        'optimize': True,
+        'progressive': True,
+        'subsampling': '4:4:4',
+        'png_compress_level': 6,
+    },
+}
+
+def image_settings(plan):
+    return PLAN_IMAGE_SETTINGS.get(plan, PLAN_IMAGE_SETTINGS['free'])
+
+# preset/crf/tune: libx264 options (tune None = untuned).
+# max_dimension: long side the source is scaled down to before filtering
+#   (0 = native); max_fps: frame rate cap (0 = keep the source rate).
+PLAN_VIDEO_SETTINGS = {
+    'free': {
+        'preset': 'veryfast',
+        'crf': 26,
+        'tune': None,
+        'max_dimension': 1280,
+        'max_fps': 30,
+    },
+    'pro': {
+        'preset': 'fast',
+        'crf': 23,
+        'tune': None,
+        'max_dimension': 1920,
+        'max_fps': 60,
+    },
+    'pro+': {
+        'preset': 'medium',
+        'crf': 20,
+        'tune': None,
+        'max_dimension': 0,
+        'max_fps': 0,
+    },
+}
+
+def video_settings(plan):
+    return PLAN_VIDEO_SETTINGS.get(plan, PLAN_VIDEO_SETTINGS['free'])
+
+# How long rendered variants stay in history, and how much history a user
+# may keep, before retention.py removes the oldest (0 = no limit).
+PLAN_RETENTION = {
+    'free': {
+        'history_ttl_days': 7,
+        'history_quota_mb': 500,
+    },
+    'pro': {
+        'history_ttl_days': 30,
+        'history_quota_mb': 5 * 1024,
+    },
+    'pro+': {
+        'history_ttl_days': 90,
+        'history_quota_mb': 20 * 1024,
+    },
+}
+
+def retention_settings(plan):
+    return PLAN_RETENTION.get(plan, PLAN_RETENTION['free'])
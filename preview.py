@@ -0,0 +1,90 @@
+# preview.py
+# A quick, low-resolution look at a batch before any tokens are spent: the
+# same sampled variants and the same filters as the full render, on a source
+# downscaled to PREVIEW_SIZE. Images get one small JPEG per variant; videos
+# get PREVIEW_FRAMES stills per variant, spread over the clip, from a single
+# ffmpeg run (fast input seeks, one frame each). The sampled parameters go
+# back to the browser so the full render can reuse exactly those variants.
+# Previews run on their own job queue (PREVIEW_QUEUE, see worker.py) and
+# outside the render slots, so they never wait behind a long encode.
+import io
+import os
+import ffmpeg
+from PIL import Image
+from image_videoprocessing import iter_image_variants, open_source, apply_video_filters, run_ffmpeg
+from probe import probe_video
+
+PREVIEW_FOLDER = os.path.join('static', 'previews')
+PREVIEW_QUEUE = 'preview'
+# Longest side of a preview, in pixels
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', 256))
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', 70))
+# Stills per video variant
+PREVIEW_FRAMES = int(os.getenv('PREVIEW_FRAMES', 3))
+# How long a preview (its images and the token that commits its variants) lasts
+PREVIEW_TTL = float(os.getenv('PREVIEW_TTL_MINUTES', 60)) * 60
+# How long the preview request waits for a worker before answering 202
+PREVIEW_TIMEOUT = float(os.getenv('PREVIEW_TIMEOUT', 10))
+
+def encode_preview(img):
+    buf = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        # Flatten onto white: a JPEG can't carry the alpha channel
+        img = img.convert("RGBA")
+        flat = Image.new("RGB", img.size, (255, 255, 255))
+        flat.paste(img, mask=img.getchannel("A"))
+        img = flat
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    img.save(buf, format="JPEG", quality=PREVIEW_QUALITY)
+    return buf.getvalue()
+
+def preview_image(src, name, variants, opts, folder):
+    # One list of paths per variant (a single still each)
+    with open(src, 'rb') as f:
+        img = open_source(f.read(), PREVIEW_SIZE)
+    paths = []
+    for i, var in enumerate(iter_image_variants(img, variants, opts)):
+        path = os.path.join(folder, f"{name}_variant_{i+1}.jpg")
+        with open(path, 'wb') as f:
+            f.write(encode_preview(var))
+        paths.append([path])
+    return paths
+
+def frame_times(duration, n):
+    # n timestamps at the middle of n equal slices of the clip
+    if duration <= 0:
+        return [0.0]
+    return [duration * (k + 0.5) / n for k in range(max(1, n))]
+
+def preview_size(w, h):
+    factor = min(1.0, PREVIEW_SIZE / max(w, h))
+    # Even sizes, so the planned crops line up as they do on 4:2:0 sources
+    return max(2, int(w * factor) // 2 * 2), max(2, int(h * factor) // 2 * 2)
+
+def preview_video(src, name, variants, opts, folder):
+    # One list of paths per variant, one still per timestamp
+    info = probe_video(src)
+    if info is None:
+        raise ValueError(f"No video stream in {os.path.basename(src)}")
+    w, h = preview_size(info['width'], info['height'])
+    paths = [[] for _ in variants]
+    outputs = []
+    for k, t in enumerate(frame_times(info['duration'], PREVIEW_FRAMES)):
+        st = ffmpeg.input(src, ss=t).video.filter('scale', w, h)
+        branches = st.filter_multi_output('split', len(variants))
+        for i, variant in enumerate(variants):
+            path = os.path.join(folder, f"{name}_variant_{i+1}_{k+1}.jpg")
+            outputs.append(ffmpeg.output(apply_video_filters(branches[i], variant, opts, w, h), path, vframes=1))
+            paths[i].append(path)
+    run_ffmpeg(ffmpeg.merge_outputs(*outputs))
+    return paths
+
+def render_previews(kind, sources, variants, opts, folder):
+    # sources are upload paths; returns {filename: [[path, ...] per variant]}
+    os.makedirs(folder, exist_ok=True)
+    render = preview_image if kind == 'images' else preview_video
+    return {
+        os.path.basename(src): render(src, os.path.splitext(os.path.basename(src))[0], variants, opts, folder)
+        for src in sources
+    }
@@ -0,0 +1,87 @@
+# probe.py
+# Just the stream facts the video path uses (size, frame rate, duration,
+# codecs), read once per file and kept in a small JSON sidecar next to it.
+# Also the pre-flight checks run on uploads before any tokens are looked at.
+import os
+import json
+import subprocess
+import ffmpeg
+
+PROBE_SUFFIX = '.probe.json'
+# The only fields asked of ffprobe (ffmpeg.probe always adds -show_format
+# -show_streams, i.e. every field of every stream)
+PROBE_ENTRIES = 'stream=codec_type,codec_name,width,height,avg_frame_rate:format=duration'
+
+VIDEO_EXTENSIONS = tuple(
+    e.strip().lower() for e in os.getenv('VIDEO_EXTENSIONS', '.mp4,.mov,.m4v,.webm,.mkv,.avi').split(',')
+)
+# Longest source we accept, in seconds (0 = no limit)
+VIDEO_MAX_DURATION = float(os.getenv('VIDEO_MAX_DURATION', 600))
+# Largest frame we accept, in pixels on the long side (0 = no limit)
+VIDEO_MAX_DIMENSION = int(os.getenv('VIDEO_MAX_DIMENSION', 4096))
+
+def probe_path(path):
+    return path + PROBE_SUFFIX
+
+def frame_rate(rate):
+    # ffprobe reports rates as fractions, e.g. '30000/1001'; 0 if unknown
+    num, _, den = (rate or '0').partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def run_ffprobe(path):
+    # ffprobe's JSON for PROBE_ENTRIES; raises ffmpeg.Error like ffmpeg.probe
+    args = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_entries', PROBE_ENTRIES, path]
+    p = subprocess.run(args, capture_output=True)
+    if p.returncode != 0:
+        raise ffmpeg.Error('ffprobe', p.stdout, p.stderr)
+    return json.loads(p.stdout.decode('utf-8'))
+
+def probe_video(path):
+    # {'width', 'height', 'fps', 'duration', 'codec', 'audio'} for the first
+    # video stream (audio: codec of the first audio stream or None), or None
+    # if there is no video. ffprobe is asked for those fields only.
+    sidecar = probe_path(path)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        with open(sidecar) as f:
+            return json.load(f)
+    result = run_ffprobe(path)
+    streams = result.get('streams') or []
+    vs = next((s for s in streams if s.get('codec_type') == 'video' and s.get('width') and s.get('height')), None)
+    aus = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    info = None
+    if vs:
+        info = {
+            'width': int(vs['width']),
+            'height': int(vs['height']),
+            'fps': frame_rate(vs.get('avg_frame_rate')),
+            'duration': float(result.get('format', {}).get('duration') or 0),
+            'codec': vs.get('codec_name'),
+            'audio': aus.get('codec_name') if aus else None,
+        }
+    with open(sidecar, 'w') as f:
+        json.dump(info, f)
+    return info
+
+def move_probe(src, dst):
+    # Keep a cached probe with its file when the file moves
+    if os.path.exists(probe_path(src)):
+        os.replace(probe_path(src), probe_path(dst))
+
+def check_video(path):
+    # Reason to turn the upload away, or None if it looks renderable
+    if not path.lower().endswith(VIDEO_EXTENSIONS):
+        return f"Unsupported file type (allowed: {', '.join(VIDEO_EXTENSIONS)})"
+    try:
+        info = probe_video(path)
+    except ffmpeg.Error:
+        return "Not a readable video file"
+    if info is None:
+        return "No video stream found"
+    if VIDEO_MAX_DURATION and info['duration'] > VIDEO_MAX_DURATION:
+        return f"Video is longer than {VIDEO_MAX_DURATION:g} seconds"
+    if VIDEO_MAX_DIMENSION and max(info['width'], info['height']) > VIDEO_MAX_DIMENSION:
+        return f"Video is larger than {VIDEO_MAX_DIMENSION}px"
+    return None
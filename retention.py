@@ -0,0 +1,264 @@
+# retention.py
+# Keeps disk use bounded. Two parts:
+#  - history: variants older than the owner's plan TTL, or beyond the plan's
+#    quota (oldest first), are removed along with their index rows,
+#    thumbnails and perceptual hashes. Driven by the history_item table,
+#    not by listing the folder.
+#  - folders: everything else that only ever grew (zips, previews, upload
+#    leftovers, legacy output/processed dirs, half-written .tmp files) is
+#    swept by age.
+#    Each folder is walked with a long-lived os.scandir iterator, SWEEP_BATCH
+#    entries per pass, so a huge folder is never listed or sorted in one go.
+# Bytes and files reclaimed are counted per category (stats(), /retention-stats).
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import datetime
+import multiprocessing
+from sqlalchemy import or_
+import jobs
+import thumbs
+import preview
+import phash
+from plan_settings import PLAN_RETENTION, retention_settings
+
+RETENTION_DB = os.getenv('RETENTION_DB', os.path.join('instance', 'retention.db'))
+SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', 60))
+# Directory entries looked at per folder per pass / history rows per pass
+SWEEP_BATCH = int(os.getenv('SWEEP_BATCH', 1000))
+HISTORY_BATCH = int(os.getenv('HISTORY_BATCH', 500))
+HISTORY_FOLDER = 'static/history'
+MB = 1024 * 1024
+HOUR = 3600
+
+ZIP_TTL = float(os.getenv('ZIP_TTL_HOURS', 24)) * HOUR
+UPLOAD_TTL = float(os.getenv('UPLOAD_TTL_HOURS', 6)) * HOUR
+BACKUP_SPOOL_TTL = float(os.getenv('BACKUP_SPOOL_TTL_HOURS', 72)) * HOUR
+# Anything half-written (.tmp) or in the legacy output dirs this long is dead
+TMP_TTL = float(os.getenv('TMP_TTL_MINUTES', 30)) * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reclaimed (
+    category TEXT PRIMARY KEY,
+    files    INTEGER NOT NULL,
+    bytes    INTEGER NOT NULL
+);
+"""
+
+def _connect():
+    os.makedirs(os.path.dirname(RETENTION_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(RETENTION_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def _record(category, files, size):
+    if not files:
+        return
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO reclaimed (category, files, bytes) VALUES (?, ?, ?) "
+            "ON CONFLICT(category) DO UPDATE SET files = files + excluded.files, bytes = bytes + excluded.bytes",
+            (category, files, size)
+        )
+    finally:
+        conn.close()
+
+def stats():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT category, files, bytes FROM reclaimed").fetchall()
+    finally:
+        conn.close()
+    return {
+        'reclaimed': {c: {'files': f, 'bytes': b} for c, f, b in rows},
+        'reclaimed_bytes': sum(b for _, _, b in rows),
+    }
+
+def remove_path(path):
+    # Bytes actually freed: a hardlink shared with the cache frees nothing
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return 0
+    if os.path.isdir(path) and not os.path.islink(path):
+        freed = 0
+        for root, _, files in os.walk(path):
+            for fn in files:
+                try:
+                    fst = os.lstat(os.path.join(root, fn))
+                    freed += fst.st_size if fst.st_nlink == 1 else 0
+                except FileNotFoundError:
+                    pass
+        shutil.rmtree(path, ignore_errors=True)
+        return freed
+    os.remove(path)
+    return st.st_size if st.st_nlink == 1 else 0
+
+# -------------------- Folders --------------------
+class FolderSweeper:
+    # Removes entries of `folder` older than ttl seconds, a batch at a time.
+    # match/keep narrow what is eligible; is_busy can veto an entry (e.g. an
+    # upload folder whose job is still queued).
+    def __init__(self, category, folder, ttl, match=None, keep=(), is_busy=None):
+        self.category = category
+        self.folder = folder
+        self.ttl = ttl
+        self.match = match
+        self.keep = set(keep)
+        self.is_busy = is_busy
+        self._it = None
+
+    def step(self, budget=SWEEP_BATCH, now=None):
+        # Returns True when the folder has been walked to the end
+        now = now or time.time()
+        if self._it is None:
+            try:
+                self._it = os.scandir(self.folder)
+            except FileNotFoundError:
+                return True
+        files = freed = 0
+        done = False
+        for _ in range(budget):
+            entry = next(self._it, None)
+            if entry is None:
+                self._it.close()
+                self._it = None
+                done = True
+                break
+            if entry.name in self.keep or (self.match and not self.match(entry.name)):
+                continue
+            try:
+                age = now - entry.stat(follow_symlinks=False).st_mtime
+            except FileNotFoundError:
+                continue
+            if age < self.ttl or (self.is_busy and self.is_busy(entry.name)):
+                continue
+            freed += remove_path(entry.path)
+            files += 1
+        _record(self.category, files, freed)
+        return done
+
+def job_is_pending(job_id):
+    job = jobs.get_job(job_id)
+    return job is not None and job['status'] in (jobs.QUEUED, jobs.RUNNING)
+
+def is_tmp(name):
+    return name.endswith('.tmp')
+
+def folder_sweepers():
+    upload_subdirs = ('jobs', 'incoming', 'backups', 'segments')
+    return [
+        FolderSweeper('zips', 'static/processed_zips', ZIP_TTL),
+        FolderSweeper('previews', preview.PREVIEW_FOLDER, preview.PREVIEW_TTL),
+        FolderSweeper('uploads', 'uploads', UPLOAD_TTL, keep=upload_subdirs),
+        FolderSweeper('uploads', jobs.JOB_UPLOAD_FOLDER, UPLOAD_TTL, is_busy=job_is_pending),
+        FolderSweeper('uploads', os.path.join('uploads', 'incoming'), TMP_TTL),
+        FolderSweeper('backups', os.path.join('uploads', 'backups'), BACKUP_SPOOL_TTL),
+        FolderSweeper('uploads', os.path.join('uploads', 'segments'), UPLOAD_TTL),
+        FolderSweeper('legacy', 'output', TMP_TTL),
+        FolderSweeper('legacy', 'processed', TMP_TTL),
+        FolderSweeper('tmp', HISTORY_FOLDER, TMP_TTL, match=is_tmp),
+        FolderSweeper('tmp', thumbs.THUMB_FOLDER, TMP_TTL, match=is_tmp),
+        FolderSweeper('tmp', os.path.join('cache', 'sources'), TMP_TTL, match=is_tmp),
+        FolderSweeper('tmp', os.path.join('cache', 'variants'), TMP_TTL, match=is_tmp),
+    ]
+
+# -------------------- History --------------------
+# db and the models come from the caller (app.py, worker.py), as in tokens.py
+
+def remove_history(rows, category, db, HistoryItem):
+    freed = 0
+    for row in rows:
+        freed += remove_path(os.path.join(HISTORY_FOLDER, row.filename))
+        freed += remove_path(thumbs.thumb_path(row.filename))
+    for user_id in {row.user_id for row in rows}:
+        phash.forget(user_id, [row.filename for row in rows if row.user_id == user_id])
+    HistoryItem.query.filter(HistoryItem.id.in_([r.id for r in rows])).delete(synchronize_session=False)
+    db.session.commit()
+    _record(category, len(rows), freed)
+    return len(rows)
+
+def plan_filter(User, plan):
+    # Users on plans retention doesn't know, and unowned rows, get 'free'
+    if plan != 'free':
+        return User.plan == plan
+    others = [p for p in PLAN_RETENTION if p != 'free']
+    return or_(User.plan.is_(None), User.plan.notin_(others))
+
+def expire_history(db, User, HistoryItem, now=None):
+    now = now or datetime.datetime.utcnow()
+    removed = 0
+    for plan, settings in PLAN_RETENTION.items():
+        if not settings['history_ttl_days']:
+            continue
+        cutoff = now - datetime.timedelta(days=settings['history_ttl_days'])
+        rows = (
+            HistoryItem.query
+            .outerjoin(User, User.id == HistoryItem.user_id)
+            .filter(plan_filter(User, plan), HistoryItem.created_at < cutoff)
+            .order_by(HistoryItem.id)
+            .limit(HISTORY_BATCH)
+            .all()
+        )
+        if rows:
+            removed += remove_history(rows, 'history_ttl', db, HistoryItem)
+    return removed
+
+def enforce_quotas(db, User, HistoryItem):
+    removed = 0
+    usage = (
+        db.session.query(HistoryItem.user_id, User.plan, db.func.sum(HistoryItem.size))
+        .join(User, User.id == HistoryItem.user_id)
+        .group_by(HistoryItem.user_id, User.plan)
+        .all()
+    )
+    for user_id, plan, total in usage:
+        quota = retention_settings(plan)['history_quota_mb'] * MB
+        if not quota or total <= quota:
+            continue
+        # Oldest first, walking the (user_id, id) index
+        over = total - quota
+        doomed = []
+        for row in HistoryItem.query.filter_by(user_id=user_id).order_by(HistoryItem.id).yield_per(HISTORY_BATCH):
+            doomed.append(row)
+            over -= row.size
+            if over <= 0 or len(doomed) >= HISTORY_BATCH:
+                break
+        removed += remove_history(doomed, 'history_quota', db, HistoryItem)
+    return removed
+
+# -------------------- Running it --------------------
+def cleanup_orphans():
+    # Startup pass: walk every folder to the end (whatever a crash or failed
+    # run left behind is swept now rather than over many passes)
+    for sweeper in folder_sweepers():
+        while not sweeper.step():
+            pass
+    return stats()
+
+def sweep_once(app, sweepers, db, User, HistoryItem):
+    for sweeper in sweepers:
+        sweeper.step()
+    with app.app_context():
+        expire_history(db, User, HistoryItem)
+        enforce_quotas(db, User, HistoryItem)
+
+def run_sweeper(app, db, User, HistoryItem):
+    sweepers = folder_sweepers()
+    cleanup_orphans()
+    while True:
+        try:
+            sweep_once(app, sweepers, db, User, HistoryItem)
+        except Exception as e:
+            print(f"Retention sweep failed: {e}", file=sys.stderr)
+        time.sleep(SWEEP_INTERVAL)
+
+def start_sweeper(app, db, User, HistoryItem):
+    # Its own process next to the job workers (worker.py)
+    p = multiprocessing.Process(target=run_sweeper, args=(app, db, User, HistoryItem), daemon=True)
+    p.start()
+    return p
@@ -3,7 +3,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from PIL import Image, ImageEnhance
 import os, shutil, zipfile, ffmpeg, datetime
-from app import db, User
+from app import db, User, history_page
 from helpers import upload_to_google_drive, scale_range
 
 routes_bp = Blueprint('routes', __name__)
@@ -72,12 +72,13 @@ def video_processor():
 @routes_bp.route('/history')
 @login_required
 def history():
-    page = int(request.args.get('page', 1))
-    per_page = 25
-    folder = os.path.join('static', 'history')
-    all_files = sorted(os.listdir(folder), key=lambda f: os.path.getmtime(os.path.join(folder, f)), reverse=True)
-    files = all_files[(page - 1) * per_page: page * per_page]
-    return render_template('history.html', files=files, page=page, total_pages=(len(all_files) + per_page - 1) // per_page)
+    page = history_page(
+        current_user.id,
+        before=request.args.get('before', type=int),
+        after=request.args.get('after', type=int)
+    )
+    return render_template('history.html', items=page['items'],
+                           newer=page['newer'], older=page['older'])
 
 @routes_bp.route('/download/<filename>')
 @login_required
@@ -0,0 +1,123 @@
+# sampler.py
+# Variant parameters for a batch, drawn well spread out in one go instead of
+# by rejection sampling. Every enabled parameter (contrast, brightness,
+# rotation, crop) is one axis of a unit cube. Candidates come from a
+# randomly shifted Halton sequence, which covers the cube evenly, and a
+# candidate is kept only if no kept point lies within `radius` of it
+# (Poisson-disk style). A grid of radius-sized cells makes that check a
+# look at the neighbouring cells rather than at every earlier point.
+import os
+import random
+import itertools
+
+# Parameter ranges at intensity 100; lower intensities scale both ends
+# (as scale_range did), so the space shrinks towards the low end.
+IMAGE_SPACE = {
+    'contrast': (-4.0, 4.0),
+    'brightness': (-2, 2),
+    'rotate': (-25, 25),
+    'crop': (0.15, 0.35),
+}
+VIDEO_SPACE = {
+    'contrast': (-4.0, 4.0),
+    'brightness': (-2, 2),
+    'rotate': (-25, 25),
+    'crop': (0.10, 0.35),
+}
+AXES = ('contrast', 'brightness', 'rotate', 'crop')
+PRIMES = (2, 3, 5, 7)
+
+# Fixed seed for reproducible batches (e.g. when comparing renders); unset
+# means a fresh random one per batch.
+SAMPLER_SEED = os.getenv('SAMPLER_SEED')
+
+# Kept points are at least RADIUS_FACTOR * n ** (-1/d) apart in the unit
+# cube; well under the packing limit, so candidates are rarely turned down.
+RADIUS_FACTOR = 0.5
+MAX_CANDIDATES_PER_POINT = 64
+
+def make_rng(seed=None):
+    if seed is None:
+        seed = SAMPLER_SEED
+    return random.Random(seed)
+
+def radical_inverse(i, base):
+    inv, f = 0.0, 1.0 / base
+    while i:
+        i, digit = divmod(i, base)
+        inv += digit * f
+        f /= base
+    return inv
+
+def halton(dims, rng):
+    # Endless Halton points in [0, 1)^dims, shifted by a random offset per
+    # axis (Cranley-Patterson rotation) and started at a random index
+    shift = [rng.random() for _ in range(dims)]
+    for i in itertools.count(rng.randrange(1, 1 << 16)):
+        yield tuple((radical_inverse(i, PRIMES[k]) + shift[k]) % 1.0 for k in range(dims))
+
+class Grid:
+    # Spatial hash with cells as wide as the radius: a point closer than the
+    # radius is always in the same or a neighbouring cell.
+    def __init__(self, dims, radius):
+        self.radius = radius
+        self.cells = {}
+        self.offsets = list(itertools.product((-1, 0, 1), repeat=dims))
+
+    def cell(self, p):
+        return tuple(int(x // self.radius) for x in p)
+
+    def neighbours(self, c):
+        # Visit whichever is smaller: the 3^d cells around c, or the
+        # occupied cells (early on, in 4-D, most neighbours are empty)
+        if len(self.cells) < len(self.offsets):
+            for key, points in self.cells.items():
+                if all(abs(a - b) <= 1 for a, b in zip(key, c)):
+                    yield from points
+        else:
+            for off in self.offsets:
+                yield from self.cells.get(tuple(a + b for a, b in zip(c, off)), ())
+
+    def is_far(self, p):
+        r2 = self.radius * self.radius
+        for q in self.neighbours(self.cell(p)):
+            if sum((x - y) ** 2 for x, y in zip(p, q)) < r2:
+                return False
+        return True
+
+    def add(self, p):
+        self.cells.setdefault(self.cell(p), []).append(p)
+
+def spread_points(n, dims, rng):
+    # n points in [0, 1)^dims, pairwise at least the radius apart
+    if dims == 0:
+        return [()] * n
+    radius = RADIUS_FACTOR * n ** (-1.0 / dims)
+    while True:
+        grid = Grid(dims, radius)
+        points = []
+        for p in itertools.islice(halton(dims, rng), MAX_CANDIDATES_PER_POINT * n):
+            if grid.is_far(p):
+                grid.add(p)
+                points.append(p)
+                if len(points) == n:
+                    return points
+        # Only for unlucky shifts with tiny dims; loosen rather than repeat
+        radius /= 2
+
+def sample_variants(n, opts, intensity, space, rng=None):
+    # n (contrast, brightness, rotation, crop_factor, flip) tuples for the
+    # options enabled in opts; disabled parameters stay 0.
+    rng = rng or make_rng()
+    axes = [a for a in AXES if opts.get(a)]
+    factor = intensity / 100
+    variants = []
+    for p in spread_points(n, len(axes), rng):
+        values = dict.fromkeys(AXES, 0)
+        for axis, u in zip(axes, p):
+            lo, hi = space[axis]
+            values[axis] = lo * factor + u * (hi - lo) * factor
+        # Horizontal flip (randomly, like before)
+        flip = bool(opts.get('flip')) and rng.random() > 0.5
+        variants.append((values['contrast'], values['brightness'], values['rotate'], values['crop'], flip))
+    return variants
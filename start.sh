@@ -6,5 +6,9 @@ pip install -r requirements.txt
 # Update packages
 apt update && apt upgrade -y
 
-# Start the app
-gunicorn app:app --bind 0.0.0.0:5000 --timeout 300
+# Start the processing workers (size with JOB_WORKERS)
+python worker.py &
+
+# Start the app; processing no longer runs inside the request. Threads keep
+# progress streams (/jobs/<id>/events) from tying up whole workers.
+gunicorn app:app --bind 0.0.0.0:5000 --timeout 300 --worker-class gthread --threads 8
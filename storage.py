@@ -0,0 +1,62 @@
+# storage.py
+# Rendered files are written once, to their canonical place (history), and
+# every other place that needs them (output/, the cache, a zip build) gets a
+# link to that copy rather than a second write: a hardlink on the same
+# filesystem, else a reflink (copy-on-write clone) where the filesystem
+# supports it, and only then a real copy.
+import os
+import sys
+import fcntl
+import shutil
+
+# linux/fs.h FICLONE: clone src's extents into dst (btrfs, XFS, bcachefs...)
+FICLONE = 0x40049409
+
+def unlink_existing(path):
+    # Files may be hardlinks shared with the cache or history: never write
+    # through them, replace the directory entry instead.
+    if os.path.lexists(path):
+        os.remove(path)
+
+def write_new(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflink is only tried on Linux')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+def link(src, dst):
+    # Make dst another name for src's data; returns how: 'link', 'reflink'
+    # or 'copy' (different filesystems without clone support).
+    unlink_existing(dst)
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def link_into(src, folders):
+    # Link src into each folder under its own name; returns the new paths
+    paths = []
+    for folder in folders:
+        dst = os.path.join(folder, os.path.basename(src))
+        link(src, dst)
+        paths.append(dst)
+    return paths
@@ -0,0 +1,73 @@
+# tests/conftest.py
+# The app writes everything (database, job queue, history, caches) relative
+# to the working directory, so the whole session runs in a scratch one.
+# Batches run inside the request (ASYNC_JOBS=0) and render inline. The
+# side databases get absolute paths: background threads (the backup
+# uploader) keep polling after pytest restores the working directory.
+import io
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='metadatachanger-tests-')
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(WORKDIR, 'users.db'),
+    'ASYNC_JOBS': '0',
+    'RENDER_WORKERS': '1',
+    'PROCESSING_VERBOSE': '0',
+    **{name: os.path.join(WORKDIR, 'instance', fn) for name, fn in (
+        ('JOBS_DB', 'jobs.db'), ('METRICS_DB', 'metrics.db'),
+        ('PHASH_DB', 'phash.db'), ('RETENTION_DB', 'retention.db'),
+    )},
+})
+
+import pytest
+from PIL import Image
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as A
+    A.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with A.app.app_context():
+        A.db.create_all()
+    return A
+
+@pytest.fixture
+def make_user(app_module):
+    A = app_module
+
+    def make(email, tokens=100):
+        with A.app.app_context():
+            user = A.User.query.filter_by(email=email).first()
+            if user is None:
+                user = A.User(email=email, password=generate_password_hash('pw'))
+                A.db.session.add(user)
+            user.tokens = tokens
+            A.db.session.commit()
+            return user.id
+    return make
+
+@pytest.fixture
+def login(app_module):
+    def client_for(email):
+        client = app_module.app.test_client()
+        client.post('/login', data={'email': email, 'password': 'pw'})
+        return client
+    return client_for
+
+def image_upload(name, size=(160, 120), colour=(120, 80, 40)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, colour).save(buf, 'JPEG')
+    buf.seek(0)
+    return buf, name
+
+def batch_form(images, batch=2, **extra):
+    return {
+        'images': images, 'batch_size': str(batch), 'intensity': '50',
+        'adjust_contrast': 'on', 'adjust_brightness': 'on', 'rotate': 'on', 'crop': 'on',
+        **extra
+    }
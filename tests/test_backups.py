@@ -0,0 +1,99 @@
+# tests/test_backups.py
+# The Drive backup uploader (backups.py) against the local fake (fake_drive.py).
+# Jobs go on a queue of their own: the app's uploader thread drains 'backup'.
+import io
+import os
+import zipfile
+import pytest
+import httplib2
+from googleapiclient.errors import HttpError
+import jobs
+import backups
+import metrics
+from fake_drive import FakeDriveService
+
+QUEUE = 'backup-test'
+
+@pytest.fixture
+def drive(tmp_path):
+    service = FakeDriveService(str(tmp_path / 'drive'))
+    return service, backups.DriveClient(factory=lambda: (service, None))
+
+def queued_archives(tmp_path, sizes):
+    # One claimed backup job per size, for an archive of that many bytes
+    batch = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f'archive_{i}.zip'
+        path.write_bytes(bytes([i]) * size)
+        job_id = jobs.enqueue('backup', {'path': str(path), 'filename': f'images_{i}.zip', 'remove': True},
+                              total=1, queue=QUEUE)
+        batch.append(jobs.claim(job_id=job_id))
+    return batch
+
+def uploaded(service):
+    # name -> bytes of every file on the fake Drive
+    out = {}
+    for file_id, meta in service._index().items():
+        if meta.get('mimeType') != 'application/vnd.google-apps.folder':
+            with open(os.path.join(service.root, file_id), 'rb') as f:
+                out[meta['name']] = f.read()
+    return out
+
+def stage_count(stage):
+    metrics.flush()
+    for line in metrics.render().splitlines():
+        if line.startswith(f'{metrics.METRIC_NAME}_count{{') and f'stage="{stage}"' in line:
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+def test_small_archives_go_up_as_one_bundle(tmp_path, drive):
+    service, client = drive
+    batch = queued_archives(tmp_path, [100, 200, 300])
+    before = stage_count('drive_upload_bundle')
+    backups.upload_batch(client, batch)
+
+    files = uploaded(service)
+    assert len(files) == 1
+    name, data = files.popitem()
+    assert name.startswith('backup_bundle_')
+    bundled = zipfile.ZipFile(io.BytesIO(data))
+    assert sorted(bundled.namelist()) == ['images_0.zip', 'images_1.zip', 'images_2.zip']
+    assert bundled.read('images_1.zip') == bytes([1]) * 200
+    results = {jobs.get_job(j['id'])['result']['file_id'] for j in batch}
+    assert len(results) == 1
+    assert not any(os.path.exists(j['payload']['path']) for j in batch)
+    assert stage_count('drive_upload_bundle') == before + 1
+
+def test_large_archive_goes_up_on_its_own(tmp_path, drive, monkeypatch):
+    service, client = drive
+    monkeypatch.setattr(backups, 'BACKUP_SMALL_BYTES', 1000)
+    batch = queued_archives(tmp_path, [5000, 100, 200])
+    backups.upload_batch(client, batch)
+
+    files = uploaded(service)
+    assert files.pop('images_0.zip') == bytes([0]) * 5000
+    (name, data), = files.items()
+    assert name.startswith('backup_bundle_')
+    assert sorted(zipfile.ZipFile(io.BytesIO(data)).namelist()) == ['images_1.zip', 'images_2.zip']
+    assert all(jobs.get_job(j['id'])['status'] == jobs.DONE for j in batch)
+
+def test_upload_retries_after_drive_failures(tmp_path, drive, monkeypatch):
+    service, client = drive
+    monkeypatch.setattr(backups, 'BACKUP_RETRY_BASE', 0)
+    monkeypatch.setattr(backups, 'BACKUP_SMALL_BYTES', 0)
+    # Drive calls: folder lookup (1, retried as 2), folder create (3), the
+    # upload's chunk (4, retried as 5); 1 and 4 fail with a 503
+    calls = []
+
+    def flaky():
+        calls.append(len(calls) + 1)
+        if calls[-1] in (1, 4):
+            raise HttpError(httplib2.Response({'status': 503}), b'{"error": "backendError"}')
+    monkeypatch.setattr(service, '_maybe_fail', flaky)
+    batch = queued_archives(tmp_path, [4096])
+    backups.upload_batch(client, batch)
+
+    assert calls == [1, 2, 3, 4, 5]
+    assert uploaded(service) == {'images_0.zip': bytes([0]) * 4096}
+    job = jobs.get_job(batch[0]['id'])
+    assert job['status'] == jobs.DONE and job['result']['file_id']
@@ -0,0 +1,70 @@
+# tests/test_cache.py
+# Rendered variant sets and stored sources in the content-addressed cache
+# (cache.py)
+import io
+import os
+import contextlib
+import jobs
+import cache
+import sampler
+import image_videoprocessing as ivp
+from conftest import image_upload
+
+OPTS = {'contrast': True, 'brightness': True, 'rotate': True, 'crop': True, 'flip': False}
+
+def render_batch(tmp_path, tag):
+    buf, name = image_upload('cached.jpg', size=(200, 150))
+    src = tmp_path / f'{tag}_{name}'
+    src.write_bytes(buf.getvalue())
+    hist = tmp_path / tag
+    hist.mkdir()
+    seen, hashes = [], []
+    upload = jobs.StoredUpload(str(src))
+    upload.filename = name
+    try:
+        ivp.process_images_logic(
+            [upload], 3, 50, OPTS, out=None, hist_folder=str(hist),
+            on_variant=seen.append, on_hash=lambda path, h: hashes.append(h)
+        )
+    finally:
+        upload.close()
+    return {os.path.basename(p): open(p, 'rb').read() for p in seen}, hashes
+
+def test_random_metadata_bypasses_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ivp, 'VARIANT_METADATA', True)
+    # Same variants both times: only the tags can differ
+    monkeypatch.setattr(sampler, 'SAMPLER_SEED', 'cache-test')
+    first, _ = render_batch(tmp_path, 'first')
+    second, _ = render_batch(tmp_path, 'second')
+    assert first.keys() == second.keys()
+    assert all(first[fn] != second[fn] for fn in first)
+
+def test_cache_hits_report_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ivp, 'VARIANT_METADATA', False)
+    first, rendered_hashes = render_batch(tmp_path, 'first')
+    second, hit_hashes = render_batch(tmp_path, 'second')
+    # Replayed from the cache, hashes included
+    assert first == second
+    assert hit_hashes == rendered_hashes
+    assert None not in hit_hashes
+
+def test_eviction_passes_over_sources_in_use(tmp_path):
+    upload = tmp_path / 'held.mp4'
+    upload.write_bytes(b'held source')
+    held_hash, other_hash = 'a1' * 32, 'b2' * 32
+    with contextlib.ExitStack() as held:
+        path = cache.store_source(held_hash, '.mp4', from_path=str(upload), held=held)
+        other = cache.store_source(other_hash, '.mp4', stream=io.BytesIO(b'other source'))
+        cache.evict(max_bytes=0)
+        assert os.path.exists(path)
+        assert not os.path.exists(other)
+        # A second job finding it in the store holds it too
+        with contextlib.ExitStack() as again:
+            assert cache.lookup_source(held_hash, '.mp4', again) == path
+            held.close()
+            cache.evict(max_bytes=0)
+            assert os.path.exists(path)
+    cache.evict(max_bytes=0)
+    assert not os.path.exists(path)
+    with contextlib.ExitStack() as late:
+        assert cache.lookup_source(held_hash, '.mp4', late) is None
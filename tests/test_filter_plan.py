@@ -0,0 +1,46 @@
+# tests/test_filter_plan.py
+# The filter planner (filter_plan.py) against the naive operation order:
+# images must come out identical, video chains must do less work.
+# bench/bench_filter_planner.py covers the ffmpeg side (psnr) and timings.
+import numpy as np
+from PIL import Image
+import sampler
+import image_engine
+import filter_plan
+
+OPTS = {'contrast': True, 'brightness': True, 'rotate': True, 'crop': True, 'flip': True}
+OPTION_SETS = [
+    OPTS,
+    {**OPTS, 'rotate': False},
+    {**OPTS, 'contrast': False, 'brightness': False},
+]
+
+def source(mode):
+    rng = np.random.default_rng(0)
+    return image_engine.Source(Image.fromarray(rng.integers(0, 256, (90, 120, 3), dtype=np.uint8)).convert(mode))
+
+def test_planned_image_render_matches_naive_order():
+    # Naive: tone-map the whole source, then warp and crop
+    variants = sampler.sample_variants(12, OPTS, 100, sampler.IMAGE_SPACE, sampler.make_rng('filter-plan'))
+    for mode in ('RGB', 'RGBA'):
+        src = source(mode)
+        for opts in OPTION_SETS:
+            for v in variants:
+                planned = image_engine.render(src, v, opts)
+                toned = image_engine.apply_lut(src.arr, image_engine.tone_lut(src, v[0], v[1], opts))
+                naive = image_engine.render(src, v, opts, arr=toned)
+                assert np.array_equal(planned, naive), (mode, opts, v)
+
+def test_planned_video_chain_processes_fewer_pixels():
+    w, h = 1280, 720
+    # Rotate + crop: rotate runs on the pre-cropped window, eq after the crop
+    variant = (0.2, 0.05, 4.0, 0.15, True)
+    naive = filter_plan.pixel_ops(filter_plan.naive_video(variant, OPTS, w, h), w, h)
+    planned_steps = filter_plan.plan_video(variant, OPTS, w, h)
+    assert [name for name, _, _ in planned_steps] == ['crop', 'rotate', 'crop', 'eq', 'hflip', 'scale']
+    assert filter_plan.pixel_ops(planned_steps, w, h) < naive
+
+    # Nothing to move around: same cost
+    tone_only = {**OPTS, 'rotate': False, 'crop': False}
+    assert filter_plan.pixel_ops(filter_plan.plan_video(variant, tone_only, w, h), w, h) == \
+        filter_plan.pixel_ops(filter_plan.naive_video(variant, tone_only, w, h), w, h)
@@ -0,0 +1,53 @@
+# tests/test_history.py
+# The history index (HistoryItem) and the shared static/history folder
+import io
+import os
+import zipfile
+from conftest import image_upload, batch_form
+
+def process(client, name, colour):
+    resp = client.post(
+        '/process-images', content_type='multipart/form-data',
+        data=batch_form([image_upload(name, colour=colour)], batch=2)
+    )
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()
+
+def test_same_upload_name_from_two_users(app_module, make_user, login):
+    A = app_module
+    alice = make_user('alice@example.com')
+    bob = make_user('bob@example.com')
+    first = process(login('alice@example.com'), 'photo.jpg', (200, 30, 30))
+    second = process(login('bob@example.com'), 'photo.jpg', (30, 30, 200))
+
+    with A.app.app_context():
+        rows = {
+            user_id: A.HistoryItem.query.filter_by(user_id=user_id).all()
+            for user_id in (alice, bob)
+        }
+    assert len(rows[alice]) == 2 and len(rows[bob]) == 2
+    alice_files = {r.filename for r in rows[alice]}
+    bob_files = {r.filename for r in rows[bob]}
+    assert not alice_files & bob_files
+    for fn in alice_files | bob_files:
+        assert os.path.isfile(os.path.join('static/history', fn))
+
+    # Each zip still names the variants after the upload
+    for result in (first, second):
+        with open(os.path.join('static/processed_zips', result['zip_filename']), 'rb') as f:
+            names = sorted(zipfile.ZipFile(io.BytesIO(f.read())).namelist())
+        assert names == ['photo_variant_1.jpg', 'photo_variant_2.jpg']
+
+def test_record_history_only_replaces_own_rows(app_module, make_user):
+    A = app_module
+    carol = make_user('carol@example.com')
+    dave = make_user('dave@example.com')
+    path = os.path.join('static/history', 'shared_variant_1.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'variant')
+    with A.app.app_context():
+        A.record_history(carol, [path])
+        A.record_history(dave, [path])
+        A.record_history(dave, [path])
+        assert A.HistoryItem.query.filter_by(user_id=carol, filename='shared_variant_1.jpg').count() == 1
+        assert A.HistoryItem.query.filter_by(user_id=dave, filename='shared_variant_1.jpg').count() == 1
@@ -0,0 +1,64 @@
+# tests/test_jobs.py
+# The job queue (jobs.py) when a worker process dies in the middle of a job
+import os
+import time
+import signal
+import jobs
+from conftest import image_upload
+
+def wait_for(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_job_of_killed_worker_is_retried_then_failed_and_refunded(app_module, make_user, monkeypatch):
+    A = app_module
+    user_id = make_user('crashed@example.com', tokens=10)
+    job_id = jobs.new_job_id()
+    folder = jobs.job_upload_dir(job_id)
+    os.makedirs(folder)
+    buf, name = image_upload('crashed.jpg')
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(buf.read())
+    variant = os.path.join('static/history', A.history_name(job_id, 'crashed_variant_1.jpg'))
+
+    def hanging(job, progress):
+        # Writes a variant, then hangs until killed
+        with open(variant, 'wb') as f:
+            f.write(b'variant')
+        time.sleep(60)
+
+    monkeypatch.setitem(jobs.HANDLERS, 'images', hanging)
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    with A.app.app_context():
+        reservation_id = A.reserve_tokens(user_id, 3, A.db, A.User, A.TokenReservation, job_id=job_id)
+    jobs.enqueue('images', {'files': [name], 'batch': 3, 'reservation_id': reservation_id},
+                 user_id=user_id, total=3, queue='crash-test', job_id=job_id)
+
+    def kill_worker_mid_job():
+        worker = jobs._spawn_worker(A.app, 'crash-test', 0.01)
+        try:
+            wait_for(lambda: jobs.get_job(job_id)['status'] == jobs.RUNNING and os.path.exists(variant))
+        finally:
+            os.kill(worker.pid, signal.SIGKILL)
+            worker.join()
+        jobs.recover(A.app, worker.pid)
+
+    # First death: back in the queue, tokens still held
+    kill_worker_mid_job()
+    job = jobs.get_job(job_id)
+    assert (job['status'], job['attempts'], job['worker_pid']) == (jobs.QUEUED, 1, None)
+    with A.app.app_context():
+        assert A.db.session.get(A.TokenReservation, reservation_id).status == 'reserved'
+
+    # Second death: failed, refunded and cleaned up
+    kill_worker_mid_job()
+    job = jobs.get_job(job_id)
+    assert (job['status'], job['attempts']) == (jobs.FAILED, 2)
+    assert job['error']
+    with A.app.app_context():
+        assert A.db.session.get(A.TokenReservation, reservation_id).status == 'refunded'
+        assert A.db.session.get(A.User, user_id).tokens == 10
+    assert not os.path.exists(variant)
+    assert not os.path.exists(folder)
@@ -0,0 +1,35 @@
+# tests/test_metrics.py
+# Stage timings (metrics.py) from the image path
+import numpy as np
+from PIL import Image
+import metrics
+import image_videoprocessing as ivp
+
+OPTS = {'contrast': True, 'brightness': True, 'rotate': True, 'crop': True, 'flip': True}
+VARIANTS = [(0.2, -0.1, 7.0, 0.05, True), (-0.1, 0.15, -4.0, 0.08, False)]
+LABELS = {'kind': 'image', 'plan': 'filters-test'}
+
+def observed_stages():
+    metrics.flush()
+    return {
+        line.split('stage="')[1].split('"')[0]
+        for line in metrics.render().splitlines()
+        if '_count{' in line and 'plan="filters-test"' in line
+    }
+
+def source_image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (90, 120, 3), dtype=np.uint8), 'RGB')
+
+def test_numpy_engine_times_tone_and_warp(monkeypatch):
+    monkeypatch.setattr(ivp, 'IMAGE_ENGINE', 'numpy')
+    img = source_image()
+    timed = [np.asarray(v) for v in ivp.iter_image_variants(img, VARIANTS, OPTS, LABELS)]
+    plain = [np.asarray(v) for v in ivp.iter_image_variants(img, VARIANTS, OPTS)]
+    assert all(np.array_equal(a, b) for a, b in zip(timed, plain))
+    assert {'filter_tone', 'filter_warp'} <= observed_stages()
+
+def test_pil_chain_times_each_filter(monkeypatch):
+    monkeypatch.setattr(ivp, 'IMAGE_ENGINE', 'pil')
+    list(ivp.iter_image_variants(source_image(), VARIANTS, OPTS, LABELS))
+    assert {'filter_contrast', 'filter_brightness', 'filter_rotate', 'filter_crop', 'filter_flip'} <= observed_stages()
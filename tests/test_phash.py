@@ -0,0 +1,39 @@
+# tests/test_phash.py
+# Perceptual hashes (phash.py): the per-user table, and the frames a video
+# variant is hashed from
+import re
+import ffmpeg
+import phash
+import image_videoprocessing as ivp
+
+def stored(user_id, filename):
+    conn = phash._connect()
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM variant_hashes WHERE user_id IS ? AND filename = ?", (user_id, filename)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_recording_and_forgetting_stay_within_one_user():
+    phash.check_and_record(901, 'image', [('same_variant_1.jpg', 0x0F0F)])
+    phash.check_and_record(902, 'image', [('same_variant_1.jpg', 0xF0F0)])
+    phash.check_and_record(902, 'image', [('same_variant_1.jpg', 0xF0F0)])
+    assert stored(901, 'same_variant_1.jpg') == 1
+    assert stored(902, 'same_variant_1.jpg') == 1
+
+    phash.forget(902, ['same_variant_1.jpg'])
+    assert stored(901, 'same_variant_1.jpg') == 1
+    assert stored(902, 'same_variant_1.jpg') == 0
+
+def test_hash_frames_fall_inside_a_frame_rate_capped_clip():
+    # 60 fps source, plan capped to 30: the select filter after the fps
+    # filter sees 300 frames, not 600
+    info = {'width': 640, 'height': 360, 'fps': 60, 'duration': 10}
+    settings = {'max_fps': 30}
+    st, w, h = ivp.cap_source(ffmpeg.input('source.mp4').video, 640, 360, info, settings)
+    graph = ' '.join(ivp.final_outputs(st, 'variant.mp4', 1, None, None, settings, info).compile())
+    picked = [int(n) for n in re.findall(r'eq\(n\\*,(\d+)\)', graph)]
+    assert len(picked) == phash.PHASH_VIDEO_FRAMES
+    assert all(0 <= n < 300 for n in picked)
+    assert ivp.output_frames(info, {}) == 600
@@ -0,0 +1,46 @@
+# tests/test_probe.py
+# probe.probe_video against a stand-in ffprobe that records how it was called
+import os
+import sys
+import json
+import pytest
+import ffmpeg
+import probe
+
+FAKE_FFPROBE = '''#!{python}
+import sys, json
+with open({log!r}, 'w') as f:
+    json.dump(sys.argv[1:], f)
+if sys.argv[-1].endswith('broken.mp4'):
+    sys.exit(1)
+print(json.dumps({{"streams": [
+    {{"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720, "avg_frame_rate": "30000/1001"}},
+    {{"codec_type": "audio", "codec_name": "aac"}}], "format": {{"duration": "4.5"}}}}))
+'''
+
+@pytest.fixture
+def fake_ffprobe(tmp_path, monkeypatch):
+    log = tmp_path / 'argv.json'
+    script = tmp_path / 'bin' / 'ffprobe'
+    script.parent.mkdir()
+    script.write_text(FAKE_FFPROBE.format(python=sys.executable, log=str(log)))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{script.parent}{os.pathsep}{os.environ['PATH']}")
+    return log
+
+def test_probe_asks_for_the_used_fields_only(tmp_path, fake_ffprobe):
+    src = tmp_path / 'clip.mp4'
+    src.write_bytes(b'video')
+    info = probe.probe_video(str(src))
+    assert info == {'width': 1280, 'height': 720, 'fps': pytest.approx(29.97, abs=0.01), 'duration': 4.5,
+                    'codec': 'h264', 'audio': 'aac'}
+    argv = json.loads(fake_ffprobe.read_text())
+    assert argv[argv.index('-show_entries') + 1] == probe.PROBE_ENTRIES
+    assert '-show_streams' not in argv and '-show_format' not in argv
+
+def test_unreadable_file_is_turned_away(tmp_path, fake_ffprobe):
+    src = tmp_path / 'broken.mp4'
+    src.write_bytes(b'not a video')
+    with pytest.raises(ffmpeg.Error):
+        probe.run_ffprobe(str(src))
+    assert probe.check_video(str(src)) == "Not a readable video file"
@@ -0,0 +1,26 @@
+# tests/test_retention.py
+# History expiry (retention.py), driven the way cron would: `flask sweep`
+import os
+import datetime
+
+def test_sweep_expires_old_history(app_module, make_user):
+    A = app_module
+    user_id = make_user('expired@example.com')
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=400)
+    paths = {}
+    for fn, created in (('expired_old.jpg', old), ('expired_new.jpg', datetime.datetime.utcnow())):
+        paths[fn] = os.path.join('static/history', fn)
+        with open(paths[fn], 'wb') as f:
+            f.write(b'variant')
+        with A.app.app_context():
+            A.db.session.add(A.HistoryItem(user_id=user_id, filename=fn, kind='image', size=7, created_at=created))
+            A.db.session.commit()
+
+    result = A.app.test_cli_runner().invoke(args=['sweep'])
+    assert result.exit_code == 0, result.output
+
+    with A.app.app_context():
+        left = {r.filename for r in A.HistoryItem.query.filter_by(user_id=user_id)}
+    assert left == {'expired_new.jpg'}
+    assert not os.path.exists(paths['expired_old.jpg'])
+    assert os.path.exists(paths['expired_new.jpg'])
@@ -0,0 +1,116 @@
+# tests/test_stream.py
+# /process-images with stream=1: the zip is the response body
+import io
+import os
+import time
+import threading
+import zipfile
+import pytest
+import phash
+import thumbs
+from conftest import image_upload, batch_form
+
+def test_stream_returns_every_variant(app_module, make_user, login):
+    user_id = make_user('stream@example.com', tokens=10)
+    client = login('stream@example.com')
+    resp = client.post(
+        '/process-images', content_type='multipart/form-data',
+        data=batch_form([image_upload('streamed.jpg')], batch=3, stream='1')
+    )
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/zip'
+    names = sorted(zipfile.ZipFile(io.BytesIO(resp.get_data())).namelist())
+    assert names == [f'streamed_variant_{i}.jpg' for i in (1, 2, 3)]
+
+    A = app_module
+    with A.app.app_context():
+        assert A.db.session.get(A.User, user_id).tokens == 7
+        rows = A.HistoryItem.query.filter_by(user_id=user_id).all()
+        assert len(rows) == 3
+        reservation = A.TokenReservation.query.filter_by(user_id=user_id).one()
+        assert reservation.status == 'committed'
+
+def test_disconnect_stops_rendering(app_module, make_user, login, monkeypatch):
+    # The client leaves after the first variant: the rest is never rendered,
+    # what was written is removed and the reservation is refunded
+    A = app_module
+    user_id = make_user('leaver@example.com', tokens=10)
+    client = login('leaver@example.com')
+    gate, ended = threading.Event(), threading.Event()
+    written = []
+
+    def slow_logic(images, batch, intensity, opts, out, hist_folder, on_variant, on_hash, plan, variants, settings):
+        try:
+            for i in range(batch):
+                path = os.path.join(hist_folder, f'leaver_variant_{i+1}.jpg')
+                with open(path, 'wb') as f:
+                    f.write(b'variant')
+                written.append(path)
+                on_variant(path)
+                gate.wait(5)
+        finally:
+            ended.set()
+
+    monkeypatch.setattr(A, 'process_images_logic', slow_logic)
+    resp = client.post(
+        '/process-images', content_type='multipart/form-data', buffered=False,
+        data=batch_form([image_upload('leaver.jpg')], batch=5, stream='1')
+    )
+    assert next(iter(resp.response))
+    resp.close()
+    gate.set()
+    assert ended.wait(5)
+
+    assert len(written) == 2
+    # Removed by the render thread once the logic has stopped
+    deadline = time.monotonic() + 5
+    while any(os.path.exists(p) for p in written) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not any(os.path.exists(p) for p in written)
+    with A.app.app_context():
+        assert A.db.session.get(A.User, user_id).tokens == 10
+        assert A.TokenReservation.query.filter_by(user_id=user_id).one().status == 'refunded'
+
+def test_render_failure_after_one_variant_leaves_nothing(app_module, make_user, login, monkeypatch):
+    # One variant streamed, a second written by a render the logic never
+    # reported (a pool chunk finishing late), then the render fails
+    A = app_module
+    user_id = make_user('broken@example.com', tokens=10)
+    client = login('broken@example.com')
+    written = []
+
+    def failing_logic(images, batch, intensity, opts, out, hist_folder, on_variant, on_hash, plan, variants, settings):
+        stem = os.path.splitext(images[0].filename)[0]
+        for i in (1, 2):
+            path = os.path.join(hist_folder, f'{stem}_variant_{i}.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'variant')
+            os.makedirs(thumbs.THUMB_FOLDER, exist_ok=True)
+            with open(thumbs.thumb_path(os.path.basename(path)), 'wb') as f:
+                f.write(b'thumb')
+            written.append(path)
+        on_variant(written[0])
+        on_hash(written[0], 0x1234)
+        raise RuntimeError('render failed')
+
+    monkeypatch.setattr(A, 'process_images_logic', failing_logic)
+    resp = client.post(
+        '/process-images', content_type='multipart/form-data',
+        data=batch_form([image_upload('broken.jpg')], batch=3, stream='1')
+    )
+    with pytest.raises(RuntimeError):
+        resp.get_data()
+
+    assert len(written) == 2
+    for path in written:
+        assert not os.path.exists(path)
+        assert not os.path.exists(thumbs.thumb_path(os.path.basename(path)))
+    with A.app.app_context():
+        assert A.HistoryItem.query.filter_by(user_id=user_id).count() == 0
+        assert A.db.session.get(A.User, user_id).tokens == 10
+        assert A.TokenReservation.query.filter_by(user_id=user_id).one().status == 'refunded'
+    conn = phash._connect()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM variant_hashes WHERE user_id = ?", (user_id,)).fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,60 @@
+# tests/test_tokens.py
+# Token reservations (tokens.py) around a batch
+import os
+import sys
+import subprocess
+import thumbs
+from conftest import ROOT, WORKDIR, image_upload, batch_form
+
+def test_failure_after_rendering_refunds_and_discards(app_module, make_user, login, monkeypatch):
+    A = app_module
+    user_id = make_user('unlucky@example.com', tokens=10)
+    client = login('unlucky@example.com')
+    before = set(os.listdir('static/history'))
+
+    def broken(paths):
+        raise OSError('disk full')
+    monkeypatch.setattr(thumbs, 'make_thumbnails', broken)
+    resp = client.post(
+        '/process-images', content_type='multipart/form-data',
+        data=batch_form([image_upload('unlucky.jpg')], batch=2)
+    )
+    assert resp.status_code == 500
+
+    with A.app.app_context():
+        assert A.db.session.get(A.User, user_id).tokens == 10
+        assert A.TokenReservation.query.filter_by(user_id=user_id).one().status == 'refunded'
+        assert A.HistoryItem.query.filter_by(user_id=user_id).count() == 0
+    assert set(os.listdir('static/history')) == before
+
+STARTED_AS_MAIN = r'''
+import io, os, sys, runpy, flask
+# As `python app.py` does: the script's folder first on the path
+sys.path.insert(0, ROOT)
+from PIL import Image
+from werkzeug.security import generate_password_hash
+flask.Flask.run = lambda self, *args, **kwargs: None
+ns = runpy.run_path(os.path.join(ROOT, 'app.py'), run_name='__main__')
+app, db, User = ns['app'], ns['db'], ns['User']
+with app.app_context():
+    db.create_all()
+    db.session.add(User(email='main@example.com', password=generate_password_hash('pw'), tokens=5))
+    db.session.commit()
+client = app.test_client()
+client.post('/login', data={'email': 'main@example.com', 'password': 'pw'})
+buf = io.BytesIO()
+Image.new('RGB', (64, 48)).save(buf, 'JPEG')
+buf.seek(0)
+resp = client.post('/process-images', content_type='multipart/form-data',
+                   data={'images': [(buf, 'main.jpg')], 'batch_size': '1', 'intensity': '30'})
+print(resp.status_code)
+'''
+
+def test_tokens_work_when_started_as_python_app_py(tmp_path):
+    # `python app.py` runs app as __main__: nothing may import a second copy
+    env = {**os.environ, 'DATABASE_URL': 'sqlite:///' + str(tmp_path / 'main.db')}
+    out = subprocess.run(
+        [sys.executable, '-c', f'ROOT = {ROOT!r}\n' + STARTED_AS_MAIN],
+        cwd=WORKDIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert out.stdout.strip().splitlines()[-1:] == ['200'], out.stderr[-2000:]
@@ -0,0 +1,89 @@
+# thumbs.py
+# Small previews for the history gallery: a downscaled copy of each image
+# variant and a poster frame for each video variant. They are made right
+# after a job renders, or on first request for anything older, and kept on
+# disk in their own folder, which can be wiped at any time.
+import io
+import os
+import sys
+import ffmpeg
+from PIL import Image
+
+THUMB_FOLDER = os.getenv('THUMB_FOLDER', 'thumbs')
+THUMB_SIZE = int(os.getenv('THUMB_SIZE', 320))
+# 'webp' or 'jpeg'
+THUMB_FORMAT = os.getenv('THUMB_FORMAT', 'webp').lower()
+THUMB_QUALITY = int(os.getenv('THUMB_QUALITY', 70))
+# Thumbnail URLs carry the history row id, so a cached copy never goes stale
+THUMB_MAX_AGE = int(os.getenv('THUMB_MAX_AGE', 365 * 24 * 3600))
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+
+def thumb_ext():
+    return '.webp' if THUMB_FORMAT == 'webp' else '.jpg'
+
+def thumb_mimetype():
+    return 'image/webp' if THUMB_FORMAT == 'webp' else 'image/jpeg'
+
+def thumb_path(filename):
+    return os.path.join(THUMB_FOLDER, f"{filename}.{THUMB_SIZE}{thumb_ext()}")
+
+def is_fresh(path, src):
+    # Variants can be re-rendered under the same name; redo the thumbnail then
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(src)
+
+def image_thumbnail(src):
+    with Image.open(src) as img:
+        # JPEG sources decode at 1/2, 1/4 or 1/8 scale when that's enough
+        img.draft('RGB', (THUMB_SIZE, THUMB_SIZE))
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.Resampling.LANCZOS)
+        return img.copy()
+
+def video_thumbnail(src):
+    # First frame, scaled by ffmpeg, handed over as PNG on stdout
+    out, _ = (
+        ffmpeg
+        .input(src)
+        .output(
+            'pipe:', vframes=1, format='image2', vcodec='png',
+            vf=f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease"
+        )
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return Image.open(io.BytesIO(out))
+
+def encode(img):
+    buf = io.BytesIO()
+    if THUMB_FORMAT == 'webp':
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+        img.save(buf, 'WEBP', quality=THUMB_QUALITY, method=4)
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(buf, 'JPEG', quality=THUMB_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+def make_thumbnail(src):
+    # Path of the thumbnail for src, rendering it if missing or outdated
+    path = thumb_path(os.path.basename(src))
+    if is_fresh(path, src):
+        return path
+    if src.lower().endswith(VIDEO_EXTENSIONS):
+        img = video_thumbnail(src)
+    else:
+        img = image_thumbnail(src)
+    os.makedirs(THUMB_FOLDER, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(encode(img))
+    os.replace(tmp, path)
+    return path
+
+def make_thumbnails(paths):
+    # Best effort at render time; whatever fails here is retried on request
+    for p in paths:
+        try:
+            make_thumbnail(p)
+        except Exception as e:
+            print(f"Thumbnail for {p} failed: {e}", file=sys.stderr)
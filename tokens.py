@@ -1,4 +1,7 @@
 # tokens.py
+import datetime
+from sqlalchemy import update
+
 PLAN_TOKEN_AMOUNTS = {'free': 50, 'pro': 1000, 'pro+': 2500}
 TOKEN_COSTS = {'image': 1, 'video': 2}
 
@@ -12,6 +15,58 @@ def deduct_tokens(user, amount, db):
         return True
     return False
 
+# -------------------- Reservations --------------------
+# Tokens are taken when a request is accepted, not after its work is done:
+# reserve_tokens() decrements the balance with one conditional UPDATE, so
+# two concurrent requests can never both spend the same tokens, and the
+# transaction is over before any processing starts. The reservation is then
+# committed when the batch succeeds or refunded if it fails. Like
+# deduct_tokens, these take the db and models from the caller (app.py).
+RESERVED = 'reserved'
+COMMITTED = 'committed'
+REFUNDED = 'refunded'
+
+def reserve_tokens(user_id, amount, db, User, TokenReservation, job_id=None):
+    # Returns the reservation id, or None if the balance doesn't cover amount
+    taken = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.tokens >= amount)
+        .values(tokens=User.tokens - amount)
+    ).rowcount
+    if taken != 1:
+        db.session.rollback()
+        return None
+    reservation = TokenReservation(user_id=user_id, amount=amount, status=RESERVED, job_id=job_id)
+    db.session.add(reservation)
+    db.session.commit()
+    return reservation.id
+
+def settle_reservation(reservation_id, status, db, User, TokenReservation):
+    # Move a reservation out of RESERVED exactly once; False if it already was
+    settled = db.session.execute(
+        update(TokenReservation)
+        .where(TokenReservation.id == reservation_id, TokenReservation.status == RESERVED)
+        .values(status=status, settled_at=datetime.datetime.utcnow())
+    ).rowcount
+    if settled != 1:
+        db.session.rollback()
+        return False
+    if status == REFUNDED:
+        reservation = db.session.get(TokenReservation, reservation_id)
+        db.session.execute(
+            update(User)
+            .where(User.id == reservation.user_id)
+            .values(tokens=User.tokens + reservation.amount)
+        )
+    db.session.commit()
+    return True
+
+def commit_reservation(reservation_id, db, User, TokenReservation):
+    return settle_reservation(reservation_id, COMMITTED, db, User, TokenReservation)
+
+def refund_reservation(reservation_id, db, User, TokenReservation):
+    return settle_reservation(reservation_id, REFUNDED, db, User, TokenReservation)
+
 def reset_user_tokens(user, db):
     user.tokens = get_plan_tokens(user.plan)
     db.session.commit()
@@ -0,0 +1,52 @@
+# uploads.py
+# Multipart uploads go to disk as they arrive: the form parser writes each
+# file in chunks to a temp file under uploads/incoming (never to memory),
+# and saving an upload is a hardlink of that temp file rather than a copy.
+import os
+import tempfile
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+UPLOAD_TMP_FOLDER = os.getenv('UPLOAD_TMP_FOLDER', os.path.join('uploads', 'incoming'))
+# Whole request body, enforced by Flask before parsing starts
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', 4096)) * 1024 * 1024
+# Any single file, enforced while it is being written
+MAX_FILE_BYTES = int(os.getenv('MAX_FILE_MB', 2048)) * 1024 * 1024
+
+class LimitedFile:
+    # Temp file that refuses to grow past MAX_FILE_BYTES
+    def __init__(self, f):
+        self._f = f
+        self._size = 0
+
+    def write(self, b):
+        self._size += len(b)
+        if self._size > MAX_FILE_BYTES:
+            raise RequestEntityTooLarge(f"File is larger than {MAX_FILE_BYTES // (1024 * 1024)} MB")
+        return self._f.write(b)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return iter(self._f)
+
+class DiskRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(UPLOAD_TMP_FOLDER, exist_ok=True)
+        # Removed when the request closes its files; save_upload links it first
+        return LimitedFile(tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_TMP_FOLDER, prefix='upload_'))
+
+def save_upload(f, dst):
+    stream = f.stream
+    name = getattr(stream, 'name', None)
+    if isinstance(name, str) and os.path.exists(name):
+        stream.flush()
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(name, dst)
+            return
+        except OSError:
+            pass
+    f.save(dst)
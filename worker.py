@@ -0,0 +1,21 @@
+# worker.py
+# Runs the processing job pool: `python worker.py`
+# Concurrency is set with JOB_WORKERS, independently of gunicorn's HTTP workers.
+# Previews (preview.py) get their own PREVIEW_WORKERS on a separate queue,
+# polled more often, so they never wait behind full renders.
+# The Drive backup uploader (backups.py) and the disk retention sweeper
+# (retention.py) run here too, one extra process each.
+import os
+from app import app, db, User, HistoryItem
+import jobs
+import backups
+import retention
+import preview
+
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', 1))
+PREVIEW_POLL_INTERVAL = float(os.getenv('PREVIEW_POLL_INTERVAL', 0.05))
+
+if __name__ == '__main__':
+    backups.start_uploader()
+    retention.start_sweeper(app, db, User, HistoryItem)
+    jobs.run_workers(app, pools=[(preview.PREVIEW_QUEUE, PREVIEW_WORKERS, PREVIEW_POLL_INTERVAL)])
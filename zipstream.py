@@ -0,0 +1,53 @@
+# zipstream.py
+# Build a zip on the fly and hand it to the client chunk by chunk, instead of
+# writing the archive to static/processed_zips and serving it afterwards.
+import io
+import os
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+class ZipSink(io.RawIOBase):
+    # Write-only, unseekable file object: buffers what zipfile writes until
+    # drained. zipfile notices it can't seek and uses data descriptors.
+    def __init__(self, tee=None):
+        self.buf = bytearray()
+        self.tee = tee
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buf += b
+        if self.tee is not None:
+            self.tee.write(b)
+        return len(b)
+
+    def drain(self):
+        data = bytes(self.buf)
+        self.buf.clear()
+        return data
+
+def stream_zip(paths, tee=None, arcname=os.path.basename):
+    # paths may be a generator that yields files as they get rendered. JPEG,
+    # PNG and MP4 are already compressed, so entries are stored, not deflated.
+    # tee, if given, receives a copy of the archive bytes (e.g. for a backup);
+    # arcname maps a path to its name inside the archive.
+    sink = ZipSink(tee)
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for path in paths:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname(path))
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data